@@ -2,19 +2,22 @@
 
 import argparse
 import datetime as dt
-from multiprocessing import Pipe, Process
+from multiprocessing import Event, Pipe, Process
 import os
+import socket
 import sys
+import threading
 import time
 
-from botocore.exceptions import ClientError
-import boto3
 from jinja2 import Template
 import numpy as np
 
 import app.config as secrets
 import app.context as ctx
-from app.xtractor import TakeOutExtractor
+from app.notify import flush_notifications, send_email
+from app.retry import retry_stats
+from app.wake import WakeListener
+from app.xtractor import TakeOutExtractor, probe_drive, remove_downloads, sweep_downloads
 
 
 class ArchiveAgent(object):
@@ -84,6 +87,7 @@ class ArchiveAgent(object):
         self.__done.recv()
         self.__agent.join()
         ctx.add_log_entry('agent terminated gracefully')
+        ctx.flush_logs()
 
     def send_digest(self):
         """send the daily digest if one has not already been sent today"""
@@ -96,62 +100,249 @@ class ArchiveAgent(object):
             pass
 
     def __run_agent(self, wait_time, conn, keep_alive, sigkill, done):
-        """code to run on forked agent process"""
-        terminate = False
+        """code to run on forked agent process
 
-        # continue to process until told to terminate
+        Notes: supervises ARCHIVE_AGENT_WORKERS worker processes that claim tasks with leases (see run_worker). Workers
+        that die are replaced if keep_alive is set. The daily digest is sent from here
+        """
+        stop = Event()
+        workers = {}
+
+        try:
+            removed = sweep_downloads(conn)
+            if removed > 0:
+                ctx.add_log_entry(f'removed {removed} stale takeout download files')
+        except Exception as e:
+            ctx.add_log_entry(f'sweeping stale takeout download files failed with <{str(e)}>')
+
+        def spawn(i):
+            worker = Process(
+                name=f'{secrets.ARCHIVE_AGENT_PROC_NAME}-{i}',
+                target=run_worker,
+                args=(conn, stop, wait_time, keep_alive),
+                kwargs={'slot': i}
+            )
+            worker.start()
+            workers[i] = worker
+
+        for i in range(secrets.ARCHIVE_AGENT_WORKERS):
+            spawn(i)
+
+        # continue to supervise until told to terminate
+        terminate = False
         while not terminate:
             try:
-                start = time.time()
-                current_id = np.nan
+                for i, worker in list(workers.items()):
+                    if worker.is_alive():
+                        continue
+
+                    worker.join()
+                    del workers[i]
+
+                    if keep_alive:
+                        ctx.add_log_entry(f'archive agent worker {i} exited with code {worker.exitcode}, restarting')
+                        spawn(i)
+
+                if len(workers) == 0:
+                    ctx.add_log_entry('agent shutting down')
+                    break
+
+                self.send_digest()
+            except Exception as e:
+                ctx.add_log_entry(f'archive agent supervisor failed with <{str(e)}>')
+
+            ctx.flush_logs()
 
-                with ctx.session_scope(conn) as s:
-                    pending = ctx.get_pending(session=s)
+            # check for termination signal (blocking for one second)
+            terminate = sigkill.poll(1)
 
-                    while len(pending) > 0:
-                        p = pending.pop()
+        # workers finish their current task before stopping
+        stop.set()
+        for worker in workers.values():
+            worker.join()
+
+        ctx.flush_logs()
+        done.send(True)
 
-                        current_id = p.internal_id
-                        ctx.add_log_entry(f'starting task', cid=p.internal_id)
 
-                        task = TakeOutExtractor(p).run()
+def run_worker(conn, stop, wait_time, keep_alive=True, extractor=TakeOutExtractor, slot=0):
+    """code to run on an archive agent worker process
+
+    Notes: claims one due consent at a time with a lease (see context.claim_task). While nothing is due the worker
+    sleeps until a new consent wakes it (see app.wake) or wait_time seconds pass, so timed polling only picks up
+    DRIVE_NOT_READY retries and expired leases
+
+    Args:
+        conn: (dict) connection parameters for database
+        stop: (multiprocessing.Event) set to stop the worker once its current task is done
+        wait_time: (int) seconds to wait between polls while no task is due
+        keep_alive: (bool) optional. keep working after a task fails unexpectedly
+        extractor: optional. class run on each claimed consent. default TakeOutExtractor
+        slot: (int) optional. index of the worker among ARCHIVE_AGENT_WORKERS, which picks its wake port
+    """
+    owner = f'{socket.gethostname()}:{os.getpid()}'
+
+    # one query for the row ids of the whole consents table, kept current from then on
+    ctx.load_synapse_index()
 
-                        # make sure all updates have been persisted to backend
-                        ctx.commit(s)
+    listener = WakeListener(ctx.get_engine(ctx.connection(conn)), slot=slot)
+    if not listener.listening:
+        ctx.add_log_entry(f'archive agent worker falling back to timed polling: <{listener.error}>')
 
-                        # final call to update Synapse consents table
-                        task.consent.update_synapse()
+    while not stop.is_set():
+        current_id = np.nan
 
-                # check for termination signal (blocking for one second)
-                terminate = sigkill.poll(1)
+        try:
+            internal_id = ctx.claim_task(owner, conn)
 
-                # figure out how long we need to wait to keep task polling interval
-                if not terminate:
-                    remaining = wait_time - (time.time() - start)
-                    time.sleep(remaining if remaining > 0 else 0)
+            if internal_id is None:
+                # sleep until the next consent is due, a new one wakes the worker, or wait_time passes. wait in short
+                # slices so a stop signal is not held up by a long poll interval
+                due = ctx.next_due_at(conn)
+                if due is not None:
+                    wait = min(wait_time, max((due - dt.datetime.utcnow()).total_seconds(), 1.))
                 else:
-                    pass
+                    wait = wait_time
+
+                deadline = time.time() + wait
+                while not stop.is_set() and time.time() < deadline:
+                    if listener.wait(min(1., deadline - time.time())):
+                        break
+                continue
+
+            current_id = internal_id
+            run_task(internal_id, owner, conn, extractor)
+        except Exception as e:
+            ctx.mark_as_permanently_failed(current_id)
+            ctx.flush_synapse()
+
+            if not np.isnan(current_id):
+                remove_downloads(current_id)
+
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+
+            msg = 'agent terminated unexpectedly: ' + \
+                f'<Type ({exc_type})>; ' + \
+                f'<Args ({", ".join([str(a) for a in e.args])})>; ' + \
+                f'<File ({os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]})>; ' + \
+                f'<LineNo ({exc_tb.tb_lineno})>'\
+
+            ctx.add_log_entry(msg, cid=current_id)
+
+            if not keep_alive:
+                ctx.add_log_entry('agent shutting down')
+                ctx.flush_logs()
+                break
+            else:
+                ctx.add_log_entry('agent restarting')
+                ctx.flush_logs()
+
+    listener.close()
+    flush_notifications()
+    ctx.flush_synapse()
+    ctx.flush_logs()
+
+
+def run_task(internal_id, owner, conn, extractor=TakeOutExtractor):
+    """run one claimed task in a session of its own while a heartbeat thread renews the lease
+
+    Notes: a consent claimed more than TASK_MAX_CLAIMS times without its task finishing is marked as failed instead of
+    run again, so an archive that kills its worker is not retried forever. The worker process is stopped if the lease
+    is lost (see abandon_task)
+
+    Args:
+        internal_id: (int) the claimed consent
+        owner: (str) id of the worker holding the lease
+        conn: (dict) connection parameters for database
+        extractor: optional. class run on the consent. default TakeOutExtractor
+    """
+    retries = {name: stats['retries'] for name, stats in retry_stats().items()}
+    done = threading.Event()
 
-                self.send_digest()
+    def heartbeat():
+        expires = time.time() + secrets.TASK_LEASE_SECONDS
+
+        while not done.wait(secrets.TASK_HEARTBEAT_SECONDS):
+            try:
+                if ctx.renew_lease(internal_id, owner, conn):
+                    expires = time.time() + secrets.TASK_LEASE_SECONDS
+                    continue
+
+                reason = 'task lease lost to another worker'
             except Exception as e:
-                ctx.mark_as_permanently_failed(current_id)
-                exc_type, exc_obj, exc_tb = sys.exc_info()
+                ctx.add_log_entry(f'renewing task lease failed with <{str(e)}>', cid=internal_id)
 
-                msg = 'agent terminated unexpectedly: ' + \
-                    f'<Type ({exc_type})>; ' + \
-                    f'<Args ({", ".join([a for a in e.args])})>; ' + \
-                    f'<File ({os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]})>; ' + \
-                    f'<LineNo ({exc_tb.tb_lineno})>'\
+                if time.time() < expires:
+                    continue
 
-                ctx.add_log_entry(msg, cid=current_id)
+                reason = 'task lease expired before it could be renewed'
 
-                if not keep_alive:
-                    ctx.add_log_entry('agent shutting down')
-                    break
-                else:
-                    ctx.add_log_entry('agent restarting')
+            abandon_task(internal_id, reason)
+            return
 
-        done.send(True)
+    beat = threading.Thread(target=heartbeat, daemon=True)
+    beat.start()
+
+    try:
+        with ctx.session_scope(conn) as s:
+            consent = s.query(ctx.Consent).get(internal_id)
+
+            if (consent.claim_count or 0) > secrets.TASK_MAX_CLAIMS:
+                consent.mark_as_failure(
+                    f'Marked as failed. Task claimed {consent.claim_count} times without finishing.'
+                )
+            elif consent.last_drive_attempt_at is not None and \
+                    consent.seconds_since_consent() > secrets.MAX_TIME_FOR_DRIVE_WAIT:
+                consent.mark_as_failure()
+            elif consent.last_drive_attempt_at is not None and probe_drive(consent) is False:
+                # still nothing in Drive, back off again without building an extractor
+                consent.mark_drive_not_ready()
+                ctx.add_log_entry(f'Google Drive for {consent.study_id} not ready', cid=internal_id)
+            else:
+                ctx.add_log_entry(f'starting task', cid=internal_id)
+                extractor(consent).run()
+
+            # make sure all updates have been persisted to backend, then write the task's log entries. SQLite would
+            # keep the log sink waiting on the updates this session holds
+            consent.release_lease()
+            ctx.commit(s)
+            ctx.flush_logs()
+
+            # final call to update Synapse consents table
+            consent.update_synapse()
+
+            # credentials kept for a later attempt stay encrypted in the db only
+            consent.drop_credential_handle()
+
+            # partial downloads are only kept while a later attempt may resume them
+            if consent.status in (ctx.ConsentStatus.COMPLETE.value, ctx.ConsentStatus.FAILED.value):
+                remove_downloads(internal_id)
+    finally:
+        done.set()
+        beat.join()
+
+    ctx.flush_synapse()
+
+    # report how hard the worker had to retry Synapse and Google for this task
+    stats = retry_stats()
+    if any([stats[name]['retries'] > n for name, n in retries.items()]):
+        ctx.add_log_entry(f'retries so far <{stats}>', cid=internal_id)
+
+
+def abandon_task(internal_id, reason):
+    """stop the worker process running a task whose lease it no longer holds
+
+    Notes: another worker may already be running the task, so the process exits at once without touching the consent
+    or its downloads. The supervisor starts a new worker in its place
+
+    Args:
+        internal_id: (int) the consent of the task
+        reason: (str) logged with the consent
+    """
+    ctx.add_log_entry(f'{reason}, stopping the worker', cid=internal_id)
+    ctx.flush_logs()
+
+    os._exit(1)
 
 
 def get_wait_time_from_env():
@@ -173,34 +364,10 @@ def get_wait_time_from_env():
 
 def send_daily_digest(conn=None):
     """send the daily digest email"""
-    try:
-        digest = ctx.daily_digest(conn)
-        template = Template(secrets.DIGEST_TEMPLATE)
-
-        client = boto3.client('ses', region_name=secrets.REGION_NAME)
-        response = client.send_email(
-            Source=secrets.FROM_STUDY_EMAIL,
-            Destination={
-                'ToAddresses': secrets.ADMIN_EMAILS
-            },
-            Message={
-                'Subject': {
-                    'Data': secrets.DIGEST_SUBJECT.format(today=digest['today']),
-                    'Charset': secrets.CHARSET
-                },
-                'Body': {
-                    'Html': {
-                        'Data': template.render(x=digest),
-                        'Charset': secrets.CHARSET
-                    }
-                }
-            },
-            ReplyToAddresses=[secrets.FROM_STUDY_EMAIL]
-        )
-    except ClientError as e:
-        raise Exception(f'email failed with <{str(e.response["Error"]["Message"])}>')
-    else:
-        return response
+    digest = ctx.daily_digest(conn)
+    template = Template(secrets.DIGEST_TEMPLATE)
+
+    return send_email(secrets.DIGEST_SUBJECT.format(today=digest['today']), template.render(x=digest))
 
 
 def main():
@@ -27,9 +27,34 @@ CONSENTS_SYNID = ''
 """how many times to retry an interaction with Synapse if a failure is exprienced"""
 SYNAPSE_RETRIES = 0
 
+"""most attempts per call to Google (Drive and DLP) when connection, 5xx, or 429 errors occur"""
+RETRY_ATTEMPTS = 5
+
+"""seconds before the first retry. the wait is a random time up to this doubled on every retry"""
+RETRY_BASE_DELAY = 1.
+
+"""longest wait in seconds between retries, including waits asked for with Retry-After"""
+RETRY_MAX_DELAY = 60.
+
+"""retries allowed per call across a process, plus RETRY_BUDGET_MIN, before retrying stops"""
+RETRY_BUDGET_RATIO = .2
+RETRY_BUDGET_MIN = 10
+
+"""flush staged consents table updates this many milliseconds after the first one. 0 only flushes per agent cycle"""
+SYNAPSE_FLUSH_INTERVAL_MS = 30000
+
+"""log entries written to the database per batch. the log is written sooner if this many are waiting"""
+LOG_BATCH_SIZE = 200
+
+"""write buffered log entries this many milliseconds after the first one. 0 only writes on size and flush_logs"""
+LOG_FLUSH_INTERVAL_MS = 2000
+
 """naming convention for location files"""
 SYNAPSE_LOCATION_NAMING_CONVENTION = ''
 
+"""naming convention for the optional location activity files"""
+SYNAPSE_ACTIVITY_NAMING_CONVENTION = ''
+
 """naming convention for search files"""
 SYNAPSE_SEARCH_NAMING_CONVENTION = ''
 
@@ -73,20 +98,83 @@ ARCHIVE_AGENT_PROC_NAME = ''
 """where one beanstalk-ec2 instance to store tmp files for data processing"""
 ARCHIVE_AGENT_TMP_DIR = ''
 
+"""consent submissions the web server holds while they are written to the database. more are refused with a 503"""
+SUBMISSION_QUEUE_SIZE = 100
+
+"""threads per web server process writing consent submissions to the database"""
+SUBMISSION_WORKERS = 2
+
+"""seconds a client refused with a 503 is asked to wait before submitting again"""
+SUBMISSION_RETRY_AFTER = 5
+
+"""seconds a stopping web server process waits for queued consent submissions to be written"""
+SUBMISSION_DRAIN_TIMEOUT = 10
+
+"""consents per multi-row insert when bulk importing consents. see app/ingest.py"""
+INGEST_BATCH_SIZE = 1000
+
+"""processes encrypting credentials when bulk importing consents"""
+INGEST_WORKERS = 4
+
+"""number of archive agent worker processes claiming and running tasks concurrently"""
+ARCHIVE_AGENT_WORKERS = 2
+
+"""seconds a worker holds a task without a heartbeat before other workers may reclaim it"""
+TASK_LEASE_SECONDS = 600
+
+"""seconds between lease renewals of a running task. keep well below TASK_LEASE_SECONDS"""
+TASK_HEARTBEAT_SECONDS = 120
+
+"""times a consent may be claimed without its task finishing, e.g. its worker was killed, before it is failed"""
+TASK_MAX_CLAIMS = 3
+
+"""Postgres channel used to wake archive agent workers as soon as a consent is added"""
+WAKE_CHANNEL = 'gtap_tasks'
+
+"""local ports from WAKE_PORT on, one per archive agent worker, used to wake workers when the db is not Postgres"""
+WAKE_PORT = 47653
+
 """how long to wait between Google Drive queries if the last attempt was not ready. (seconds)"""
 WAIT_TIME_BETWEEN_DRIVE_NOT_READY = 0
 
+"""growth of the wait between Google Drive queries after every attempt that was not ready"""
+DRIVE_BACKOFF_FACTOR = 2
+
 """maximum time for DRIVE attempts. (seconds)"""
 MAX_TIME_FOR_DRIVE_WAIT = 0
 
+"""bytes per chunk when streaming a takeout archive from Google Drive to ARCHIVE_AGENT_TMP_DIR"""
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+"""archives smaller than this many bytes are held in memory, anything larger is streamed to disk"""
+DOWNLOAD_MEMORY_CEILING = 64 * 1024 * 1024
+
+"""bytes per HTTP range request when downloading a takeout archive in parts"""
+DOWNLOAD_RANGE_SIZE = 64 * 1024 * 1024
+
+"""number of range requests to run concurrently for one takeout archive"""
+DOWNLOAD_WORKERS = 4
+
+"""number of parts of a multi-part takeout export to download concurrently"""
+DOWNLOAD_PARTS = 2
+
+"""number of threads parsing downloaded takeout parts while the remaining parts download"""
+EXTRACTION_WORKERS = 2
+
 """working directory on the beanstalk-ec2 instance"""
 WORKING_DIR = ''
 
 """Takeout URL query"""
 TAKEOUT_URL = ''
 
-"""number of threads to consume on the beanstaalk-ec2 instance for cleaning"""
-CLEANING_THREADS = 0
+"""number of location records parsed and written per batch. bounds memory used by location extraction"""
+LOCATION_BATCH_SIZE = 100000
+
+"""largest "My Activity" html block in characters to buffer. longer blocks are counted as parse errors"""
+SEARCH_HTML_MAX_BLOCK = 1024 * 1024
+
+"""also upload the long table of every location activity sample and its confidence"""
+LOCATION_ACTIVITY_DETAIL = False
 
 """the Postgres database connection for logging and task management"""
 DATABASE = {
@@ -98,6 +186,18 @@ DATABASE = {
     'database': ''
 }
 
+"""connections kept open per process in the database connection pool (Postgres only)"""
+DB_POOL_SIZE = 5
+
+"""extra connections opened past DB_POOL_SIZE under load and closed when returned (Postgres only)"""
+DB_MAX_OVERFLOW = 10
+
+"""test pooled connections before use so connections dropped by the server are replaced transparently"""
+DB_POOL_PRE_PING = True
+
+"""seconds after which a pooled connection is replaced. -1 keeps connections indefinitely"""
+DB_POOL_RECYCLE = 1800
+
 # ----------------------------------------------------------------------------------------------------------------------
 # Data Loss Prevention
 """set the environment variable for google-cloud-dlp access"""
@@ -118,6 +218,32 @@ DLP_INSPECT_CONFIG = {
     'include_quote': True
 }
 
+"""most DLP inspect requests per second across all concurrent requests"""
+DLP_QPS = 10
+
+"""number of DLP inspect requests to run concurrently"""
+DLP_WORKERS = 4
+
+"""payload budget in bytes for one DLP inspect request. DLP rejects requests over 0.5 MB"""
+DLP_MAX_REQUEST_BYTES = 400000
+
+"""most search queries (table rows) in one DLP inspect request"""
+DLP_MAX_REQUEST_ROWS = 10000
+
+"""tokens that make a search query safe to skip DLP when the query is made of nothing else"""
+DLP_SAFE_TOKENS = [
+    'weather', 'facebook', 'youtube', 'google', 'amazon', 'netflix', 'news', 'maps', 'gmail', 'twitter'
+]
+
+"""salt mixed into the hash of every query in the DLP verdict cache"""
+DLP_CACHE_SALT = b''
+
+"""seconds a cached DLP verdict stays valid"""
+DLP_CACHE_TTL = 30 * 24 * 3600
+
+"""most verdicts to keep in the DLP verdict cache. least recently used verdicts are evicted first"""
+DLP_CACHE_MAX_ENTRIES = 1000000
+
 # ----------------------------------------------------------------------------------------------------------------------
 # Google OAUTH
 GOOGLE_OAUTH2_CLIENT_ID = ''
@@ -146,12 +272,24 @@ PARTICIPANT_EMAIL_BODY = """
 
 """
 
+"""collect completion emails to admins for this many minutes and send them as one summary. 0 sends each at once"""
+NOTIFY_BATCH_MINUTES = 0
+
+"""subject line for the summary of completion emails. {n} is the number of consents in it"""
+NOTIFY_BATCH_SUBJECT = '{n} consents processed'
+
 """emails to receive daily digests"""
 ADMIN_EMAILS = []
 
 """subject line for daily digest email to admins"""
 DIGEST_SUBJECT = ''
 
+"""most consents listed with their details in the daily digest. counts always cover every consent"""
+DIGEST_MAX_CONSENTS = 100
+
+"""most recent log entries listed per consent in the daily digest"""
+DIGEST_MAX_NOTES = 20
+
 """Jinja template for daily digest email body"""
 DIGEST_TEMPLATE = """
 
@@ -1,31 +1,34 @@
+import atexit
 from contextlib import contextmanager
 import datetime as dt
 from enum import Enum
+import hashlib
 import json
+import os
 from pytz import timezone as tz
-from ssl import SSLError
 import sys
-import time
+from threading import Lock, Timer
 
-from botocore.exceptions import ClientError
-import boto3
 from flask_simple_crypt import SimpleCrypt
 from jinja2 import Template
 import numpy as np
-from sqlalchemy import and_, or_, cast, \
+from sqlalchemy import and_, or_, case, func, event, \
     create_engine, inspect, Column, Integer, LargeBinary, \
     String, Date, DateTime, Index, ForeignKey
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.engine.url import URL
-from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.exc import DisconnectionError, IntegrityError, OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import sessionmaker, relationship
 import synapseclient
 from synapseclient import Schema, Table
 from synapseclient import Column as SynColumn
-from synapseclient.exceptions import SynapseHTTPError
 
 import app.config as secrets
+from app.synapse_sync import WriteBehindBuffer
+from app.notify import NOTIFICATIONS, send_email
+import app.wake as wake
 
 syn = secrets.syn
 
@@ -48,6 +51,22 @@ SYN_SCHEMA = Schema(
 )
 BLANK_CONSENT = ('blank', 0, 'blank', 'blank', 'blank', 'blank')
 
+"""collapses Consent.update_synapse calls into bulk writes. see flush_synapse"""
+SYNAPSE_BUFFER = WriteBehindBuffer(syn, secrets.CONSENTS_SYNID, flush_interval_ms=secrets.SYNAPSE_FLUSH_INTERVAL_MS)
+
+"""hit and miss counts for the DLP verdict cache in this process"""
+DLP_CACHE_STATS = {'hits': 0, 'misses': 0}
+
+"""number of keys per IN clause when reading or writing the DLP verdict cache"""
+DLP_CACHE_QUERY_SIZE = 500
+
+"""process-wide (engine, sessionmaker) per database connection. see get_engine"""
+ENGINES = {}
+ENGINES_LOCK = Lock()
+
+"""pools inherited from a parent process. kept referenced so garbage collection never closes the parent's sockets"""
+INHERITED_POOLS = []
+
 
 class AppWrap(object):
     """a class used to wrap the application configuration options required to initialize the encryption cypher"""
@@ -62,6 +81,73 @@ cypher = SimpleCrypt()
 cypher.init_app(AppWrap(secrets))
 
 
+def encrypt_credentials(data):
+    """encrypt oauth contents as stored in Consent.data"""
+    s = json.dumps(data)
+    s = s.encode('utf-8')
+
+    msg = cypher.encrypt(s)
+
+    return msg
+
+
+class CredentialHandle(object):
+    """class for holding a consent's decrypted oauth credentials for the length of a task
+
+    Notes: the cypher's key expansion makes every decrypt expensive, so a handle decrypts once and parses once. clear
+    zeroes the handle's copy of the decrypted bytes and drops the parsed values. the bytes the cypher returns, and
+    strings parsed from them, are immutable and are only dropped, never zeroed, so their memory lasts until it is
+    reused
+    """
+
+    def __init__(self, data):
+        """constructor
+
+        Args:
+            data: (bytes) encrypted credentials as stored in Consent.data
+        """
+        self.__plain = bytearray(cypher.decrypt(data))
+        self.__credentials = None
+        self.__fields = None
+
+    def __repr__(self):
+        return f'<CredentialHandle(cleared={self.cleared})>'
+
+    @property
+    def cleared(self):
+        return self.__plain is None
+
+    @property
+    def credentials(self):
+        """the credentials as Consent.credentials has always returned them"""
+        if self.cleared:
+            raise ValueError('credentials have been cleared')
+
+        if self.__credentials is None:
+            self.__credentials = json.loads(self.__plain.decode('utf-8'))
+
+        return self.__credentials
+
+    @property
+    def fields(self):
+        """the oauth fields as a dict. credentials stored as a JSON string are parsed once more"""
+        if self.__fields is None:
+            x = self.credentials
+            self.__fields = json.loads(x) if isinstance(x, str) else x
+
+        return self.__fields
+
+    def clear(self):
+        """zero the handle's copy of the decrypted bytes and drop everything parsed from them"""
+        if self.__plain is not None:
+            for i in range(len(self.__plain)):
+                self.__plain[i] = 0
+
+        self.__plain = None
+        self.__credentials = None
+        self.__fields = None
+
+
 class StringArray(String):
     """a class used to manage an array of strings, representing them as a single"""
     def __init__(self, s='', delimiter=', '):
@@ -135,10 +221,24 @@ class Consent(Base):
     search_sid = Column(String)
     status = Column(String)
 
+    # scheduling metadata so polling never has to read logs. times are utc
+    last_drive_attempt_at = Column(DateTime)
+    attempt_count = Column(Integer, default=0)
+    next_eligible_at = Column(DateTime)
+
+    # the archive agent worker running this consent and when its lease runs out unless renewed. times are utc
+    lease_owner = Column(String)
+    lease_expires_at = Column(DateTime)
+
+    # claims since a worker last finished this consent. a worker that dies mid-task never releases its claim
+    claim_count = Column(Integer, default=0)
+
     logs = relationship("LogEntry")
 
-    Index('idx_iid', 'iid')
-    Index('idx_dt', 'consent_dt')
+    __table_args__ = (
+        Index('idx_consent_status_eligible', 'status', 'next_eligible_at'),
+        Index('idx_consent_dt', 'consent_dt'),
+    )
 
     def __init__(self, **kwargs):
         self.study_id = kwargs['study_id']
@@ -155,6 +255,10 @@ class Consent(Base):
         self.first_name = kwargs.get('first_name')
         self.last_name = kwargs.get('last_name')
 
+        self.attempt_count = 0
+        self.next_eligible_at = None
+        self.claim_count = 0
+
     def __repr__(self):
         return "<Consent(internal_id='%s', consentDateTime='%s')>" % (
             f'{self.internal_id}',
@@ -175,14 +279,29 @@ class Consent(Base):
 
     @property
     def credentials(self):
-        """decrypt oauth credentials"""
+        """decrypt oauth credentials
+
+        Notes: decrypted once per consent object and held in a CredentialHandle until clear_credentials
+        """
+        return self.credential_handle.credentials
+
+    @property
+    def credential_fields(self):
+        """decrypted oauth credentials as a dict"""
+        return self.credential_handle.fields
+
+    @property
+    def credential_handle(self):
+        """the CredentialHandle holding this consent's decrypted credentials"""
         if self.data is None:
             raise ValueError('credentials do not exist for participant')
 
-        s = cypher.decrypt(self.data)
-        s = s.decode('utf-8')
+        handle = getattr(self, '_credential_handle', None)
+        if handle is None or handle.cleared:
+            handle = CredentialHandle(self.data)
+            self._credential_handle = handle
 
-        return json.loads(s)
+        return handle
 
     @property
     def dict(self):
@@ -196,7 +315,7 @@ class Consent(Base):
             'consent_dt': self.consent_dt,
             'location_sid': self.location_sid,
             'search_sid': self.search_sid,
-            'notes': [l.dict for l in sorted(self.logs)],
+            'notes': [l.dict for l in sorted(self.log_entries)],
             'status': self.status
         }
 
@@ -208,6 +327,16 @@ class Consent(Base):
     def hours_since_consent(self):
         return np.ceil((dt.datetime.now()-self.consent_dt).seconds/3600)
 
+    @property
+    def log_entries(self):
+        """log entries of this consent, including ones still waiting in the log sink"""
+        pending = LOG_SINK.pending(self.internal_id)
+        logs = list(self.logs)
+
+        # an entry written by a flush after pending was read is in both
+        written = set([(l.ts, l.msg) for l in logs])
+        return logs + [e for e in pending if (e.ts, e.msg) not in written]
+
     @property
     def last_modified(self):
         """timestamp from latest log entry or consent submission if none exist"""
@@ -217,12 +346,7 @@ class Consent(Base):
     @staticmethod
     def __encrypt(data):
         """private method used to encrypt oauth contents"""
-        s = json.dumps(data)
-        s = s.encode('utf-8')
-
-        msg = cypher.encrypt(s)
-
-        return msg
+        return encrypt_credentials(data)
 
     def add_search_error(self, msg=None, session=None):
         """add search data related error
@@ -297,7 +421,9 @@ class Consent(Base):
         return self
 
     def clear_credentials(self):
-        """delete credentials from the db and update synapse"""
+        """delete credentials from the db and update synapse. the CredentialHandle in memory is cleared"""
+        self.drop_credential_handle()
+
         if self.data is None:
             return
 
@@ -309,6 +435,13 @@ class Consent(Base):
         add_log_entry(f'credentials cleared', self.internal_id)
         self.update_synapse()
 
+    def drop_credential_handle(self):
+        """clear the CredentialHandle holding decrypted credentials in memory. credentials in the db are kept"""
+        handle = getattr(self, '_credential_handle', None)
+        if handle is not None:
+            handle.clear()
+            self._credential_handle = None
+
     def latest_archive_transactions(self, n=-1):
         """get the latest n log messages for this consent, sorted by decreasing timestamp
 
@@ -318,7 +451,7 @@ class Consent(Base):
         Returns:
             [context.LogEntry,]
         """
-        logs = sorted(self.logs, key=lambda x: x.ts, reverse=True)
+        logs = sorted(self.log_entries, key=lambda x: x.ts, reverse=True)
 
         if logs is not None and len(logs) > 0:
             n = n if -1 < n <= len(logs) else len(logs)
@@ -350,6 +483,38 @@ class Consent(Base):
 
         self.update_synapse()
 
+    def mark_drive_not_ready(self):
+        """record a Google Drive attempt that found no takeout data and schedule the next one
+
+        Notes: the wait starts at WAIT_TIME_BETWEEN_DRIVE_NOT_READY seconds and grows by DRIVE_BACKOFF_FACTOR after
+        every attempt, but never past MAX_TIME_FOR_DRIVE_WAIT after consent so the last attempt lands on the deadline.
+        consent_dt is in TIMEZONE and converted to utc like next_eligible_at
+        """
+        now = dt.datetime.utcnow()
+
+        self.last_drive_attempt_at = now
+        self.attempt_count = (self.attempt_count or 0) + 1
+
+        consent_dt = self.consent_dt
+        if consent_dt.tzinfo is None:
+            consent_dt = tz(secrets.TIMEZONE).localize(consent_dt)
+        consent_dt = consent_dt.astimezone(tz('utc')).replace(tzinfo=None)
+
+        wait = secrets.WAIT_TIME_BETWEEN_DRIVE_NOT_READY * secrets.DRIVE_BACKOFF_FACTOR ** (self.attempt_count - 1)
+        deadline = consent_dt + dt.timedelta(seconds=secrets.MAX_TIME_FOR_DRIVE_WAIT)
+
+        self.next_eligible_at = max(
+            min(now + dt.timedelta(seconds=wait), deadline),
+            now + dt.timedelta(seconds=secrets.WAIT_TIME_BETWEEN_DRIVE_NOT_READY)
+        )
+        self.set_status(ConsentStatus.DRIVE_NOT_READY)
+
+    def release_lease(self):
+        """give up the worker lease on this consent after finishing its task. the caller commits"""
+        self.lease_owner = None
+        self.lease_expires_at = None
+        self.claim_count = 0
+
     def notes(self, n=-1):
         """build combined message of log entries
 
@@ -392,72 +557,54 @@ class Consent(Base):
     def notify_admins(self):
         """send email to admins with log messages
 
-        Notes: sends to email addresses ADMIN_EMAILS defined in application config
+        Notes: sends to email addresses ADMIN_EMAILS defined in application config. If NOTIFY_BATCH_MINUTES is above
+        zero the notification is queued and sent with others in one summary email instead
+
         Returns:
-            dict - AWS Simple Email Service response
+            dict - AWS Simple Email Service response, or None if the notification was queued
         """
-        try:
-            x = dict(
-                study_id=self.study_id,
-                logs=[str(log) for log in sorted(self.logs, reverse=True)]
-            )
-            template = Template(secrets.PARTICIPANT_EMAIL_BODY)
-
-            client = boto3.client('ses', 
-                    aws_access_key_id=secrets.AWS_ACCESS_KEY_ID,
-                    aws_secret_access_key=secrets.AWS_SECRET_ACCESS_KEY,
-                    region_name=secrets.REGION_NAME)
-            
-            response = client.send_email(
-                Source=secrets.FROM_STUDY_EMAIL,
-                Destination={
-                    'ToAddresses': secrets.ADMIN_EMAILS
-                },
-                Message={
-                    'Subject': {
-                        'Data': secrets.PARTICIPANT_EMAIL_SUBJECT,
-                        'Charset': secrets.CHARSET
-                    },
-                    'Body': {
-                        'Html': {
-                            'Data': template.render(x=x),
-                            'Charset': secrets.CHARSET
-                        }
-                    }
-                },
-                ReplyToAddresses=[secrets.FROM_STUDY_EMAIL]
-            )
-        except ClientError as e:
-            raise Exception(f'email failed with <{str(e.response["Error"]["Message"])}>')
-        else:
-            return response
+        x = dict(
+            study_id=self.study_id,
+            logs=[str(log) for log in sorted(self.log_entries, reverse=True)]
+        )
+
+        if secrets.NOTIFY_BATCH_MINUTES > 0:
+            NOTIFICATIONS.add(x)
+            return None
+
+        template = Template(secrets.PARTICIPANT_EMAIL_BODY)
+        return send_email(secrets.PARTICIPANT_EMAIL_SUBJECT, template.render(x=x))
 
     def put_to_synapse(self):
-        """generate a new row in Synapse table for this consent"""
+        """generate a new row in Synapse table for this consent
+
+        Notes: the row is staged in the Synapse write-behind buffer and written on the next flush_synapse
+        """
         if self.internal_id is None:
             return
 
-        data = [[
+        SYNAPSE_BUFFER.stage(self.synapse_row)
+
+    @property
+    def synapse_row(self):
+        """the Synapse consents table row for this consent, in SYN_SCHEMA order"""
+        return [
             self.study_id,
             self.internal_id,
             self.consent_dt.strftime(secrets.DTFORMAT).upper(),
             self.location_sid,
             self.search_sid,
             self.notes()
-        ]]
-        self.__syn_store(data)
+        ]
 
     def seconds_since_last_drive_attempt(self):
         """seconds since the latest attempt to query Google Drive"
-        
+
         Returns:
             int - seconds since latest attempt or maxint if no attempt has been made
         """""
-        logs = sorted(self.logs, key=lambda x: x.ts)
-        logs = [l for l in logs if 'Google Drive' in l.msg and 'not ready' in l.msg]
-
-        if len(logs) > 0:
-            return (dt.datetime.now(tz('utc')) - tz('utc').localize(logs[-1].ts)).total_seconds()
+        if self.last_drive_attempt_at is not None:
+            return (dt.datetime.utcnow() - self.last_drive_attempt_at).total_seconds()
         else:
             return sys.maxsize
 
@@ -479,7 +626,7 @@ class Consent(Base):
         if self.location_sid is None:
             self.location_sid = str(StringArray(sid))
         else:
-            self.location_sid = str(StringArray(self.search_sid).merge(sid))
+            self.location_sid = str(StringArray(self.location_sid).merge(sid))
 
         session = inspect(self).session
         commit(session)
@@ -514,57 +661,16 @@ class Consent(Base):
         self.status = status.value
         self.update_synapse()
 
-    def __syn_store(self, data):
-        """store data to Synapse
-
-        Notes: Synapse frequently encounters SSL and other connection errors. This method will retry the push however
-        many times are defined in the application config setting SYNAPSE_RETRIES. Sleeps three seconds between attempts
-
-        Args:
-            data: (dict) should match SYN_SCHEMA defined above
-
-        Returns:
-            None
-        """
-        retries = secrets.SYNAPSE_RETRIES
-
-        while retries > 0:
-            try:
-                syn.store(Table(SYN_SCHEMA, data))
-                retries = 0
-            except SSLError:
-                pass
-            except SynapseHTTPError:
-                pass
-            except Exception as e:
-                add_log_entry(f'consent failed to push to Synapse with <{str(e)}>', self.internal_id)
-                retries = 0
-
-            retries -= 1
-            time.sleep(3)
-
     def update_synapse(self):
         """update an existing Synapse row for this consent
 
-        Notes: will create a new row if a matching is not found
+        Notes: will create a new row if a matching is not found. The latest state of the consent is staged in the
+        Synapse write-behind buffer, so repeated updates collapse into one write on the next flush_synapse
 
         Returns:
             None
         """
-        results = syn.tableQuery(
-            f"select * from {secrets.CONSENTS_SYNID} "
-            f"where study_id='{self.study_id}'"
-            f"  and internal_id='{self.internal_id}'"
-        ).asDataFrame()
-
-        if len(results) == 0:
-            self.put_to_synapse()
-        else:
-            results['location_sid'] = self.location_sid
-            results['search_sid'] = self.search_sid
-            results['notes'] = self.notes()
-
-            self.__syn_store(results)
+        self.put_to_synapse()
 
 
 class LogEntry(Base):
@@ -576,8 +682,13 @@ class LogEntry(Base):
     ts = Column(DateTime)
     msg = Column(String)
 
+    __table_args__ = (
+        Index('idx_log_cid_ts', 'cid', 'ts'),
+    )
+
     def __init__(self, msg, cid=None):
-        self.ts = dt.datetime.now(tz(secrets.TIMEZONE))
+        # local time without tzinfo, as timestamps come back from the database
+        self.ts = dt.datetime.now(tz(secrets.TIMEZONE)).replace(tzinfo=None)
         self.cid = cid
         self.msg = msg
 
@@ -612,22 +723,135 @@ class LogEntry(Base):
     def __contains__(self, item):
         return item in self.msg
 
+
+class DlpVerdict(Base):
+    """datatype used to cache DLP verdicts for search queries across participants
+
+    Notes: queries are never stored. The key is a salted hash of the normalized query and the DLP inspect config
+    fingerprint, so a change to DLP_INSPECT_CONFIG starts a fresh set of verdicts. A verdict with no info_type means
+    DLP found nothing in the query
+    """
+    __tablename__ = 'dlp_verdict'
+
+    key = Column(String(64), primary_key=True)
+    info_type = Column(String)
+    likelihood = Column(Integer)
+    created = Column(DateTime)
+    last_used = Column(DateTime, index=True)
+
+    def __repr__(self):
+        return f'<DlpVerdict(key={self.key}, info_type={self.info_type}, likelihood={self.likelihood})>'
+
+
+class DigestSummary(Base):
+    """datatype used to keep the daily digest counts of each day for week and month rollups"""
+    __tablename__ = 'digest_summary'
+
+    day = Column(Date, primary_key=True)
+    consents_added = Column(Integer)
+    searches = Column(Integer)
+    locations = Column(Integer)
+    updated = Column(DateTime)
+
+    def __repr__(self):
+        return f'<DigestSummary(day={self.day}, consents_added={self.consents_added})>'
+
     
 # ----------------------------------------------------------------------------------------------------------------------
 # Database Context
 # ----------------------------------------------------------------------------------------------------------------------
+def engine_key(conn):
+    """a hashable key for database connection parameters"""
+    return json.dumps(conn, sort_keys=True, default=str)
+
+
 def get_engine(conn):
+    """get the DB engine as defined in the application config
+
+    Notes: one engine, and so one connection pool, is built per connection per process and reused from then on. Pool
+    size, pre-ping, and recycle come from the DB_POOL_* application config
+
+    Returns:
+        sqlalchemy.engine.Engine
+    """
+    return registered(conn)[0]
+
+
+def registered(conn):
+    """the (engine, sessionmaker) registered for a database connection, building them on first use"""
+    key = engine_key(conn)
+
+    with ENGINES_LOCK:
+        if key not in ENGINES:
+            engine = build_engine(conn)
+            ENGINES[key] = (engine, sessionmaker(bind=engine))
+
+        return ENGINES[key]
+
+
+def build_engine(conn):
     """generate a DB engine as defined in the application config"""
     driver = conn['drivername']
+    kwargs = dict(
+        pool_pre_ping=secrets.DB_POOL_PRE_PING,
+        pool_recycle=secrets.DB_POOL_RECYCLE
+    )
 
     if driver == 'sqlite':
         args = f'sqlite+pysqlite:///{conn["path"]}'
     elif driver == 'postgres':
         args = URL(**conn)
+
+        # batch mode sends executemany (e.g. bulk log inserts) as a few round trips instead of one per row
+        kwargs.update(pool_size=secrets.DB_POOL_SIZE, max_overflow=secrets.DB_MAX_OVERFLOW, use_batch_mode=True)
     else:
         raise Exception('driver undefined')
 
-    return create_engine(args)
+    engine = create_engine(args, **kwargs)
+    guard_pool(engine)
+
+    return engine
+
+
+def guard_pool(engine):
+    """never hand a pooled connection to a process other than the one that opened it
+
+    Notes: sqlalchemy's recipe for pools used with multiprocessing. a connection checked out in the wrong process is
+    detached without being closed and replaced with a new one
+    """
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info['pid'] != os.getpid():
+            connection_record.connection = connection_proxy.connection = None
+            raise DisconnectionError(
+                f'connection record belongs to pid {connection_record.info["pid"]}, '
+                f'attempting to check out in pid {os.getpid()}'
+            )
+
+
+def reset_engines_after_fork():
+    """give a forked process (e.g. the archive agent) fresh connection pools
+
+    Notes: the inherited pools are swapped out rather than disposed. disposing them would close sockets the parent
+    process is still using
+    """
+    global ENGINES_LOCK
+    ENGINES_LOCK = Lock()
+
+    for engine, maker in ENGINES.values():
+        INHERITED_POOLS.append(engine.pool)
+        engine.pool = engine.pool.recreate()
+
+
+# python < 3.7 has no fork hooks; guard_pool still keeps inherited connections out of the child
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_engines_after_fork)
+    os.register_at_fork(after_in_child=lambda: LOG_SINK.after_fork())
+    os.register_at_fork(after_in_child=lambda: SYNAPSE_BUFFER.after_fork())
 
 
 def connection(conn):
@@ -650,8 +874,8 @@ def session_scope(conn):
         None
     """
     conn = connection(conn)
-    engine = get_engine(conn)
-    session = sessionmaker(bind=engine)()
+    engine, maker = registered(conn)
+    session = maker()
 
     try:
         yield session
@@ -665,10 +889,163 @@ def session_scope(conn):
         session.close()
 
 
+class LogSink(object):
+    """class for collecting log entries in memory and writing them to the database in bulk"""
+
+    def __init__(self, conn=None, max_entries=200, flush_interval_ms=0):
+        """constructor
+
+        Notes: entries are written in one executemany insert when max_entries are waiting, flush_interval_ms after the
+        first one is added if it is above zero, or when flush is called. Call flush_logs at the end of every task and
+        on every shutdown or crash path
+
+        Args:
+            conn: (dict) optional DB connection. will use application config if not provided
+            max_entries: (int) optional. write once this many entries are waiting
+            flush_interval_ms: (int) optional. write this long after the first entry is added. 0 waits for flush
+        """
+        self.conn = conn
+        self.max_entries = max_entries
+        self.flush_interval_ms = flush_interval_ms
+
+        self.__pending = []
+        self.__lock = Lock()
+        self.__timer = None
+
+    def __repr__(self):
+        return f'<LogSink(pending={len(self)})>'
+
+    def __len__(self):
+        return len(self.__pending)
+
+    def add(self, entry):
+        """buffer a log entry
+
+        Args:
+            entry: (LogEntry)
+        """
+        with self.__lock:
+            self.__pending.append(entry)
+            full = len(self.__pending) >= self.max_entries
+
+            if not full and self.flush_interval_ms > 0 and self.__timer is None:
+                self.__timer = Timer(self.flush_interval_ms / 1000., self.flush)
+                self.__timer.daemon = True
+                self.__timer.start()
+
+        if full:
+            self.flush()
+
+    def pending(self, cid):
+        """log entries of a consent that have not been written yet"""
+        with self.__lock:
+            return [e for e in self.__pending if e.cid == cid]
+
+    def flush(self):
+        """write every buffered log entry in one bulk insert
+
+        Notes: entries that fail to write are put back in front of any added since
+
+        Returns:
+            (int) number of entries written
+        """
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+
+            entries, self.__pending = self.__pending, []
+
+        if len(entries) == 0:
+            return 0
+
+        try:
+            with session_scope(self.conn) as s:
+                s.bulk_insert_mappings(LogEntry, [{'ts': e.ts, 'cid': e.cid, 'msg': e.msg} for e in entries])
+        except Exception:
+            with self.__lock:
+                self.__pending = entries + self.__pending
+            raise
+
+        return len(entries)
+
+    def after_fork(self):
+        """drop entries inherited from the parent process, which remains responsible for writing them"""
+        self.__pending = []
+        self.__lock = Lock()
+        self.__timer = None
+
+
+"""buffers log entries added without a session. see flush_logs"""
+LOG_SINK = LogSink(max_entries=secrets.LOG_BATCH_SIZE, flush_interval_ms=secrets.LOG_FLUSH_INTERVAL_MS)
+
+
+def flush_logs():
+    """write every buffered log entry to the database
+
+    Returns:
+        (int) number of entries written
+    """
+    try:
+        return LOG_SINK.flush()
+    except Exception as e:
+        print(f'log entries failed to write with <{str(e)}>', file=sys.stderr)
+        return 0
+
+
+def flush_synapse():
+    """write every staged consent row to the Synapse consents table
+
+    Returns:
+        (int) number of rows written
+    """
+    try:
+        return SYNAPSE_BUFFER.flush()
+    except Exception as e:
+        add_log_entry(f'consents failed to push to Synapse with <{str(e)}>')
+        return 0
+
+
+def load_synapse_index():
+    """fill the Synapse consents table row index with one query so updates skip the row lookup"""
+    try:
+        SYNAPSE_BUFFER.index.load()
+    except Exception as e:
+        add_log_entry(f'loading the Synapse consents table index failed with <{str(e)}>')
+
+
 def create_database(conn):
     """create the database defined by objects inheriting Base in this file"""
     engine = get_engine(conn)
     Base.metadata.create_all(engine)
+    migrate_database(engine)
+
+
+def migrate_database(engine):
+    """add columns and indexes defined in this file that are missing from tables created by an older version
+
+    Notes: create_all only creates missing tables, so new columns and indexes are added here. safe to run on every
+    start
+    """
+    existing = inspect(engine)
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing.get_table_names():
+            continue
+
+        columns = [c['name'] for c in existing.get_columns(table.name)]
+
+        for column in table.columns:
+            if column.name not in columns:
+                engine.execute(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}'
+                )
+
+        indexes = [i['name'] for i in existing.get_indexes(table.name)]
+
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(engine)
 
 
 def build_synapse_table():
@@ -694,6 +1071,8 @@ def build_synapse_table():
 def add_task(data, conn=None, session=None):
     """add a task for the archive manager to process
 
+    Notes: archive agent workers waiting for work are woken once the task is committed
+
     Args:
         data: (dict) containing attributes required to initialize a new Consent object
         conn: (dict) optional DB connection paramaters
@@ -707,18 +1086,30 @@ def add_task(data, conn=None, session=None):
 
     if session is not None:
         consent = add_entity(session, consent)
+        wake_workers(session.get_bind())
         return consent
 
     else:
         with session_scope(conn) as s:
             add_entity(s, consent)
 
+        # start the task now rather than on the next poll
+        wake_workers(get_engine(connection(conn)))
+
         # don't return the consent from here, will cause
         # an error because the consent will detach from the
         # session when it closes
         return None
 
 
+def wake_workers(engine):
+    """wake archive agent workers waiting for new tasks (see app.wake), logging a signal that could not be sent"""
+    error = wake.notify(engine)
+
+    if error is not None:
+        add_log_entry(f'waking archive agent workers failed with <{error}>')
+
+
 def add_entity(session, entity):
     """add an object to the database"""
     if session is None:
@@ -750,6 +1141,8 @@ def commit(s):
 def add_log_entry(entry, cid=None, session=None):
     """add a log entry to the database
 
+    Notes: without a session the entry is buffered in the log sink and written in bulk. see flush_logs
+
     Args:
         entry: (LogEntry)
         cid: (int) - optional foreign key to Consent.internal_id
@@ -769,6 +1162,10 @@ def add_log_entry(entry, cid=None, session=None):
         except TypeError:
             raise Exception('can only log an object with a __str__ method')
 
+    if session is None:
+        LOG_SINK.add(entry)
+        return entry
+
     return add_entity(session, entry)
 
 
@@ -802,53 +1199,271 @@ def mark_as_permanently_failed(internal_id, session=None):
         get_n_commit(session)
 
 
-def get_pending(conn=None, session=None):
-    """get all consents waiting to be processed
+def due(now):
+    """SQL filter for consents a worker may claim now
+
+    Notes: READY and DRIVE_NOT_READY consents past next_eligible_at, and PROCESSING consents whose lease expired
+    because the worker running them died
+    """
+    return or_(
+        and_(
+            Consent.status.in_([ConsentStatus.READY.value, ConsentStatus.DRIVE_NOT_READY.value]),
+            or_(Consent.next_eligible_at == None, Consent.next_eligible_at <= now)
+        ),
+        and_(
+            Consent.status == ConsentStatus.PROCESSING.value,
+            Consent.lease_expires_at != None,
+            Consent.lease_expires_at <= now
+        )
+    )
+
+
+def claim_task(owner, conn=None, lease_seconds=None):
+    """claim the next due consent with a lease, in a short transaction of its own
+
+    Notes: Postgres skips rows other workers have locked (SELECT ... FOR UPDATE SKIP LOCKED). Every driver then takes
+    the lease with a conditional UPDATE that only succeeds if the consent is still due, which is what keeps two
+    workers from claiming the same consent on SQLite. consents rescheduled for a retry go first, by next_eligible_at
+    in utc, then consents never scheduled, by consent_dt in TIMEZONE. the two are never compared with each other
 
     Args:
+        owner: (str) id of the claiming worker
         conn: (dict) optional DB connection. will use application config if not provided
-        session: (sqlalchemy.session_maker()) optional managed session with db. will be generated if not provided
+        lease_seconds: (int) optional. default TASK_LEASE_SECONDS from application config
 
     Returns:
-        [Consent,]
+        (int) internal_id of the claimed consent or None if nothing is due
     """
-    if session is None:
-        session = session_scope(conn)
-        close = True
-    else:
-        close = False
+    conn = connection(conn)
+    lease_seconds = lease_seconds if lease_seconds is not None else secrets.TASK_LEASE_SECONDS
 
-    pending = sorted(session.query(Consent).filter(or_(
-        Consent.status == ConsentStatus.READY.value,
-        Consent.status == ConsentStatus.DRIVE_NOT_READY.value
-    )).with_for_update().all(), reverse=True)
+    with session_scope(conn) as s:
+        for attempt in range(3):
+            now = dt.datetime.utcnow()
 
-    ready = []
+            query = s.query(Consent.internal_id).filter(due(now)).order_by(
+                Consent.next_eligible_at == None,
+                Consent.next_eligible_at,
+                Consent.consent_dt
+            )
 
-    def add_to_ready(p):
-        p.set_status(ConsentStatus.PROCESSING)
-        ready.append(p)
+            if conn['drivername'] == 'postgres':
+                query = query.with_for_update(skip_locked=True)
 
-    while len(pending) > 0:
-        p = pending.pop()
+            candidate = query.first()
+            if candidate is None:
+                return None
 
-        if p.status == ConsentStatus.DRIVE_NOT_READY.value:
-            if p.seconds_since_consent() > secrets.MAX_TIME_FOR_DRIVE_WAIT:
-                p.mark_as_failure()
+            claimed = s.query(Consent).filter(
+                Consent.internal_id == candidate[0],
+                due(now)
+            ).update({
+                Consent.status: ConsentStatus.PROCESSING.value,
+                Consent.lease_owner: owner,
+                Consent.lease_expires_at: now + dt.timedelta(seconds=lease_seconds),
+                Consent.claim_count: func.coalesce(Consent.claim_count, 0) + 1
+            }, synchronize_session=False)
 
-            elif p.seconds_since_last_drive_attempt() < secrets.WAIT_TIME_BETWEEN_DRIVE_NOT_READY:
-                pass
+            s.commit()
 
-            else:
-                add_to_ready(p)
-        else:
-            add_to_ready(p)
+            if claimed == 1:
+                return candidate[0]
 
-    commit(session)
-    if close:
-        session.close()
+    # lost every race this time round, the next poll tries again
+    return None
+
+
+def next_due_at(conn=None):
+    """when the next consent that is not due yet becomes due
+
+    Notes: the earliest next_eligible_at of waiting consents or lease expiry of running ones, read off the
+    (status, next_eligible_at) index. the database is the priority queue shared by every worker
+
+    Args:
+        conn: (dict) optional DB connection. will use application config if not provided
+
+    Returns:
+        (datetime.datetime) utc or None if nothing is scheduled
+    """
+    with session_scope(conn) as s:
+        eligible = s.query(func.min(Consent.next_eligible_at)).filter(
+            Consent.status.in_([ConsentStatus.READY.value, ConsentStatus.DRIVE_NOT_READY.value])
+        ).scalar()
+
+        expires = s.query(func.min(Consent.lease_expires_at)).filter(
+            Consent.status == ConsentStatus.PROCESSING.value
+        ).scalar()
+
+    times = [t for t in (eligible, expires) if t is not None]
+    return min(times) if len(times) > 0 else None
+
+
+def renew_lease(internal_id, owner, conn=None, lease_seconds=None):
+    """extend the lease on a claimed consent
+
+    Args:
+        internal_id: (int) the claimed consent
+        owner: (str) id of the worker holding the lease
+        conn: (dict) optional DB connection. will use application config if not provided
+        lease_seconds: (int) optional. default TASK_LEASE_SECONDS from application config
+
+    Returns:
+        success flag as bool. False if the lease was lost to another worker
+    """
+    lease_seconds = lease_seconds if lease_seconds is not None else secrets.TASK_LEASE_SECONDS
+
+    with session_scope(conn) as s:
+        renewed = s.query(Consent).filter(
+            Consent.internal_id == internal_id,
+            Consent.lease_owner == owner
+        ).update({
+            Consent.lease_expires_at: dt.datetime.utcnow() + dt.timedelta(seconds=lease_seconds)
+        }, synchronize_session=False)
+
+    return renewed == 1
+
+
+def dlp_config_fingerprint(config):
+    """a stable fingerprint of a DLP inspect config"""
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def dlp_cache_key(query, fingerprint):
+    """the DLP verdict cache key for a search query
+
+    Notes: queries are normalized by case folding and collapsing whitespace before hashing with DLP_CACHE_SALT
+
+    Args:
+        query: (str) search query
+        fingerprint: (str) see dlp_config_fingerprint
+
+    Returns:
+        str
+    """
+    normalized = ' '.join(query.casefold().split())
+
+    h = hashlib.sha256(secrets.DLP_CACHE_SALT)
+    h.update(fingerprint.encode('utf-8'))
+    h.update(normalized.encode('utf-8'))
+
+    return h.hexdigest()
+
+
+def dlp_cache_stats():
+    """hit and miss counts of the DLP verdict cache for this process"""
+    return dict(DLP_CACHE_STATS)
+
+
+def get_dlp_verdicts(keys, conn=None):
+    """look up cached DLP verdicts
+
+    Notes: verdicts older than DLP_CACHE_TTL seconds are treated as misses. Hits are marked as used for eviction
+
+    Args:
+        keys: ([str,]) see dlp_cache_key
+        conn: (dict) optional DB connection. will use application config if not provided
+
+    Returns:
+        dict key -> (info_type, likelihood)
+    """
+    keys = list(keys)
+    now = dt.datetime.utcnow()
+    oldest = now - dt.timedelta(seconds=secrets.DLP_CACHE_TTL)
+
+    verdicts = {}
+    with session_scope(conn) as s:
+        for i in range(0, len(keys), DLP_CACHE_QUERY_SIZE):
+            chunk = keys[i:i + DLP_CACHE_QUERY_SIZE]
+
+            hits = s.query(DlpVerdict).filter(
+                and_(DlpVerdict.key.in_(chunk), DlpVerdict.created >= oldest)
+            ).all()
+
+            for v in hits:
+                verdicts[v.key] = (v.info_type, v.likelihood)
+
+            s.query(DlpVerdict).filter(DlpVerdict.key.in_([v.key for v in hits])).update(
+                {DlpVerdict.last_used: now}, synchronize_session=False
+            )
+
+    DLP_CACHE_STATS['hits'] += len(verdicts)
+    DLP_CACHE_STATS['misses'] += len(keys) - len(verdicts)
+
+    return verdicts
+
+
+def put_dlp_verdicts(verdicts, conn=None):
+    """add verdicts to the DLP verdict cache, replacing expired ones, and evict the least recently used verdicts beyond
+    DLP_CACHE_MAX_ENTRIES
+
+    Notes: verdicts are upserted, so a key another worker cached after the lookup is replaced rather than failing the
+    whole batch with an IntegrityError
+
+    Args:
+        verdicts: (dict) key -> (info_type, likelihood). info_type is None when DLP found nothing
+        conn: (dict) optional DB connection. will use application config if not provided
+
+    Returns:
+        None
+    """
+    if len(verdicts) == 0:
+        return
 
-    return ready
+    now = dt.datetime.utcnow()
+
+    # the same key order in every writer keeps concurrent Postgres upserts from deadlocking on each other
+    keys = sorted(verdicts.keys())
+
+    with session_scope(conn) as s:
+        for i in range(0, len(keys), DLP_CACHE_QUERY_SIZE):
+            upsert(s, DlpVerdict.__table__, [
+                {
+                    'key': k,
+                    'info_type': verdicts[k][0],
+                    'likelihood': verdicts[k][1],
+                    'created': now,
+                    'last_used': now
+                } for k in keys[i:i + DLP_CACHE_QUERY_SIZE]
+            ])
+
+        excess = s.query(func.count(DlpVerdict.key)).scalar() - secrets.DLP_CACHE_MAX_ENTRIES
+        if excess > 0:
+            stale = [k for k, in s.query(DlpVerdict.key).order_by(DlpVerdict.last_used).limit(excess)]
+
+            for i in range(0, len(stale), DLP_CACHE_QUERY_SIZE):
+                s.query(DlpVerdict).filter(
+                    DlpVerdict.key.in_(stale[i:i + DLP_CACHE_QUERY_SIZE])
+                ).delete(synchronize_session=False)
+
+
+def upsert(session, table, rows):
+    """insert rows, replacing the rows that already have their primary keys
+
+    Notes: INSERT ... ON CONFLICT DO UPDATE on Postgres and INSERT OR REPLACE on SQLite, so a row added by another
+    transaction in the meantime is overwritten instead of raising an IntegrityError
+
+    Args:
+        session: (sqlalchemy.session_maker()) managed session with db
+        table: (sqlalchemy.Table) table of the rows
+        rows: ([dict,]) column name -> value of every column
+    """
+    if len(rows) == 0:
+        return
+
+    dialect = session.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        statement = postgresql.insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[c.name for c in table.primary_key.columns],
+            set_={c.name: statement.excluded[c.name] for c in table.columns if not c.primary_key}
+        )
+    elif dialect == 'sqlite':
+        statement = table.insert().prefix_with('OR REPLACE')
+    else:
+        raise Exception(f'upsert is not supported on <{dialect}>')
+
+    session.execute(statement, rows)
 
 
 def get_consent(study_id, internal_id, session):
@@ -860,54 +1475,211 @@ def get_consent(study_id, internal_id, session):
     return c
 
 
-def daily_digest(conn=None):
+def uploaded(sid):
+    """SQL expression that is 1 when a Synapse id column holds an upload rather than nothing or an error"""
+    return case([(and_(sid != None, ~sid.like('%err%'), ~sid.like('%not found%')), 1)], else_=0)
+
+
+def digest_counts(session, start, end):
+    """count consents added, searches, and locations uploaded per day in one GROUP BY query
+
+    Args:
+        session: (sqlalchemy.session_maker()) managed session with db
+        start: (datetime.date) first day
+        end: (datetime.date) day after the last day
+
+    Returns:
+        dict datetime.date -> (consents_added, searches, locations)
+    """
+    day = func.date(Consent.consent_dt)
+
+    rows = session.query(
+        day, func.count(Consent.internal_id), func.sum(uploaded(Consent.search_sid)),
+        func.sum(uploaded(Consent.location_sid))
+    ).filter(
+        Consent.consent_dt >= dt.datetime.combine(start, dt.time.min),
+        Consent.consent_dt < dt.datetime.combine(end, dt.time.min)
+    ).group_by(day).all()
+
+    counts = {}
+    for d, n, searches, locations in rows:
+        # sqlite returns the date as a string
+        d = dt.datetime.strptime(d, '%Y-%m-%d').date() if isinstance(d, str) else d
+        counts[d] = (n, int(searches or 0), int(locations or 0))
+
+    return counts
+
+
+def summarize_days(session, start, end):
+    """store digest counts per day in the summary table, recounting only days that may still change
+
+    Notes: consents keep being processed up to MAX_TIME_FOR_DRIVE_WAIT after they are added, so only days older than
+    that are settled. settled days with a summary are never counted again
+
+    Args:
+        session: (sqlalchemy.session_maker()) managed session with db
+        start: (datetime.date) first day
+        end: (datetime.date) day after the last day
+
+    Returns:
+        [DigestSummary,] one per day
+    """
+    settled = dt.date.today() - dt.timedelta(days=int(np.ceil(secrets.MAX_TIME_FOR_DRIVE_WAIT / 86400)) + 1)
+
+    summaries = {
+        x.day: x for x in session.query(DigestSummary).filter(DigestSummary.day >= start, DigestSummary.day < end)
+    }
+
+    days = [start + dt.timedelta(days=i) for i in range((end - start).days)]
+    stale = [d for d in days if d not in summaries or d >= settled]
+
+    if len(stale) > 0:
+        counts = digest_counts(session, min(stale), max(stale) + dt.timedelta(days=1))
+        now = dt.datetime.utcnow()
+
+        for d in stale:
+            x = summaries.get(d)
+            if x is None:
+                x = DigestSummary(day=d)
+                session.add(x)
+
+            x.consents_added, x.searches, x.locations = counts.get(d, (0, 0, 0))
+            x.updated = now
+            summaries[d] = x
+
+        commit(session)
+
+    return [summaries[d] for d in days]
+
+
+def digest_details(session, start, end, limit=None, notes=None):
+    """details of the latest consents added in a period with their latest log entries
+
+    Args:
+        session: (sqlalchemy.session_maker()) managed session with db
+        start: (datetime.datetime) start of the period
+        end: (datetime.datetime) end of the period, exclusive
+        limit: (int) optional. most consents. default DIGEST_MAX_CONSENTS from application config
+        notes: (int) optional. most log entries per consent. default DIGEST_MAX_NOTES from application config
+
+    Returns:
+        [dict,] consent dicts, without credentials, ordered by decreasing consent date
+    """
+    limit = limit if limit is not None else secrets.DIGEST_MAX_CONSENTS
+    notes = notes if notes is not None else secrets.DIGEST_MAX_NOTES
+
+    consents = session.query(Consent).filter(
+        Consent.consent_dt >= start,
+        Consent.consent_dt < end
+    ).order_by(Consent.consent_dt.desc()).limit(limit).all()
+
+    # one query for the logs of every listed consent instead of one per consent
+    logs = {c.internal_id: [] for c in consents}
+    if len(consents) > 0:
+        for l in session.query(LogEntry).filter(LogEntry.cid.in_(list(logs.keys()))).order_by(LogEntry.ts.desc()):
+            if len(logs[l.cid]) < notes:
+                logs[l.cid].append(l)
+
+    details = []
+    for c in consents:
+        details.append({
+            'internal_id': c.internal_id,
+            'study_id': c.study_id,
+            'email': c.email,
+            'first_name': c.first_name,
+            'last_name': c.last_name,
+            'consent_dt': c.consent_dt.strftime(secrets.DTFORMAT).upper(),
+            'location_sid': c.location_sid,
+            'search_sid': c.search_sid,
+            'notes': [{'ts': l.ts_formatted, 'msg': l.msg} for l in logs[c.internal_id][::-1]],
+            'status': c.status
+        })
+
+    return details
+
+
+def daily_digest(conn=None, day=None):
     """generate the daily digest of consents processed
 
+    Notes: counts are aggregated in SQL and stored in the summary table. Only the latest DIGEST_MAX_CONSENTS consents
+    are listed with their details
+
     Args:
         conn: (dict) optional DB connection. will use application config if not provided
+        day: (datetime.date) optional. defaults to today
 
     Returns:
         dict
     """
-    today = dt.date.today()
+    day = day if day is not None else dt.date.today()
+    start = dt.datetime.combine(day, dt.time.min)
 
     with session_scope(conn) as s:
-        consents = s.query(Consent).filter(
-            cast(Consent.consent_dt, Date) == today
-        ).all()
-
-        n = len(consents)
-        n_searches = sum([
-            1 for c in consents
-            if c.search_sid is not None and
-               'err' not in c.search_sid and
-               'not found' not in c.search_sid
-        ])
-        n_locations = sum([
-            1 for c in consents
-            if c.location_sid is not None and
-               'err' not in c.location_sid and
-               'not found' not in c.location_sid
-        ])
+        summary = summarize_days(s, day, day + dt.timedelta(days=1))[0]
 
         digest = {
-            'today': today.strftime('%B %d, %Y'),
-            'consents_added': n,
-            'searches': n_searches,
-            'locations': n_locations,
-            'consents': [c.dict for c in consents]
+            'today': day.strftime('%B %d, %Y'),
+            'consents_added': summary.consents_added,
+            'searches': summary.searches,
+            'locations': summary.locations,
+            'consents': digest_details(s, start, start + dt.timedelta(days=1))
         }
 
-        for c in digest['consents']:
-            c['consent_dt'] = c['consent_dt'].strftime(secrets.DTFORMAT).upper()
-
-            for note in c['notes']:
-                del note['cid']
-                note['ts'] = note['ts'].strftime(secrets.DTFORMAT).upper()
+    digest['consents_omitted'] = digest['consents_added'] - len(digest['consents'])
 
     return digest
 
 
+def rollup_digest(period='week', day=None, conn=None):
+    """roll the daily digest counts up over the week or month containing a day
+
+    Notes: reads the summary table, counting only the days that have no summary or may still change
+
+    Args:
+        period: (str) 'week' (starting Monday) or 'month'
+        day: (datetime.date) optional. any day in the period. defaults to today
+        conn: (dict) optional DB connection. will use application config if not provided
+
+    Returns:
+        dict
+    """
+    day = day if day is not None else dt.date.today()
+
+    if period == 'week':
+        start = day - dt.timedelta(days=day.weekday())
+        end = start + dt.timedelta(days=7)
+    elif period == 'month':
+        start = day.replace(day=1)
+        end = (start + dt.timedelta(days=32)).replace(day=1)
+    else:
+        raise ValueError(f'unknown digest period <{period}>')
+
+    # days that have not happened yet have nothing to count
+    end = min(end, dt.date.today() + dt.timedelta(days=1))
+
+    with session_scope(conn) as s:
+        summaries = summarize_days(s, start, end)
+
+        return {
+            'period': period,
+            'start': start.strftime('%B %d, %Y'),
+            'end': (end - dt.timedelta(days=1)).strftime('%B %d, %Y'),
+            'consents_added': sum([x.consents_added for x in summaries]),
+            'searches': sum([x.searches for x in summaries]),
+            'locations': sum([x.locations for x in summaries]),
+            'days': [
+                {'day': x.day.strftime('%B %d, %Y'), 'consents_added': x.consents_added, 'searches': x.searches,
+                 'locations': x.locations}
+                for x in summaries
+            ]
+        }
+
+
+# registered first so it runs last, after anything the Synapse flush logs
+atexit.register(flush_logs)
+atexit.register(flush_synapse)
+
+
 if __name__ == '__main__':
     # create_database(secrets.DATABASE)
     # build_synapse_table()
@@ -0,0 +1,181 @@
+import json
+from multiprocessing.dummy import Pool as TPool
+import os
+from threading import Lock
+
+import app.config as secrets
+from app.retry import GOOGLE
+
+DRIVE_FILE_URL = 'https://www.googleapis.com/drive/v3/files/{file_id}'
+
+
+class RangeNotSupported(Exception):
+    """raised when Google Drive does not answer a byte range request with partial content"""
+    pass
+
+
+class RangedDownload(object):
+    """class for downloading a Google Drive file as concurrent byte ranges"""
+
+    def __init__(self, session, file_id, path, range_size=None, workers=None):
+        """constructor
+
+        Notes: the file is preallocated at path and every range is written in place. Completed ranges are recorded in a
+        sidecar manifest (<path>.manifest) so a failed download resumes from the missing ranges on the next attempt
+
+        Args:
+            session: (AuthorizedSession) authorized participant http session
+            file_id: (str) Google Drive file id
+            path: (str) where to write the file
+            range_size: (int) optional. bytes per range request. default DOWNLOAD_RANGE_SIZE from application config
+            workers: (int) optional. concurrent range requests. default DOWNLOAD_WORKERS from application config
+        """
+        self.session = session
+        self.file_id = file_id
+        self.path = path
+        self.manifest_path = f'{path}.manifest'
+        self.range_size = range_size if range_size is not None else secrets.DOWNLOAD_RANGE_SIZE
+        self.workers = workers if workers is not None else secrets.DOWNLOAD_WORKERS
+        self.size = None
+        self.error = None
+
+        self.__completed = set()
+        self.__lock = Lock()
+
+    def __repr__(self):
+        return f'<RangedDownload(file_id={self.file_id}, size={self.size}, pending={len(self.pending)})>'
+
+    @property
+    def url(self):
+        return DRIVE_FILE_URL.format(file_id=self.file_id) + '?alt=media'
+
+    @property
+    def ranges(self):
+        """all byte ranges of the file as (start, end) tuples, end inclusive"""
+        if self.size is None:
+            return []
+
+        return [(s, min(s + self.range_size, self.size) - 1) for s in range(0, self.size, self.range_size)]
+
+    @property
+    def pending(self):
+        """byte ranges that have not been downloaded yet"""
+        return [r for r in self.ranges if r[0] not in self.__completed]
+
+    @property
+    def complete(self):
+        return self.size is not None and len(self.pending) == 0
+
+    def fetch_size(self):
+        """get the size of the file in bytes from the Drive metadata endpoint"""
+        if self.size is None:
+            url = DRIVE_FILE_URL.format(file_id=self.file_id)
+            response = GOOGLE.call(self.session.get, url, params={'fields': 'size'})
+
+            if response.status_code != 200:
+                raise Exception(f'file metadata request failed with status <{response.status_code}>')
+
+            self.size = int(json.loads(response.content)['size'])
+
+        return self.size
+
+    def run(self):
+        """download every pending range
+
+        Notes: the manifest is kept after the file is complete so a later attempt finds nothing left to fetch. It is up
+        to the caller to remove both once the file has been used. On failure the reason is stored in self.error
+
+        Returns:
+            success flag as bool
+        """
+        self.fetch_size()
+        self.__resume()
+
+        pool = TPool(self.workers)
+        try:
+            errors = [e for e in pool.map(self.__try_fetch, self.pending) if e is not None]
+        finally:
+            pool.close()
+            pool.join()
+
+        if any([isinstance(e, RangeNotSupported) for e in errors]):
+            raise RangeNotSupported(f'range requests not supported for {self.file_id}')
+
+        if self.complete:
+            return True
+        else:
+            self.error = str(errors[0]) if len(errors) > 0 else 'unknown'
+            return False
+
+    def __resume(self):
+        """load completed ranges from the manifest, or preallocate a new file if there is nothing to resume"""
+        manifest = None
+        if os.path.exists(self.manifest_path) and os.path.exists(self.path):
+            try:
+                with open(self.manifest_path, 'r') as f:
+                    manifest = json.load(f)
+            except ValueError:
+                manifest = None
+
+        if manifest is not None and \
+                manifest.get('file_id') == self.file_id and \
+                manifest.get('size') == self.size and \
+                manifest.get('range_size') == self.range_size:
+            self.__completed = set(manifest['completed'])
+        else:
+            # truncate leaves a sparse file on filesystems that support it
+            with open(self.path, 'wb') as f:
+                f.truncate(self.size)
+
+            self.__completed = set()
+            self.__save_manifest()
+
+    def __save_manifest(self):
+        """write the manifest to a tmp file and swap it in so a crash never leaves a half written manifest"""
+        tmp = f'{self.manifest_path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({
+                'file_id': self.file_id,
+                'size': self.size,
+                'range_size': self.range_size,
+                'completed': sorted(self.__completed)
+            }, f)
+
+        os.replace(tmp, self.manifest_path)
+
+    def __try_fetch(self, r):
+        """fetch a range, returning the exception instead of raising it so other ranges can finish
+
+        Notes: dropped connections, 5xx, and 429 are retried under the shared Google retry policy
+        """
+        try:
+            GOOGLE.call(self.__fetch, r)
+            return None
+        except Exception as e:
+            return e
+
+    def __fetch(self, r):
+        """fetch a single byte range and write it into place"""
+        start, end = r
+
+        with self.session.get(self.url, headers={'Range': f'bytes={start}-{end}'}, stream=True) as response:
+            if response.status_code == 200:
+                raise RangeNotSupported()
+            elif response.status_code != 206:
+                response.raise_for_status()
+                raise Exception(f'range request failed with status <{response.status_code}>')
+
+            offset = start
+            with open(self.path, 'r+b') as out:
+                out.seek(start)
+
+                for chunk in response.iter_content(chunk_size=secrets.DOWNLOAD_CHUNK_SIZE):
+                    out.write(chunk)
+                    offset += len(chunk)
+
+        if offset != end + 1:
+            raise Exception(f'range {start}-{end} ended early at byte {offset}')
+
+        with self.__lock:
+            self.__completed.add(start)
+            self.__save_manifest()
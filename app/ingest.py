@@ -0,0 +1,170 @@
+#!/bin/env python
+
+import argparse
+import csv
+import json
+from multiprocessing import Pool
+import os
+import sys
+
+import dateutil.parser
+
+import app.config as secrets
+import app.context as ctx
+
+"""fields read from every consent record. study_id, consent_dt, and credentials are required"""
+FIELDS = ['study_id', 'consent_dt', 'credentials', 'email', 'first_name', 'last_name']
+
+
+def read_consents(path):
+    """read consent records from a CSV file with a header row, or from a JSONL file with one record per line
+
+    Returns:
+        [dict,] with the keys in FIELDS
+    """
+    with open(path, 'r') as f:
+        if path.lower().endswith('.csv'):
+            records = list(csv.DictReader(f))
+        else:
+            records = [json.loads(line) for line in f if len(line.strip()) > 0]
+
+    consents = []
+    for i, r in enumerate(records):
+        missing = [k for k in FIELDS[:3] if r.get(k) in (None, '')]
+        if len(missing) > 0:
+            raise Exception(f'consent record {i + 1} is missing <{", ".join(missing)}>')
+
+        x = {k: r.get(k) for k in FIELDS}
+        x['consent_dt'] = dateutil.parser.parse(str(x['consent_dt']))
+
+        consents.append(x)
+
+    return consents
+
+
+def ingest_consents(consents, conn=None, batch_size=None, workers=None):
+    """add many consents for the archive manager to process at once
+
+    Notes: credentials are encrypted in a process pool, each batch of consents is written with one multi-row insert, and
+    the Synapse consents table gets one batched update at the end. archive agent workers are woken once
+
+    Args:
+        consents: ([dict,]) attributes required to initialize new Consent objects. see read_consents
+        conn: (dict) optional DB connection. will use application config if not provided
+        batch_size: (int) optional. consents per insert. default INGEST_BATCH_SIZE from application config
+        workers: (int) optional. encrypting processes. default INGEST_WORKERS from application config
+
+    Returns:
+        ([int,]) internal ids of the added consents
+    """
+    conn = ctx.connection(conn)
+    batch_size = batch_size if batch_size is not None else secrets.INGEST_BATCH_SIZE
+    workers = workers if workers is not None else secrets.INGEST_WORKERS
+
+    if len(consents) == 0:
+        return []
+
+    pool = Pool(min(workers, len(consents)))
+    try:
+        encrypted = pool.map(ctx.encrypt_credentials, [c['credentials'] for c in consents])
+    finally:
+        pool.close()
+        pool.join()
+
+    table = ctx.Consent.__table__
+    postgres = conn['drivername'] == 'postgres'
+    ids = []
+
+    records = [{
+        'study_id': c['study_id'],
+        'consent_dt': c['consent_dt'],
+        'data': data,
+        'email': c.get('email'),
+        'first_name': c.get('first_name'),
+        'last_name': c.get('last_name'),
+        'status': ctx.ConsentStatus.READY.value,
+        'attempt_count': 0
+    } for c, data in zip(consents, encrypted)]
+
+    if not postgres:
+        # older sqlite builds allow at most 999 bound parameters per statement. column defaults are bound per row too
+        params = len(table.insert().values(records[:1]).compile(dialect=ctx.get_engine(conn).dialect).params)
+        batch_size = min(batch_size, 999 // params)
+
+    for i in range(0, len(records), batch_size):
+        rows = records[i:i + batch_size]
+
+        with ctx.session_scope(conn) as s:
+            if postgres:
+                batch = [r[0] for r in s.execute(table.insert().values(rows).returning(table.c.internal_id))]
+            else:
+                # no RETURNING on sqlite. writes are exclusive, so one insert gets consecutive ids up to the last one
+                last = s.execute(table.insert().values(rows)).lastrowid
+                batch = list(range(last - len(rows) + 1, last + 1))
+
+            s.commit()
+
+        ids.extend(batch)
+
+        for internal_id, r in zip(batch, rows):
+            ctx.SYNAPSE_BUFFER.stage([
+                r['study_id'],
+                internal_id,
+                r['consent_dt'].strftime(secrets.DTFORMAT).upper(),
+                None,
+                None,
+                'none'
+            ])
+
+    ctx.flush_synapse()
+    ctx.add_log_entry(f'{len(ids)} consents imported')
+    ctx.flush_logs()
+
+    ctx.wake_workers(ctx.get_engine(conn))
+
+    return ids
+
+
+def main():
+    """bulk import consents from the command line
+
+    Command line arguments:
+        path: (str) CSV or JSONL file of consents with study_id, consent_dt, credentials, and optionally email,
+            first_name, last_name
+        batch: (int) optional. consents per insert
+
+    Examples:
+        >>> python3 ingest.py --path /home/luke/consents.jsonl
+    """
+    parser = argparse.ArgumentParser(description='--')
+    parser.add_argument(
+        '--path',
+        type=str,
+        help='file path to a CSV or JSONL file of consents',
+        required=True
+    )
+    parser.add_argument(
+        '--batch',
+        type=int,
+        help='optional. consents per insert',
+        required=False
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f'consents file does not exist at {args.path}')
+        return 1
+
+    try:
+        ids = ingest_consents(read_consents(args.path), batch_size=args.batch)
+    except Exception as e:
+        print(e)
+        return 1
+
+    print(f'{len(ids)} consents imported')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
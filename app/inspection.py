@@ -0,0 +1,192 @@
+from multiprocessing.dummy import Pool as TPool
+from threading import Lock
+import time
+
+from google.api_core import exceptions as gexc
+
+import app.config as secrets
+from app.retry import GOOGLE
+
+"""approximate bytes a table row adds to an inspect request on top of the query itself"""
+ROW_OVERHEAD_BYTES = 16
+
+
+def payload_bytes(queries):
+    """approximate bytes queries add to an inspect request"""
+    return sum([len(q.encode('utf-8')) + ROW_OVERHEAD_BYTES for q in queries])
+
+
+class TokenBucket(object):
+    """thread safe token bucket used to hold requests to a rate"""
+
+    def __init__(self, rate, capacity=None):
+        """constructor
+
+        Args:
+            rate: (float) tokens added per second
+            capacity: (int) optional. most tokens that can be saved up. default is one second of tokens
+        """
+        self.rate = float(rate)
+        self.capacity = capacity if capacity is not None else max(1., self.rate)
+
+        self.__tokens = self.capacity
+        self.__last = time.monotonic()
+        self.__lock = Lock()
+
+    def acquire(self):
+        """take a token, blocking until one is available"""
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.capacity, self.__tokens + (now - self.__last) * self.rate)
+                self.__last = now
+
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+
+                wait = (1 - self.__tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class DlpDispatcher(object):
+    """class for sending search queries to DLP as concurrent, rate limited inspect requests"""
+
+    def __init__(self, client, project_id, inspect_config, **kwargs):
+        """constructor
+
+        Args:
+            client: (google.cloud.dlp.DlpServiceClient) or anything with the same project_path and inspect_content
+            project_id: (str) Google project to run inspections under
+            inspect_config: (dict) DLP inspect config
+            qps: (float) optional. inspect requests per second. default DLP_QPS from application config
+            workers: (int) optional. concurrent requests. default DLP_WORKERS from application config
+            max_bytes: (int) optional. request payload budget. default DLP_MAX_REQUEST_BYTES from application config
+            max_rows: (int) optional. most queries per request. default DLP_MAX_REQUEST_ROWS from application config
+            policy: (app.retry.RetryPolicy) optional. retry policy for quota and availability errors. default GOOGLE
+        """
+        self.client = client
+        self.parent = client.project_path(project_id)
+        self.inspect_config = inspect_config
+
+        self.workers = kwargs.get('workers', secrets.DLP_WORKERS)
+        self.max_bytes = kwargs.get('max_bytes', secrets.DLP_MAX_REQUEST_BYTES)
+        self.max_rows = kwargs.get('max_rows', secrets.DLP_MAX_REQUEST_ROWS)
+        self.policy = kwargs.get('policy', GOOGLE)
+        self.bucket = TokenBucket(kwargs.get('qps', secrets.DLP_QPS))
+
+        self.requests = 0
+        self.__lock = Lock()
+
+    def __repr__(self):
+        return f'<DlpDispatcher(workers={self.workers}, max_bytes={self.max_bytes}, requests={self.requests})>'
+
+    def chunks(self, queries):
+        """split queries into requests that fit the payload byte budget and row limit
+
+        Notes: chunks are built as they are taken, so a budget lowered after a payload was rejected applies to every
+        chunk taken afterwards
+        """
+        chunk, size = [], 0
+
+        for q in queries:
+            n = payload_bytes([q])
+
+            if len(chunk) > 0 and (size + n > self.max_bytes or len(chunk) >= self.max_rows):
+                yield chunk
+                chunk, size = [], 0
+
+            chunk.append(q)
+            size += n
+
+        if len(chunk) > 0:
+            yield chunk
+
+    def inspect(self, queries):
+        """inspect search queries
+
+        Args:
+            queries: ([str,]) unique search queries
+
+        Returns:
+            dict query -> (info_type, likelihood) for every query DLP flagged. multiple info types are comma separated
+            and the highest likelihood is kept
+        """
+        queries = list(queries)
+        if len(queries) == 0:
+            return {}
+
+        # every worker takes its next chunk from the same generator
+        chunks = self.chunks(queries)
+        lock = Lock()
+
+        def work(_):
+            found = {}
+
+            while True:
+                with lock:
+                    chunk = next(chunks, None)
+
+                if chunk is None:
+                    return found
+
+                found.update(self.__inspect_chunk(chunk))
+
+        pool = TPool(self.workers)
+        try:
+            results = pool.map(work, range(self.workers))
+        finally:
+            pool.close()
+            pool.join()
+
+        found = {}
+        for r in results:
+            found.update(r)
+
+        return found
+
+    def __inspect_chunk(self, chunk):
+        """inspect one chunk, splitting it in half if DLP rejects the payload as too large"""
+        try:
+            return self.__request(chunk)
+        except gexc.InvalidArgument as e:
+            if len(chunk) < 2 or 'too large' not in str(e).lower():
+                raise
+
+            # shrink the budget for the chunks that have not been built yet
+            with self.__lock:
+                self.max_bytes = min(self.max_bytes, payload_bytes(chunk) // 2)
+
+            half = len(chunk) // 2
+            found = self.__inspect_chunk(chunk[:half])
+            found.update(self.__inspect_chunk(chunk[half:]))
+            return found
+
+    def __request(self, chunk):
+        """send one inspect request, retrying with backoff and jitter on quota and availability errors"""
+        item = {
+            'table': {
+                'headers': [{'name': 'userSearchQueries'}],
+                'rows': [{'values': [{'string_value': q}]} for q in chunk]
+            }
+        }
+
+        def send():
+            # every attempt, retries included, waits for a token
+            self.bucket.acquire()
+            return self.client.inspect_content(parent=self.parent, inspect_config=self.inspect_config, item=item)
+
+        response = self.policy.call(send)
+
+        with self.__lock:
+            self.requests += 1
+
+        # findings point back to the query through the row index of the table; DLP omits a zero row index
+        found = {}
+        for f in response.result.findings:
+            q = chunk[f.location.content_locations[0].record_location.table_location.row_index]
+            info_types, likelihood = found.get(q, (set(), 0))
+            found[q] = (info_types | {f.info_type.name}, max(likelihood, f.likelihood))
+
+        return {q: (','.join(sorted(t)), l) for q, (t, l) in found.items()}
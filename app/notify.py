@@ -0,0 +1,182 @@
+import atexit
+import os
+import sys
+from threading import Lock, Timer
+
+from botocore.exceptions import ClientError
+import boto3
+from jinja2 import Template
+
+import app.config as secrets
+
+"""the process-wide SES client and the pid that built it. see get_ses_client"""
+SES_CLIENT = None
+SES_CLIENT_PID = None
+SES_CLIENT_LOCK = Lock()
+
+
+def get_ses_client():
+    """get the SES client, building it on first use in each process
+
+    Notes: building a client loads the botocore service models, so one is kept per process. clients are not safe to
+    share across a fork, so a forked process builds its own
+    """
+    global SES_CLIENT, SES_CLIENT_PID
+
+    with SES_CLIENT_LOCK:
+        if SES_CLIENT is None or SES_CLIENT_PID != os.getpid():
+            SES_CLIENT = boto3.client(
+                'ses',
+                aws_access_key_id=secrets.AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=secrets.AWS_SECRET_ACCESS_KEY,
+                region_name=secrets.REGION_NAME
+            )
+            SES_CLIENT_PID = os.getpid()
+
+        return SES_CLIENT
+
+
+def set_ses_client(client):
+    """use client in place of SES in this process, e.g. a local stub with the same send_email"""
+    global SES_CLIENT, SES_CLIENT_PID
+
+    with SES_CLIENT_LOCK:
+        SES_CLIENT = client
+        SES_CLIENT_PID = os.getpid()
+
+
+def send_email(subject, html, client=None):
+    """send an html email to ADMIN_EMAILS defined in application config
+
+    Args:
+        subject: (str)
+        html: (str) email body
+        client: optional. SES client or a stub with the same send_email. default get_ses_client()
+
+    Returns:
+        dict - AWS Simple Email Service response
+    """
+    client = client if client is not None else get_ses_client()
+
+    try:
+        return client.send_email(
+            Source=secrets.FROM_STUDY_EMAIL,
+            Destination={
+                'ToAddresses': secrets.ADMIN_EMAILS
+            },
+            Message={
+                'Subject': {
+                    'Data': subject,
+                    'Charset': secrets.CHARSET
+                },
+                'Body': {
+                    'Html': {
+                        'Data': html,
+                        'Charset': secrets.CHARSET
+                    }
+                }
+            },
+            ReplyToAddresses=[secrets.FROM_STUDY_EMAIL]
+        )
+    except ClientError as e:
+        raise Exception(f'email failed with <{str(e.response["Error"]["Message"])}>')
+
+
+class NotificationBatcher(object):
+    """class for collapsing per consent admin notifications into one summary email"""
+
+    def __init__(self, interval_minutes, client=None):
+        """constructor
+
+        Notes: the summary is sent interval_minutes after the first notification is added, or when flush is called.
+        Each notification is rendered with PARTICIPANT_EMAIL_BODY and the summary joins them
+
+        Args:
+            interval_minutes: (float) how long to collect notifications before sending
+            client: optional. SES client or a stub with the same send_email. default get_ses_client()
+        """
+        self.interval_minutes = interval_minutes
+        self.client = client
+
+        self.__pending = []
+        self.__lock = Lock()
+        self.__timer = None
+
+    def __repr__(self):
+        return f'<NotificationBatcher(interval_minutes={self.interval_minutes}, pending={len(self)})>'
+
+    def __len__(self):
+        return len(self.__pending)
+
+    def add(self, x):
+        """queue a notification
+
+        Args:
+            x: (dict) values for PARTICIPANT_EMAIL_BODY
+        """
+        with self.__lock:
+            self.__pending.append(x)
+
+            if self.__timer is None:
+                self.__timer = Timer(self.interval_minutes * 60., self.flush)
+                self.__timer.daemon = True
+                self.__timer.start()
+
+    def flush(self):
+        """send every queued notification as one summary email
+
+        Notes: notifications are put back if the email fails
+
+        Returns:
+            (int) number of notifications sent
+        """
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+
+            batch, self.__pending = self.__pending, []
+
+        if len(batch) == 0:
+            return 0
+
+        template = Template(secrets.PARTICIPANT_EMAIL_BODY)
+        html = '<hr>'.join([template.render(x=x) for x in batch])
+
+        try:
+            send_email(secrets.NOTIFY_BATCH_SUBJECT.format(n=len(batch)), html, client=self.client)
+        except Exception:
+            with self.__lock:
+                self.__pending = batch + self.__pending
+            raise
+
+        return len(batch)
+
+    def after_fork(self):
+        """drop notifications inherited from the parent process, which remains responsible for sending them"""
+        self.__pending = []
+        self.__lock = Lock()
+        self.__timer = None
+
+
+"""collects admin notifications when NOTIFY_BATCH_MINUTES is above zero. see flush_notifications"""
+NOTIFICATIONS = NotificationBatcher(secrets.NOTIFY_BATCH_MINUTES)
+
+
+def flush_notifications():
+    """send queued admin notifications as one summary email
+
+    Returns:
+        (int) number of notifications sent
+    """
+    try:
+        return NOTIFICATIONS.flush()
+    except Exception as e:
+        print(f'admin notifications failed to send with <{str(e)}>', file=sys.stderr)
+        return 0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=lambda: NOTIFICATIONS.after_fork())
+
+atexit.register(flush_notifications)
@@ -0,0 +1,133 @@
+from collections import Counter
+import re
+
+import app.config as secrets
+
+"""DLP likelihood assigned to local rule hits (google.cloud.dlp Likelihood.VERY_LIKELY)"""
+VERY_LIKELY = 5
+
+
+def luhn(digits):
+    """check a credit card number with the Luhn checksum"""
+    total = 0
+    for i, d in enumerate(reversed(digits)):
+        d = int(d)
+        if i % 2 == 1:
+            d = d * 2 - 9 if d > 4 else d * 2
+        total += d
+
+    return total % 10 == 0
+
+
+"""street suffixes accepted by the street address rule"""
+STREET_SUFFIXES = (
+    'st|street|ave|avenue|rd|road|blvd|boulevard|dr|drive|ln|lane|ct|court|way|pl|place|ter|terrace|hwy|highway'
+)
+
+"""local rules as (name, DLP info type it stands in for, compiled pattern, optional validator of the match). hits skip
+DLP, so phone numbers need US separators (ten bare digits may be an ISBN) and a street address must end the query as
+number, one to three name words, suffix, and optional unit. looser shapes go on to DLP"""
+RULES = [
+    ('email', 'EMAIL_ADDRESS', re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+'), None),
+    ('ssn', 'US_SOCIAL_SECURITY_NUMBER', re.compile(r'\b\d{3}-\d{2}-\d{4}\b'), None),
+    ('credit_card', 'CREDIT_CARD_NUMBER', re.compile(r'\b\d(?:[ -]?\d){12,18}\b'),
+        lambda m: luhn(re.sub(r'\D', '', m.group(0)))),
+    ('phone', 'PHONE_NUMBER', re.compile(
+        r'(?<![\w-])(?:\+?1[\s.-])?(?:\(\d{3}\)\s?|\d{3}[\s.-])\d{3}[\s.-]\d{4}(?![\w-])'), None),
+    ('street_address', 'STREET_ADDRESS', re.compile(
+        rf'(?:^|\s)\d{{1,6}}\s+(?:[a-z][a-z.\']*\s+){{1,3}}(?:{STREET_SUFFIXES})\.?'
+        r'(?:,?\s+(?:apt|unit|suite|ste|#)\s*#?\w{1,5})?\s*$', re.IGNORECASE), None),
+]
+
+"""splits a query into the tokens checked against the safe list"""
+TOKENS = re.compile(r'[^\W\d_]+|\d+')
+
+
+class PreRedactor(object):
+    """class for triaging search queries locally before they are sent to DLP"""
+
+    def __init__(self, rules=None, safe_tokens=None, info_types=None):
+        """constructor
+
+        Notes: queries matching a rule are certain hits and are redacted without asking DLP. Queries made only of safe
+        tokens are certain misses and are skipped. Everything else is ambiguous and still goes to DLP
+
+        Args:
+            rules: ([(name, info_type, pattern, validator),]) optional. default RULES
+            safe_tokens: ([str,]) optional. default DLP_SAFE_TOKENS from application config
+            info_types: ([str,]) optional. only rules for these DLP info types are applied. default the info types of
+                DLP_INSPECT_CONFIG from application config
+        """
+        if info_types is None:
+            info_types = [t['name'] for t in secrets.DLP_INSPECT_CONFIG['info_types']]
+
+        rules = rules if rules is not None else RULES
+        self.rules = [r for r in rules if r[1] in info_types]
+
+        safe_tokens = safe_tokens if safe_tokens is not None else secrets.DLP_SAFE_TOKENS
+        self.safe_tokens = frozenset([t.casefold() for t in safe_tokens])
+
+        self.hits = Counter()
+        self.safe = 0
+        self.ambiguous = 0
+
+    def __repr__(self):
+        return f'<PreRedactor(rules={len(self.rules)}, safe_tokens={len(self.safe_tokens)})>'
+
+    @property
+    def total(self):
+        return sum(self.hits.values()) + self.safe + self.ambiguous
+
+    @property
+    def avoided(self):
+        """fraction of queries that did not need to go to DLP"""
+        return 1 - self.ambiguous / self.total if self.total > 0 else 0.
+
+    def triage(self, queries):
+        """sort unique queries into certain hits, certain misses, and ambiguous queries
+
+        Args:
+            queries: ([str,]) unique search queries
+
+        Returns:
+            (dict query -> (info_type, likelihood) of certain hits, [str,] certain misses, [str,] ambiguous)
+        """
+        redacted, safe, ambiguous = {}, [], []
+
+        for q in queries:
+            rule = self.match(q)
+
+            if rule is not None:
+                redacted[q] = (rule[1], VERY_LIKELY)
+                self.hits[rule[0]] += 1
+            elif self.is_safe(q):
+                safe.append(q)
+            else:
+                ambiguous.append(q)
+
+        self.safe += len(safe)
+        self.ambiguous += len(ambiguous)
+
+        return redacted, safe, ambiguous
+
+    def match(self, query):
+        """the first rule that matches the query, or None"""
+        for rule in self.rules:
+            name, info_type, pattern, validator = rule
+
+            for m in pattern.finditer(query):
+                if validator is None or validator(m):
+                    return rule
+
+        return None
+
+    def is_safe(self, query):
+        """a query is safe when it has no digits and every token is on the safe list"""
+        tokens = TOKENS.findall(query.casefold())
+        return len(tokens) > 0 and all([not t.isdigit() and t in self.safe_tokens for t in tokens])
+
+    def summary(self):
+        """a log friendly summary of rule hits and DLP traffic avoided"""
+        hits = ', '.join([f'{name} {n}' for name, n in sorted(self.hits.items())])
+        return f'local redaction hits <{hits if len(hits) > 0 else "none"}>, {self.safe} safe, ' \
+            f'{self.ambiguous} sent on to DLP. {self.avoided:.1%} of DLP traffic avoided'
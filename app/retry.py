@@ -0,0 +1,167 @@
+import random
+from ssl import SSLError
+from threading import Lock
+import time
+
+import requests
+
+import app.config as secrets
+
+"""errors raised when a connection drops or times out. always worth another attempt"""
+CONNECTION_ERRORS = (
+    SSLError,
+    ConnectionError,
+    TimeoutError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+def status_of(x):
+    """the http status of a response, or of an error carrying one (requests, Synapse, and google.api_core errors)"""
+    for s in (
+        getattr(x, 'status_code', None),
+        getattr(getattr(x, 'response', None), 'status_code', None),
+        getattr(x, 'code', None)
+    ):
+        if isinstance(s, int):
+            return s
+
+    return None
+
+
+def retry_after(x):
+    """seconds asked for by a Retry-After header on a response, or on the response of an error, if there is one"""
+    response = x if hasattr(x, 'headers') else getattr(x, 'response', None)
+
+    try:
+        return float(response.headers['Retry-After'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class RetryBudgetExhausted(Exception):
+    """raised instead of retrying when a policy has used up its retry budget"""
+    pass
+
+
+class RetryPolicy(object):
+    """class for retrying calls to Synapse and Google with exponential backoff and jitter"""
+
+    def __init__(self, name, **kwargs):
+        """constructor
+
+        Notes: connection errors, 5xx, and 429 are retried. A 429 with Retry-After waits as long as it asks, anything
+        else waits a random time up to base * 2^attempt capped at cap (full jitter). Successful calls never wait.
+        Retries are limited by a budget of budget_ratio retries per call plus budget_min, so a struggling service
+        is not hammered by every caller at once
+
+        Args:
+            name: (str) name used in metrics
+            attempts: (int) optional. most attempts per call. default RETRY_ATTEMPTS from application config
+            base: (float) optional. seconds before the first retry. default RETRY_BASE_DELAY from application config
+            cap: (float) optional. longest wait between attempts. default RETRY_MAX_DELAY from application config
+            budget_ratio: (float) optional. default RETRY_BUDGET_RATIO from application config
+            budget_min: (int) optional. default RETRY_BUDGET_MIN from application config
+        """
+        self.name = name
+        self.attempts = kwargs.get('attempts', secrets.RETRY_ATTEMPTS)
+        self.base = kwargs.get('base', secrets.RETRY_BASE_DELAY)
+        self.cap = kwargs.get('cap', secrets.RETRY_MAX_DELAY)
+        self.budget_ratio = kwargs.get('budget_ratio', secrets.RETRY_BUDGET_RATIO)
+        self.budget_min = kwargs.get('budget_min', secrets.RETRY_BUDGET_MIN)
+
+        self.calls = 0
+        self.retries = 0
+        self.retry_seconds = 0.
+        self.exhausted = 0
+        self.__lock = Lock()
+
+    def __repr__(self):
+        return f'<RetryPolicy(name={self.name}, calls={self.calls}, retries={self.retries})>'
+
+    @property
+    def stats(self):
+        """retry metrics for this policy"""
+        return {
+            'calls': self.calls,
+            'retries': self.retries,
+            'retry_seconds': round(self.retry_seconds, 3),
+            'budget_exhausted': self.exhausted
+        }
+
+    def delay(self, attempt, x):
+        """seconds to wait before retrying after attempt, or None if the error or response is not worth retrying
+
+        Args:
+            attempt: (int) attempts made so far
+            x: the exception raised or the response returned
+        """
+        status = status_of(x)
+
+        if isinstance(x, Exception) and isinstance(x, CONNECTION_ERRORS) and status is None:
+            pass
+        elif status == 429:
+            asked = retry_after(x)
+            if asked is not None:
+                return min(asked, self.cap)
+        elif status is None or status < 500:
+            return None
+
+        return random.uniform(0, min(self.cap, self.base * 2 ** (attempt - 1)))
+
+    def call(self, fn, *args, **kwargs):
+        """call fn, retrying on retryable errors and on responses with a retryable status
+
+        Notes: a response that is still retryable after the last attempt is returned as is for the caller to handle
+
+        Returns:
+            whatever fn returns
+        """
+        with self.__lock:
+            self.calls += 1
+
+        attempt = 0
+        while True:
+            attempt += 1
+
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                wait = self.delay(attempt, e)
+                if wait is None or attempt >= self.attempts:
+                    raise
+                self.__wait(wait, e)
+                continue
+
+            wait = self.delay(attempt, result) if status_of(result) is not None else None
+            if wait is None or attempt >= self.attempts:
+                return result
+
+            if hasattr(result, 'close'):
+                result.close()
+
+            self.__wait(wait, result)
+
+    def __wait(self, seconds, cause):
+        """spend one retry from the budget and sleep"""
+        with self.__lock:
+            if self.retries >= self.budget_ratio * self.calls + self.budget_min:
+                self.exhausted += 1
+                raise RetryBudgetExhausted(f'{self.name} retry budget exhausted after <{str(cause)}>')
+
+            self.retries += 1
+            self.retry_seconds += seconds
+
+        time.sleep(seconds)
+
+
+"""shared policies for every call to Synapse and to Google (Drive and DLP)"""
+SYNAPSE = RetryPolicy('synapse', attempts=secrets.SYNAPSE_RETRIES)
+GOOGLE = RetryPolicy('google')
+
+
+def retry_stats():
+    """retry metrics of the shared policies"""
+    return {p.name: p.stats for p in (SYNAPSE, GOOGLE)}
@@ -1,14 +1,18 @@
+import atexit
 import datetime as dt
 from flask import Blueprint, render_template, request, session
-from multiprocessing import Process
 from pytz import timezone
 
-import app.context as ctx
 from app.search_consent import oauth2
+from app.search_consent.submissions import respond, SubmissionQueue
 import app.config as secrets
 
 crud = Blueprint('crud', __name__)
 
+"""consent submissions waiting to be written to the database"""
+SUBMISSIONS = SubmissionQueue(size=secrets.SUBMISSION_QUEUE_SIZE, workers=secrets.SUBMISSION_WORKERS)
+atexit.register(SUBMISSIONS.drain, secrets.SUBMISSION_DRAIN_TIMEOUT)
+
 
 @crud.route('/download', methods=['GET', 'POST'])
 @oauth2.required
@@ -40,9 +44,5 @@ def download():
 
         data['credentials'] = session['google_oauth2_credentials']
 
-        # this is bad, i'm leaving a zombie process for the os to cleanup.
-        # it does, but ideally we would have a application level task manager
-        # do this... i.e. celery
-        Process(target=ctx.add_task, args=(data,)).start()
-
-        return 'task submitted'
+        # a small, fixed pool of threads writes consents to the database
+        return respond(SUBMISSIONS, data)
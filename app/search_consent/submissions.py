@@ -0,0 +1,108 @@
+import os
+from queue import Full, Queue
+from threading import Lock, Thread
+import time
+
+import app.config as secrets
+import app.context as ctx
+
+
+class SubmissionQueue(object):
+    """class for handing consent submissions to a small, fixed pool of threads that write them to the database"""
+
+    def __init__(self, size, workers, add_task=None):
+        """constructor
+
+        Notes: threads are started on the first submit in each process, so a web server that forks its workers after
+        import gets a pool per worker. submit never blocks, a full queue is reported to the caller instead
+
+        Args:
+            size: (int) most submissions waiting to be written
+            workers: (int) threads writing submissions
+            add_task: (callable) optional. persists one submission. default context.add_task
+        """
+        self.size = size
+        self.workers = workers
+        self.add_task = add_task if add_task is not None else ctx.add_task
+
+        self.__queue = Queue(maxsize=size)
+        self.__lock = Lock()
+        self.__pid = None
+
+    def __repr__(self):
+        return f'<SubmissionQueue(size={self.size}, workers={self.workers}, waiting={len(self)})>'
+
+    def __len__(self):
+        return self.__queue.qsize()
+
+    def submit(self, data):
+        """queue a consent submission
+
+        Args:
+            data: (dict) containing attributes required to initialize a new Consent object
+
+        Returns:
+            success flag as bool. False if the queue is full and the caller should ask the client to retry
+        """
+        self.__start()
+
+        try:
+            self.__queue.put_nowait(data)
+            return True
+        except Full:
+            return False
+
+    def drain(self, timeout):
+        """wait up to timeout seconds for queued submissions to be written"""
+        deadline = time.time() + timeout
+        while self.__queue.unfinished_tasks > 0 and time.time() < deadline:
+            time.sleep(.1)
+
+    def __start(self):
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+
+            # a forked process inherits the queue but none of the threads
+            self.__pid = os.getpid()
+            self.__queue = Queue(maxsize=self.size)
+
+            for i in range(self.workers):
+                Thread(target=self.__work, name=f'consent-submissions-{i}', daemon=True).start()
+
+    def __work(self):
+        queue = self.__queue
+
+        while True:
+            data = queue.get()
+
+            try:
+                self.add_task(data)
+            except Exception as e:
+                # never log the submission itself, it holds credentials
+                ctx.add_log_entry(f'adding consent for {data.get("study_id")} failed with <{str(e)}>')
+            finally:
+                queue.task_done()
+
+
+def respond(queue, data, retry_after=None):
+    """queue a consent submission and build the response to the client that posted it
+
+    Notes: when the threads writing submissions fall behind the client is asked to retry rather than letting
+    submissions pile up
+
+    Args:
+        queue: (SubmissionQueue) queue the submission is handed to
+        data: (dict) containing attributes required to initialize a new Consent object
+        retry_after: (int) optional. seconds the client is asked to wait. default SUBMISSION_RETRY_AFTER from
+            application config
+
+    Returns:
+        flask response value. 503 with a Retry-After header if the queue is full
+    """
+    retry_after = retry_after if retry_after is not None else secrets.SUBMISSION_RETRY_AFTER
+
+    if not queue.submit(data):
+        return 'too many submissions, please try again shortly', 503, {'Retry-After': str(retry_after)}
+
+    return 'task submitted'
@@ -0,0 +1,262 @@
+from collections import OrderedDict
+from threading import RLock, Timer
+
+from synapseclient.exceptions import SynapseHTTPError
+from synapseclient.table import PartialRow, PartialRowset, Row, RowSet, SelectColumn
+
+from app.retry import SYNAPSE
+
+"""number of internal ids per IN clause when looking up consents table rows"""
+QUERY_SIZE = 200
+
+"""columns of the consents table, in SYN_SCHEMA order"""
+COLUMNS = ['study_id', 'internal_id', 'consent_dt', 'location_sid', 'search_sid', 'notes']
+
+"""columns overwritten when a consent already has a row"""
+UPDATE_COLUMNS = ['location_sid', 'search_sid', 'notes']
+
+"""http status codes Synapse answers with when a row changed underneath an update"""
+CONFLICT_STATUS = (409, 412)
+
+
+def is_conflict(e):
+    """whether a Synapse error means the row changed underneath an update"""
+    return getattr(getattr(e, 'response', None), 'status_code', None) in CONFLICT_STATUS
+
+
+class RowIndex(object):
+    """class for tracking where each consent lives in the Synapse consents table"""
+
+    def __init__(self, client, table_id):
+        """constructor
+
+        Notes: maps (study_id, internal_id) -> (row id, row version, row etag). Filled by load, kept current from the
+        rows this process writes, and patched by refresh for keys it does not know about
+
+        Args:
+            client: (synapseclient.Synapse) or anything with the same tableQuery and getTableColumns
+            table_id: (str) Synapse id of the consents table
+        """
+        self.client = client
+        self.table_id = table_id
+
+        self.__rows = {}
+        self.__column_ids = None
+        self.__lock = RLock()
+
+    def __repr__(self):
+        return f'<RowIndex(table_id={self.table_id}, rows={len(self)})>'
+
+    def __len__(self):
+        return len(self.__rows)
+
+    @property
+    def column_ids(self):
+        """consents table column name -> Synapse column id"""
+        if self.__column_ids is None:
+            columns = SYNAPSE.call(lambda: list(self.client.getTableColumns(self.table_id)))
+            self.__column_ids = {c['name']: c['id'] for c in columns}
+
+        return self.__column_ids
+
+    def get(self, key):
+        """(row id, row version, row etag) of a consent or None if it is not known"""
+        with self.__lock:
+            return self.__rows.get(key)
+
+    def record(self, key, row_id, version):
+        """record where a consent row was appended by this process"""
+        with self.__lock:
+            self.__rows[key] = (row_id, version, None)
+
+    def bump(self, key):
+        """record that a consent row was updated by this process"""
+        with self.__lock:
+            row_id, version, etag = self.__rows[key]
+            self.__rows[key] = (row_id, version + 1, None)
+
+    def load(self):
+        """fill the index from one query over the whole consents table"""
+        rows = self.__query(f'select study_id, internal_id from {self.table_id}')
+
+        with self.__lock:
+            self.__rows = rows
+
+    def refresh(self, keys):
+        """look up the rows of specific consents, dropping the ones that no longer exist
+
+        Args:
+            keys: ([(study_id, internal_id),])
+        """
+        keys = list(keys)
+        found = {}
+        for i in range(0, len(keys), QUERY_SIZE):
+            ids = ', '.join([f"'{k[1]}'" for k in keys[i:i + QUERY_SIZE]])
+            found.update(self.__query(
+                f'select study_id, internal_id from {self.table_id} where internal_id in ({ids})'
+            ))
+
+        with self.__lock:
+            for key in keys:
+                self.__rows.pop(key, None)
+                if key in found:
+                    self.__rows[key] = found[key]
+
+    def after_fork(self):
+        """replace a lock that another thread of the parent process may have held at the fork. rows are kept"""
+        self.__lock = RLock()
+
+    def __query(self, query):
+        """run a consents table query and key the row ids, versions, and etags of the result"""
+        results = SYNAPSE.call(lambda: list(self.client.tableQuery(query, resultsAs='rowset')))
+
+        rows = {}
+        for r in results:
+            key = (r['values'][0], str(r['values'][1]))
+            rows[key] = (r['rowId'], r['versionNumber'], r.get('etag'))
+
+        return rows
+
+
+class WriteBehindBuffer(object):
+    """class for collapsing updates to the Synapse consents table and writing them in bulk"""
+
+    def __init__(self, client, table_id, flush_interval_ms=0):
+        """constructor
+
+        Notes: staged rows are keyed by (study_id, internal_id) so only the latest state of each consent is written.
+        Rows are written when flush is called, or flush_interval_ms after the first row is staged if it is above zero
+
+        Args:
+            client: (synapseclient.Synapse) or anything with the same tableQuery, getTableColumns, and store
+            table_id: (str) Synapse id of the consents table
+            flush_interval_ms: (int) optional. flush this long after a row is first staged. 0 waits for flush
+        """
+        self.client = client
+        self.table_id = table_id
+        self.flush_interval_ms = flush_interval_ms
+        self.index = RowIndex(client, table_id)
+
+        self.__pending = OrderedDict()
+        self.__lock = RLock()
+        self.__timer = None
+
+    def __repr__(self):
+        return f'<WriteBehindBuffer(table_id={self.table_id}, pending={len(self)})>'
+
+    def __len__(self):
+        return len(self.__pending)
+
+    def stage(self, row):
+        """stage the latest state of a consent row
+
+        Args:
+            row: (list) values in COLUMNS order
+        """
+        with self.__lock:
+            key = (row[0], str(row[1]))
+            self.__pending.pop(key, None)
+            self.__pending[key] = row
+
+            if self.flush_interval_ms > 0 and self.__timer is None:
+                self.__timer = Timer(self.flush_interval_ms / 1000., self.flush)
+                self.__timer.daemon = True
+                self.__timer.start()
+
+    def flush(self):
+        """write every staged row to Synapse as one partial update of the existing rows and one append of the new rows
+
+        Notes: row ids come from the row index. Only consents missing from the index are looked up, in one query, and
+        appended rows are added to the index from the row references Synapse returns. Rows that fail to write are
+        staged again unless a newer state was staged in the meantime
+
+        Returns:
+            (int) number of rows written
+        """
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+
+            rows, self.__pending = self.__pending, OrderedDict()
+
+        if len(rows) == 0:
+            return 0
+
+        try:
+            unknown = [key for key in rows.keys() if self.index.get(key) is None]
+            if len(unknown) > 0:
+                self.index.refresh(unknown)
+
+            updates = [key for key in rows.keys() if self.index.get(key) is not None]
+            gone = self.__update(updates, rows) if len(updates) > 0 else []
+
+            new = [key for key in rows.keys() if key not in updates or key in gone]
+            if len(new) > 0:
+                self.__append(new, rows)
+
+            return len(rows)
+        except Exception:
+            with self.__lock:
+                for key, row in rows.items():
+                    if key not in self.__pending:
+                        self.__pending[key] = row
+            raise
+
+    def after_fork(self):
+        """drop rows inherited from the parent process, which remains responsible for writing them"""
+        self.__pending = OrderedDict()
+        self.__lock = RLock()
+        self.__timer = None
+        self.index.after_fork()
+
+    def __update(self, keys, rows):
+        """partially update the rows of known consents, refreshing their row ids once if Synapse reports a conflict
+
+        Returns:
+            ([(study_id, internal_id),]) consents whose rows turned out to be deleted and have to be appended instead
+        """
+        gone = []
+
+        try:
+            self.__store(self.__partial_rowset(keys, rows))
+        except SynapseHTTPError as e:
+            if not is_conflict(e):
+                raise
+
+            self.index.refresh(keys)
+            gone = [key for key in keys if self.index.get(key) is None]
+            keys = [key for key in keys if key not in gone]
+
+            if len(keys) > 0:
+                self.__store(self.__partial_rowset(keys, rows))
+
+        for key in keys:
+            self.index.bump(key)
+
+        return gone
+
+    def __append(self, keys, rows):
+        """append the rows of new consents as one row set and index the row ids Synapse gives them"""
+        headers = [SelectColumn(id=self.index.column_ids[c]) for c in COLUMNS]
+        values = [Row([None if v is None else str(v) for v in rows[key]]) for key in keys]
+
+        refs = self.__store(RowSet(headers=headers, tableId=self.table_id, rows=values))
+
+        # row references come back in the order the rows were sent
+        for key, ref in zip(keys, refs['rows']):
+            self.index.record(key, ref['rowId'], ref['versionNumber'])
+
+    def __partial_rowset(self, keys, rows):
+        """build partial row updates of UPDATE_COLUMNS for consents in the row index"""
+        partial = []
+        for key in keys:
+            row_id, version, etag = self.index.get(key)
+            values = {c: rows[key][COLUMNS.index(c)] for c in UPDATE_COLUMNS}
+            partial.append(PartialRow(values, row_id, etag=etag, nameToColumnId=self.index.column_ids))
+
+        return PartialRowset(self.table_id, partial)
+
+    def __store(self, obj):
+        """store to the consents table under the shared Synapse retry policy. conflicts are not retried"""
+        return SYNAPSE.call(self.client.store, obj)
@@ -0,0 +1,135 @@
+import select
+import socket
+
+from sqlalchemy import text
+
+import app.config as secrets
+
+"""notification sent on WAKE_CHANNEL by notify when the db is Postgres"""
+NOTIFY = text("SELECT pg_notify(:channel, '')")
+
+
+def is_postgres(engine):
+    return engine.dialect.name == 'postgresql'
+
+
+def notify(engine):
+    """wake archive agent workers waiting for new tasks
+
+    Notes: on Postgres a NOTIFY on WAKE_CHANNEL reaches workers on any host. Otherwise a datagram is sent to the port of
+    every worker on this host, WAKE_PORT and the ARCHIVE_AGENT_WORKERS - 1 ports after it, so a busy worker never
+    swallows the signal. Best effort, a worker that misses the signal still finds the task on its next poll
+
+    Args:
+        engine: (sqlalchemy.engine.Engine) engine of the task database
+
+    Returns:
+        (str) why the signal could not be sent or None
+    """
+    try:
+        if is_postgres(engine):
+            # a notification is only delivered once its transaction commits
+            with engine.begin() as c:
+                c.execute(NOTIFY, channel=secrets.WAKE_CHANNEL)
+        else:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                for slot in range(max(secrets.ARCHIVE_AGENT_WORKERS, 1)):
+                    s.sendto(b'wake', ('127.0.0.1', secrets.WAKE_PORT + slot))
+    except Exception as e:
+        return str(e)
+
+    return None
+
+
+class WakeListener(object):
+    """class for waiting on new task signals sent by notify, with timed polling as the fallback"""
+
+    def __init__(self, engine, slot=0):
+        """constructor
+
+        Notes: on Postgres a dedicated connection LISTENs on WAKE_CHANNEL. Otherwise a datagram socket is bound to
+        WAKE_PORT + slot on this host. If neither can be set up, wait simply sleeps out its timeout
+
+        Args:
+            engine: (sqlalchemy.engine.Engine) engine of the task database
+            slot: (int) optional. index of the worker among ARCHIVE_AGENT_WORKERS. only used without Postgres
+        """
+        self.engine = engine
+        self.slot = slot
+        self.error = None
+
+        self.__connection = None
+        self.__socket = None
+
+        try:
+            if is_postgres(engine):
+                self.__listen()
+            else:
+                self.__bind()
+        except Exception as e:
+            self.error = str(e)
+            self.close()
+
+    def __repr__(self):
+        return f'<WakeListener(slot={self.slot}, listening={self.listening})>'
+
+    @property
+    def listening(self):
+        return self.__connection is not None or self.__socket is not None
+
+    def __listen(self):
+        """LISTEN on a connection of its own that is never handed back to the pool"""
+        proxy = self.engine.raw_connection()
+        proxy.detach()
+
+        # pre-ping leaves a transaction open, and psycopg2 refuses to switch to autocommit inside one
+        self.__connection = proxy.connection
+        self.__connection.rollback()
+        self.__connection.autocommit = True
+
+        with self.__connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {secrets.WAKE_CHANNEL}')
+
+    def __bind(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.bind(('127.0.0.1', secrets.WAKE_PORT + self.slot))
+        s.setblocking(False)
+        self.__socket = s
+
+    def wait(self, timeout):
+        """block until a new task signal arrives or timeout seconds pass
+
+        Returns:
+            True if woken by a signal, False on timeout
+        """
+        if not self.listening:
+            select.select([], [], [], max(timeout, 0))
+            return False
+
+        source = self.__connection if self.__connection is not None else self.__socket
+        ready, _, _ = select.select([source], [], [], max(timeout, 0))
+
+        if len(ready) == 0:
+            return False
+
+        # drain every pending signal so a burst of new tasks wakes the worker once
+        if self.__connection is not None:
+            self.__connection.poll()
+            del self.__connection.notifies[:]
+        else:
+            try:
+                while True:
+                    self.__socket.recv(64)
+            except (BlockingIOError, InterruptedError):
+                pass
+
+        return True
+
+    def close(self):
+        if self.__connection is not None:
+            self.__connection.close()
+            self.__connection = None
+
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
@@ -4,13 +4,15 @@ import argparse
 import datetime as dt
 import gc
 import re
-from io import BytesIO
+from io import BytesIO, TextIOWrapper
 import json
 import numpy as np
 from multiprocessing.dummy import Pool as TPool
 import os
 from pytz import timezone as tz
+import shutil
 import sys
+import tempfile
 from zipfile import ZipFile
 
 import google.cloud.dlp as dlp
@@ -23,12 +25,63 @@ from synapseclient import File, Activity
 
 import app.config as secrets
 import app.context as ctx
+from app.drive import RangedDownload, RangeNotSupported
+from app.inspection import DlpDispatcher
+from app.retry import GOOGLE, SYNAPSE
+from app.redaction import PreRedactor
 
 syn = secrets.syn
 
 """generate a single authorized client for all tasks"""
 __dlp = dlp.DlpServiceClient()
 
+"""columns written for location data"""
+LOCATION_COLUMNS = ('time', 'lat', 'lon', 'accuracy', 'velocity', 'altitude', 'activity')
+
+"""columns of the optional long table of location activity samples"""
+ACTIVITY_COLUMNS = ('time', 'activity_time', 'type', 'confidence')
+
+"""activity types reported by Location History. unexpected types are appended to the categories as they appear"""
+ACTIVITY_TYPES = [
+    'EXITING_VEHICLE', 'IN_BUS', 'IN_CAR', 'IN_FOUR_WHEELER_VEHICLE', 'IN_RAIL_VEHICLE', 'IN_ROAD_VEHICLE',
+    'IN_TWO_WHEELER_VEHICLE', 'IN_VEHICLE', 'ON_BICYCLE', 'ON_FOOT', 'RUNNING', 'STILL', 'TILTING', 'UNKNOWN',
+    'WALKING'
+]
+
+"""patterns used to step through the 'locations' array of a Location History file"""
+LOCATIONS_ARRAY = re.compile(r'"locations"\s*:\s*\[')
+RECORD_SEPARATOR = re.compile(r'[\s,]*')
+
+"""patterns used to cut "My Activity" html into blocks and pull (title, url, time) from each block"""
+SEARCH_BLOCK_START = re.compile(r'<div class="outer-cell[^>]*?mdl-shadow--2dp">')
+SEARCH_BLOCK_START_MAX = 256
+SEARCH_BLOCK_END = '</div></div></div>'
+SEARCHED_FOR = re.compile(r'Searched for.+?">(.+?)</a><br>(.*?)</div>')
+VISITED = re.compile(r'Visited.*?href="([^"]*)">(.*?)</a><br>(.*?)</div')
+
+"""Takeout timestamp formats as (name, detection pattern, strptime format of the part before the zone)"""
+TIMESTAMP_FORMATS = [
+    ('iso8601', re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}'), None),
+    ('activity-12h', re.compile(r'^[A-Z][a-z]{2} \d{1,2}, \d{4}, \d{1,2}:\d{2}:\d{2} [AP]M'), '%b %d, %Y, %I:%M:%S %p'),
+    ('activity-24h', re.compile(r'^\d{1,2} [A-Z][a-z]{2} \d{4}, \d{1,2}:\d{2}:\d{2}'), '%d %b %Y, %H:%M:%S'),
+]
+
+"""splits an activity timestamp into its stamp and an optional trailing zone"""
+TIMESTAMP_ZONE = re.compile(
+    r'^(?P<stamp>.*?\d{1,2}:\d{2}:\d{2}(?: [AP]M)?)(?:\s+(?P<zone>[A-Z]{2,5}|(?:GMT|UTC)[+-][\d:]+))?$'
+)
+
+"""UTC offsets in hours for the timezone abbreviations Takeout writes"""
+TIMEZONE_OFFSETS = {
+    'UTC': 0, 'GMT': 0, 'BST': 1, 'CET': 1, 'CEST': 2, 'EET': 2, 'EEST': 3, 'IST': 5.5,
+    'HST': -10, 'AKST': -9, 'AKDT': -8, 'PST': -8, 'PDT': -7, 'MST': -7, 'MDT': -6,
+    'CST': -6, 'CDT': -5, 'EST': -5, 'EDT': -4, 'AST': -4, 'ADT': -3
+}
+TIMEZONE_TZINFOS = {k: int(v * 3600) for k, v in TIMEZONE_OFFSETS.items()}
+
+"""downloaded takeout parts and their manifests in ARCHIVE_AGENT_TMP_DIR, named takeout-<internal_id>-<file id>.zip"""
+DOWNLOAD_FILE = re.compile(r'^takeout-(?P<internal_id>\d+)-(?P<tid>.+?)\.zip(?:\.manifest(?:\.tmp)?)?$')
+
 """takeout errors"""
 DRIVE_NOT_READY = 'drive not ready'
 ARCHIVE_STRUCTURE_FAILURE = 'takeout archive has no content'
@@ -55,21 +108,37 @@ class TakeOutExtractor(object):
         else:
             self.__authorized_session = self.authorize_user_session()
 
-        self.__zip_stream = None
+        self.__parts = []
+        self.__scanner = None
+        self.__scans = []
+        self.__scanned = None
+        self.__scan_error = None
         self.__tmp_files = []
-        self.__tid = None
+        self.__tids = None
         self.__search_queries = None
         self.cleaned_search_file = None
         self.cleaned_gps_file = None
+        self.cleaned_activity_file = None
 
     def __repr__(self):
         return f'<TakeOutExtractor({str(self.consent)})>'
 
     def __del__(self):
-        """make sure we don't leave any streams leaking or tmp files in the OS"""
-        if hasattr(self, '__zip_stream') and self.__zip_stream is not None:
-            self.__zip_stream.close()
-            del self.__zip_stream
+        """make sure we don't leave any streams leaking, worker threads running, or tmp files in the OS"""
+        if self.__scanner is not None:
+            # let running scans finish so the csv files they write are known. terminate does not stop threads
+            self.__scanner.close()
+            self.__scanner.join()
+            self.__scanner = None
+
+            # parts scanned before the task gave up, e.g. when another part failed to download
+            self.__collect_scans()
+
+        for part in self.__parts:
+            if isinstance(part, BytesIO):
+                part.close()
+
+        del self.__parts
 
         for tmp in self.__tmp_files:
             if os.path.exists(tmp['path']):
@@ -79,20 +148,24 @@ class TakeOutExtractor(object):
         gc.collect()
 
     @property
-    def takeout_id(self):
-        """get the takeout id
+    def takeout_ids(self):
+        """get the file ids of every part of the latest takeout export
+
+        Notes: Google splits large exports into takeout-<timestamp>-001.zip, takeout-<timestamp>-002.zip, ... All parts
+        sharing the latest timestamp are returned
+
         Returns:
-            (str) to represent the id if the takeout data is ready else DRIVE_NOT_READY
+            ([str,]) file ids ordered by part name if the takeout data is ready else DRIVE_NOT_READY
         """
-        if self.__tid is not None:
-            return self.__tid
+        if self.__tids is not None:
+            return self.__tids
 
         elif self.__archive_path is not None:
-            self.__tid = 'local'
-            return self.__tid
+            self.__tids = ['local']
+            return self.__tids
 
         else:
-            response = self.__authorized_session.get(secrets.TAKEOUT_URL)
+            response = GOOGLE.call(self.__authorized_session.get, secrets.TAKEOUT_URL)
 
             if response.status_code == 200:
                 content = json.loads(response.content).get('files')
@@ -104,8 +177,9 @@ class TakeOutExtractor(object):
                         df['timeStamp'] = df.name.str.split('-', 3).apply(lambda x: x[1])
                         df['timeStamp'] = pd.to_datetime(df['timeStamp'])
 
-                        self.__tid = df.id[df.timeStamp.idxmax()]
-                        return self.__tid
+                        latest = df[df.timeStamp == df.timeStamp.max()].sort_values('name')
+                        self.__tids = latest.id.tolist()
+                        return self.__tids
                     else:
                         return DRIVE_NOT_READY
                 else:
@@ -116,8 +190,13 @@ class TakeOutExtractor(object):
                 return TAKEOUT_URL_FAILURE
 
     @property
-    def zipped(self):
-        return ZipFile(self.__zip_stream)
+    def takeout_id(self):
+        """get the takeout id of the first part of the latest export
+        Returns:
+            (str) to represent the id if the takeout data is ready else DRIVE_NOT_READY
+        """
+        tids = self.takeout_ids
+        return tids[0] if isinstance(tids, list) else tids
 
     def authorize_user_session(self):
         """authorize the HTTP session with consent credentials
@@ -126,16 +205,7 @@ class TakeOutExtractor(object):
             AuthorizedSession
         """
         try:
-            jdata = json.loads(self.consent.credentials)
-            credentials = Credentials(
-                token=jdata['access_token'],
-                refresh_token=jdata['refresh_token'],
-                token_uri=jdata['token_uri'],
-                client_id=jdata['client_id'],
-                client_secret=jdata['client_secret']
-            )
-
-            return AuthorizedSession(credentials)
+            return authorized_session(self.consent)
         except TypeError as e:
             if any(['NoneType' in a for a in e.args]):
                 self.consent.add_search_error()
@@ -162,74 +232,213 @@ class TakeOutExtractor(object):
         self.consent.update_synapse()
 
     def download_takeout_data(self):
-        """download takeout archive from Google Drive
+        """download every part of the takeout export from Google Drive
+
+        Notes: up to DOWNLOAD_PARTS parts are downloaded concurrently and each part is handed to the extraction workers
+        as soon as it lands. Parts no larger than DOWNLOAD_MEMORY_CEILING are held in memory. Larger parts are fetched as
+        concurrent byte ranges into ARCHIVE_AGENT_TMP_DIR. If any part fails the consent is put back to DRIVE_NOT_READY
+        and the next attempt resumes from the parts and ranges already on disk
+
         Returns:success flag as bool
         """
         if self.__authorized_session is None:
             return False
 
         try:
-            url = f'https://www.googleapis.com/drive/v3/files/{self.takeout_id}?alt=media'
-            response = self.__authorized_session.get(url)
+            tids = self.takeout_ids
+            paths = {
+                tid: self.__filename(f'takeout-{self.consent.internal_id}-{tid}.zip')
+                for tid in tids
+            }
 
-            if response.status_code == 200:
-                self.__zip_stream = BytesIO(response.content)
-                self.__log_it(f'takeout archive downloaded')
+            # parts of an earlier export can never be resumed once a newer export replaced it
+            remove_downloads(self.consent.internal_id, keep=tids)
+
+            pool = TPool(min(len(tids), secrets.DOWNLOAD_PARTS))
+            try:
+                results = []
+                for result in pool.imap_unordered(lambda tid: self.__download_part(tid, paths[tid]), tids):
+                    if result['source'] is not None:
+                        self.__add_part(result['source'])
+                    results.append(result)
+            finally:
+                pool.close()
+                pool.join()
+
+            failed = [r for r in results if r['source'] is None]
+
+            if len(failed) == 0:
+                for r in results:
+                    self.__tmp_files.extend([{'path': p} for p in r['files']])
+
+                self.__log_it(f'takeout archive downloaded in {len(tids)} part{"s" if len(tids) > 1 else ""}')
                 return True
             else:
+                self.consent.mark_drive_not_ready()
+                self.__log_it(
+                    f'Google Drive for {self.consent.study_id} not ready. {len(failed)} of {len(tids)} takeout parts '
+                    f'did not download with <{failed[0]["error"]}>'
+                )
                 return False
         except Exception as e:
             self.__log_it(f'downloading takeout data failed with <{str(e)}>')
             return False
 
+    def __download_part(self, tid, filename):
+        """download one part of the takeout export
+
+        Notes: runs on a download worker thread so it must not log or touch the consent
+
+        Args:
+            tid: (str) Google Drive file id of the part
+            filename: (str) where to put the part if it is too large to hold in memory
+
+        Returns:
+            dict with the downloaded source (path or BytesIO, None on failure), files to remove once the task is done,
+            and the error message on failure
+        """
+        result = {'source': None, 'files': [], 'error': None}
+
+        try:
+            download = RangedDownload(self.__authorized_session, tid, filename)
+
+            if download.fetch_size() <= secrets.DOWNLOAD_MEMORY_CEILING:
+                return self.__stream_part(tid, filename, result)
+
+            if download.run():
+                result['source'] = filename
+                result['files'] = [filename, download.manifest_path]
+            else:
+                result['error'] = f'{download.error}. {len(download.pending)} of {len(download.ranges)} ranges remaining'
+        except RangeNotSupported:
+            return self.__stream_part(tid, filename, result)
+        except Exception as e:
+            result['error'] = str(e)
+
+        return result
+
+    def __stream_part(self, tid, filename, result):
+        """download one part of the takeout export as a single streamed request
+
+        Notes: the part is streamed in chunks of DOWNLOAD_CHUNK_SIZE bytes. Parts larger than DOWNLOAD_MEMORY_CEILING,
+        or of unknown size, are written to filename so memory use does not grow with the size of the archive
+
+        Returns:
+            result updated with the downloaded source
+        """
+        url = f'https://www.googleapis.com/drive/v3/files/{tid}?alt=media'
+
+        try:
+            with GOOGLE.call(self.__authorized_session.get, url, stream=True) as response:
+                if response.status_code != 200:
+                    result['error'] = f'download failed with status <{response.status_code}>'
+                    return result
+
+                size = int(response.headers.get('Content-Length', -1))
+
+                if 0 <= size <= secrets.DOWNLOAD_MEMORY_CEILING:
+                    result['source'] = BytesIO(response.content)
+                else:
+                    result['files'] = [filename]
+
+                    with open(filename, 'wb') as out:
+                        for chunk in response.iter_content(chunk_size=secrets.DOWNLOAD_CHUNK_SIZE):
+                            out.write(chunk)
+
+                    result['source'] = filename
+        except Exception as e:
+            result['error'] = str(e)
+
+        return result
+
     def load_from_local(self):
         """load takeout archive from local filesystem"""
         if self.__archive_path is None:
             return False
         try:
-            with open(self.__archive_path, 'rb') as f:
-                self.__zip_stream = BytesIO(f.read())
-            
+            # open once to make sure the archive is readable, then leave it on disk
+            ZipFile(self.__archive_path).close()
+            self.__add_part(self.__archive_path)
+
             self.__log_it('takeout archive loaded from filesystem')
             return True
         except Exception as e:
             self.__log_it(f'loading takeout data from filesystem failed with <{str(e)}>')
             return False
 
+    def __add_part(self, source):
+        """queue a downloaded archive part for extraction on the bounded pool of EXTRACTION_WORKERS threads"""
+        if self.__scanner is None:
+            self.__scanner = TPool(secrets.EXTRACTION_WORKERS)
+
+        self.__parts.append(source)
+        self.__scans.append(self.__scanner.apply_async(scan_archive, (source, self.__filename(''))))
+
+    def __scanned_members(self, kind):
+        """wait for every queued part to be extracted and return the member records of one kind
+
+        Notes: the location csv files of every part are tracked for removal, even when another part failed
+
+        Args:
+            kind: (str) 'searches' or 'locations'
+
+        Returns:
+            [dict,] see scan_archive
+        """
+        if self.__scanned is None:
+            self.__scanned, self.__scan_error = self.__collect_scans()
+
+            self.__scanner.close()
+            self.__scanner.join()
+            self.__scanner = None
+
+        if self.__scan_error is not None:
+            raise self.__scan_error
+
+        return [r for r in self.__scanned if r['kind'] == kind]
+
+    def __collect_scans(self):
+        """wait for the queued parts to be extracted, gathering their member records and tracking the location csv
+        files they wrote
+
+        Returns:
+            ([dict,] member records, the first error raised by a scan or None)
+        """
+        records, error = [], None
+
+        for scan in self.__scans:
+            try:
+                records.extend(scan.get())
+            except Exception as e:
+                error = e if error is None else error
+
+        self.__tmp_files.extend([
+            {'path': r[k]} for r in records for k in ('data', 'detail') if r['kind'] == 'locations' and r[k] is not None
+        ])
+
+        return records, error
+
     def extract_searches(self):
         """extract search data from takeout archive
         Returns:success flag as bool
         """
         try:
-            search_files = [f for f in self.zipped.namelist() if 'Search' in f]
+            search_files = self.__scanned_members('searches')
 
             if len(search_files) > 0:
                 self.__log_it(f'Found <{len(search_files)}> search files')
 
                 dfs = []
-                for fn in search_files:
-                    prefix, suffix = str(fn).split('.')
-                    self.__log_it(f'Processing file {fn} with suffix {suffix}')
-
-                    ## Process JSON search file
-                    if suffix == 'json':                        
-                        with self.zipped.open(fn) as f:
-                            s = f.read().decode('utf-8')
-                            df = pd.DataFrame(json.loads(s))
-                            df['action'] = df.title.str.extract(r'(?P<action>Visited|Searched)')
-                            df.title = df.title.str.replace('Visited ', '')
-                            df.title = df.title.str.replace('Searched for ', '')
-                            dfs.append(df)
-
-                    #Process HTML search file
-                    elif suffix == 'html':
-                        with open('tmp.html', 'wb') as out:
-                            out.write(self.zipped.open(fn).read())
-                            out.close()
-                            df, numTotalBlocks, numErrorBlocks = process_userSearchQueries_in_htmlFormat('tmp.html')
-                            self.__log_it(f'HTML File had {numTotalBlocks} blocks with {numErrorBlocks} blocks failed parsing')
-                            dfs.append(df)
-                        os.remove('tmp.html')
+                for member in search_files:
+                    self.__log_it(f'Processing file {member["name"]}')
+
+                    if member['error'] is not None:
+                        raise Exception(member['error'])
+
+                    if member['note'] is not None:
+                        self.__log_it(member['note'])
+
+                    dfs.append(member['data'])
 
                 search_queries = pd.concat(dfs, sort=False)
 
@@ -260,7 +469,15 @@ class TakeOutExtractor(object):
             df = self.__search_queries
             uniqueSearchQueries = df.title.to_list()
             ## Run the text queries through DLP api
-            dlp_results = run_dlp_api(uniqueSearchQueries)
+            redactor = PreRedactor()
+            before = ctx.dlp_cache_stats()
+            dlp_results = run_dlp_api(uniqueSearchQueries, redactor)
+            after = ctx.dlp_cache_stats()
+            self.__log_it(redactor.summary())
+            self.__log_it(
+                f'DLP verdict cache answered {after["hits"] - before["hits"]} queries, '
+                f'{after["misses"] - before["misses"]} sent to DLP'
+            )
             #merge the DLP results
             df = df.merge(dlp_results, how='left', left_on='title', right_on='title')
             toRedact = ~df.info_type.isnull()
@@ -283,24 +500,29 @@ class TakeOutExtractor(object):
         Returns: success flag as bool
         """
         try:
-            gps_files = [ f for f in self.zipped.namelist() if 'Location History' in f ]
+            gps_files = self.__scanned_members('locations')
 
             if len(gps_files) > 0:
-                dfs = []
-                for fn in gps_files:
-                    with open('tmp.json', 'wb') as out:
-                        out.write(self.zipped.open(fn).read())
-                        out.close()
-                        dfs.append(parse_google_location_data('tmp.json'))
-                os.remove('tmp.json')
-                df = pd.concat(dfs, sort=False)
+                for member in gps_files:
+                    if member['error'] is not None:
+                        raise Exception(member['error'])
+
+                    self.__log_it(member['note'])
 
                 filename = self.__filename(
                     secrets.SYNAPSE_LOCATION_NAMING_CONVENTION.format(studyId=self.consent.study_id, 
                         internalID=self.consent.internal_id)
                 )
-                df.to_csv(filename, index=None)
+                stitch_csv([member['data'] for member in gps_files], filename)
                 self.cleaned_gps_file = filename
+
+                if secrets.LOCATION_ACTIVITY_DETAIL:
+                    filename = self.__filename(
+                        secrets.SYNAPSE_ACTIVITY_NAMING_CONVENTION.format(studyId=self.consent.study_id,
+                            internalID=self.consent.internal_id)
+                    )
+                    stitch_csv([member['detail'] for member in gps_files], filename)
+                    self.cleaned_activity_file = filename
                 self.__log_it(f'location data extracted')
                 return True
             else:
@@ -320,11 +542,11 @@ class TakeOutExtractor(object):
         count = 0
         def tmp(self, path, setter, parent):        
             try:
-                result = syn.store(File(path, parentId=parent))
+                result = SYNAPSE.call(syn.store, File(path, parentId=parent))
                 synid = result.properties['id']
                 setter(synid)
-                syn.setProvenance(synid, activity=Activity( name='gTap Archive Manager'))
-                syn.setAnnotations( synid, annotations={    
+                SYNAPSE.call(syn.setProvenance, synid, activity=Activity( name='gTap Archive Manager'))
+                SYNAPSE.call(syn.setAnnotations, synid, annotations={
                     'study_id': self.consent.study_id,
                     'internal_id': self.consent.internal_id
                     }
@@ -346,6 +568,12 @@ class TakeOutExtractor(object):
             setter = self.consent.set_location_sid
             tmp(self, self.cleaned_gps_file, setter, parent)
             count += 1
+
+        if self.cleaned_activity_file is not None:
+            parent = secrets.LOCATION_SYNID
+            setter = self.consent.set_location_sid
+            tmp(self, self.cleaned_activity_file, setter, parent)
+            count += 1
         return count
 
 
@@ -355,7 +583,7 @@ class TakeOutExtractor(object):
             self.consent.mark_as_failure(self.takeout_id)
 
         elif self.takeout_id == DRIVE_NOT_READY:
-            self.consent.set_status(ctx.ConsentStatus.DRIVE_NOT_READY)
+            self.consent.mark_drive_not_ready()
             self.__log_it(f'Google Drive for {self.consent.study_id} not ready')
 
         else:
@@ -378,40 +606,362 @@ class TakeOutExtractor(object):
 
 
 
-def process_userSearchQueries_in_htmlFormat(html_file):
+def authorized_session(consent):
+    """build an HTTP session authorized with the consent's credentials
+
+    Returns:
+        AuthorizedSession
+    """
+    jdata = consent.credential_fields
+    credentials = Credentials(
+        token=jdata['access_token'],
+        refresh_token=jdata['refresh_token'],
+        token_uri=jdata['token_uri'],
+        client_id=jdata['client_id'],
+        client_secret=jdata['client_secret']
+    )
+
+    return AuthorizedSession(credentials)
+
+
+def probe_drive(consent):
+    """cheaply check whether a consent's takeout export has shown up in Google Drive
+
+    Notes: a single listing of TAKEOUT_URL, without building a TakeOutExtractor. Anything other than a clean answer is
+    left for the extractor to handle and report
+
+    Args:
+        consent: (gtap.context.Consent)
+
+    Returns:
+        True if takeout files are listed, False if the listing is empty, None if it could not tell
+    """
+    try:
+        response = GOOGLE.call(authorized_session(consent).get, secrets.TAKEOUT_URL)
+
+        if response.status_code != 200:
+            return None
+
+        files = json.loads(response.content).get('files')
+        return None if files is None else len(files) > 0
+    except Exception:
+        return None
+
+
+def remove_downloads(internal_id, keep=()):
+    """remove a consent's downloaded takeout parts and manifests from ARCHIVE_AGENT_TMP_DIR
+
+    Args:
+        internal_id: (int) the consent
+        keep: ([str,]) optional. file ids of parts to keep, e.g. the parts of the current export
+
+    Returns:
+        (int) number of files removed
+    """
+    count = 0
+
+    for fn in os.listdir(secrets.ARCHIVE_AGENT_TMP_DIR):
+        m = DOWNLOAD_FILE.match(fn)
+
+        if m is not None and int(m.group('internal_id')) == internal_id and m.group('tid') not in keep:
+            try:
+                os.remove(os.path.join(secrets.ARCHIVE_AGENT_TMP_DIR, fn))
+                count += 1
+            except FileNotFoundError:
+                pass
+
+    return count
+
+
+def sweep_downloads(conn=None):
+    """remove downloaded takeout parts and manifests that no consent will resume
+
+    Notes: run when the archive agent starts. Files of consents that are gone or COMPLETE or FAILED are removed, and so
+    is anything last written longer than MAX_TIME_FOR_DRIVE_WAIT ago
+
+    Args:
+        conn: (dict) optional DB connection. will use application config if not provided
+
+    Returns:
+        (int) number of files removed
+    """
+    files = {}
+    for fn in os.listdir(secrets.ARCHIVE_AGENT_TMP_DIR):
+        m = DOWNLOAD_FILE.match(fn)
+        if m is not None:
+            files[fn] = int(m.group('internal_id'))
+
+    if len(files) == 0:
+        return 0
+
+    with ctx.session_scope(conn) as s:
+        statuses = dict(s.query(ctx.Consent.internal_id, ctx.Consent.status).filter(
+            ctx.Consent.internal_id.in_(list(set(files.values())))
+        ))
+
+    active = [
+        ctx.ConsentStatus.READY.value, ctx.ConsentStatus.PROCESSING.value, ctx.ConsentStatus.DRIVE_NOT_READY.value
+    ]
+    oldest = dt.datetime.now().timestamp() - secrets.MAX_TIME_FOR_DRIVE_WAIT
+
+    count = 0
+    for fn, internal_id in files.items():
+        path = os.path.join(secrets.ARCHIVE_AGENT_TMP_DIR, fn)
+
+        try:
+            if statuses.get(internal_id) not in active or os.path.getmtime(path) < oldest:
+                os.remove(path)
+                count += 1
+        except FileNotFoundError:
+            pass
+
+    return count
+
+
+def scan_archive(source, workdir):
+    """extract every search and location member of one takeout archive part
+
+    Notes: runs on an extraction worker thread. Failures are recorded per member rather than raised so the caller can
+    report them against the consent
+
+    Args:
+        source: (str or BytesIO) path to, or in memory copy of, the archive part
+        workdir: (str) directory to write location csv files into
+
+    Returns:
+        [dict,] one record per member with keys kind ('searches' or 'locations'), name, data (pandas.DataFrame of
+        searches, or path to a location csv file), detail (path to an activity csv file or None), note (str message to
+        log or None), and error (str or None)
+    """
+    records = []
+
+    with ZipFile(source) as zipped:
+        for fn in zipped.namelist():
+            if 'Search' in fn:
+                kind = 'searches'
+            elif 'Location History' in fn:
+                kind = 'locations'
+            else:
+                continue
+
+            record = {'kind': kind, 'name': fn, 'data': None, 'detail': None, 'note': None, 'error': None}
+
+            try:
+                if kind == 'searches':
+                    record['data'], record['note'] = parse_search_member(zipped, fn)
+                else:
+                    fd, path = tempfile.mkstemp(prefix='locations-', suffix='.csv', dir=workdir)
+                    os.close(fd)
+                    record['data'] = path
+
+                    if secrets.LOCATION_ACTIVITY_DETAIL:
+                        fd, record['detail'] = tempfile.mkstemp(prefix='activities-', suffix='.csv', dir=workdir)
+                        os.close(fd)
+
+                    with zipped.open(fn) as f:
+                        count = parse_google_location_data(f, path, activity_path=record['detail'])
+                        record['note'] = f'{fn} had {count} locations'
+            except Exception as e:
+                record['error'] = str(e)
+
+            if kind == 'locations' or record['data'] is not None or record['error'] is not None:
+                records.append(record)
+
+    return records
+
+
+def parse_search_member(zipped, fn):
+    """parse one search file from a takeout archive
+
+    Args:
+        zipped: (ZipFile) open takeout archive part
+        fn: (str) member name of the search file
+
+    Returns:
+        (pandas.DataFrame or None if the member is not a search file, str note to log or None)
+    """
+    suffix = os.path.splitext(fn)[1].lstrip('.')
+
+    ## Process JSON search file
+    if suffix == 'json':
+        with zipped.open(fn) as f:
+            s = f.read().decode('utf-8')
+            df = pd.DataFrame(json.loads(s))
+            df['action'] = df.title.str.extract(r'(?P<action>Visited|Searched)')
+            df.title = df.title.str.replace('Visited ', '')
+            df.title = df.title.str.replace('Searched for ', '')
+            note = None
+
+    #Process HTML search file
+    elif suffix == 'html':
+        with zipped.open(fn) as f:
+            df, numTotalBlocks, numErrorBlocks = process_userSearchQueries_in_htmlFormat(
+                f, max_block_size=secrets.SEARCH_HTML_MAX_BLOCK
+            )
+            note = f'HTML File had {numTotalBlocks} blocks with {numErrorBlocks} blocks failed parsing'
+
+    else:
+        return None, None
+
+    df['time'], fmt, slow = normalize_timestamps(df['time'])
+    timestamps = f'{fn} timestamps parsed as {fmt} with {slow} of {len(df)} rows needing the fallback parser'
+
+    return df, timestamps if note is None else f'{note}. {timestamps}'
+
+
+def normalize_timestamps(times):
+    """parse a column of Takeout timestamps into datetime64[ns, UTC]
+
+    Notes: the format is detected once from the first value and the whole column is parsed on the vectorized path for
+    that format. Only rows that path cannot parse are handed to dateutil. Timestamps without a zone are taken as UTC
+
+    Args:
+        times: (pandas.Series) timestamps as str
+
+    Returns:
+        (pandas.Series of datetime64[ns, UTC], str name of the detected format, int rows parsed by the fallback)
+    """
+    present = times.notnull()
+    sample = times[present]
+
+    name, fmt = 'unknown', None
+    if len(sample) > 0:
+        for name_, pattern, fmt_ in TIMESTAMP_FORMATS:
+            if pattern.match(str(sample.iloc[0])):
+                name, fmt = name_, fmt_
+                break
+
+    if fmt is None:
+        parsed = pd.to_datetime(times, utc=True, errors='coerce')
+    else:
+        parts = times.str.extract(TIMESTAMP_ZONE)
+        parsed = pd.to_datetime(parts['stamp'], format=fmt, errors='coerce')
+        parsed = (parsed - zone_offsets(parts['zone'])).dt.tz_localize('UTC')
+
+    slow = present & parsed.isnull()
+    if slow.any():
+        parsed[slow] = times[slow].apply(parse_timestamp_slow)
+
+    return parsed, name, int(slow.sum())
+
+
+def zone_offsets(zones):
+    """vectorized UTC offsets for timezone abbreviations (PDT) and numeric zones (GMT-07:00)
+
+    Returns:
+        pandas.Series of timedelta, zero where there is no zone and NaT where the zone is not recognized
+    """
+    hours = zones.map(TIMEZONE_OFFSETS)
+
+    numeric = zones.str.extract(r'^(?:GMT|UTC)(?P<sign>[+-])(?P<h>\d{1,2}):?(?P<m>\d{2})?$')
+    numeric = numeric['sign'].map({'+': 1., '-': -1.}) * \
+        (numeric['h'].astype(float) + numeric['m'].fillna('0').astype(float) / 60)
+
+    hours = hours.fillna(numeric)
+    hours[zones.isnull() | zones.isin(['GMT', 'UTC'])] = 0
+
+    return pd.to_timedelta(hours, unit='h')
+
+
+def parse_timestamp_slow(s):
+    """parse a single timestamp with dateutil, returning it in UTC or NaT if it cannot be parsed
+
+    Notes: a trailing zone zone_offsets knows is applied the same way as on the vectorized path. dateutil would read
+    GMT-07:00 as a POSIX zone and flip its sign
+    """
+    try:
+        match = TIMESTAMP_ZONE.match(str(s))
+        if match is not None and match.group('zone') is not None:
+            offset = zone_offsets(pd.Series([match.group('zone')])).iloc[0]
+
+            if not pd.isnull(offset):
+                t = pd.Timestamp(dateutil.parser.parse(match.group('stamp')))
+                return (t - offset).tz_localize('UTC')
+
+        t = pd.Timestamp(dateutil.parser.parse(str(s), tzinfos=TIMEZONE_TZINFOS))
+        return t.tz_localize('UTC') if t.tzinfo is None else t.tz_convert('UTC')
+    except (ValueError, OverflowError):
+        return pd.NaT
+
+
+def stitch_csv(paths, filename):
+    """concatenate csv files that share a header into one file, keeping only the first header"""
+    with open(filename, 'w') as out:
+        for i, path in enumerate(paths):
+            with open(path, 'r') as part:
+                if i > 0:
+                    part.readline()
+                shutil.copyfileobj(part, out)
+
+
+def iter_search_blocks(html_file, read_size=1024 * 1024, max_block_size=None):
+    """incrementally cut a "My Activity" html file into activity blocks
+
+    Notes: the file is read read_size characters at a time and scanned once from left to right. Only the block being
+    cut is buffered. In bounded memory mode (max_block_size) a block longer than the limit is skipped and yielded as
+    None, as soon as it grows past the limit if it has not closed yet
+
+    Args:
+        html_file: open binary file object of the html file
+        read_size: (int) optional. characters to read per step
+        max_block_size: (int) optional. largest block in characters to buffer. default is no limit
+
+    Yields:
+        str block, or None for a skipped block
+    """
+    reader = TextIOWrapper(html_file, encoding='utf-8')
+    buf, pos, eof = '', 0, False
+
+    while True:
+        start = SEARCH_BLOCK_START.search(buf, pos)
+        end = buf.find(SEARCH_BLOCK_END, start.end()) if start is not None else -1
+
+        if end >= 0:
+            pos = end + len(SEARCH_BLOCK_END)
+            yield buf[start.start():pos] if max_block_size is None or pos - start.start() <= max_block_size else None
+            continue
+
+        if start is not None and max_block_size is not None and len(buf) - start.start() > max_block_size:
+            # the block never closed, drop it and look for the next one
+            pos = start.end()
+            yield None
+            continue
+
+        if eof:
+            return
+
+        # keep only the unfinished block, or enough of the tail to find a block start that straddles the read
+        keep = start.start() if start is not None else max(pos, len(buf) - SEARCH_BLOCK_START_MAX)
+        chunk = reader.read(read_size)
+        eof = len(chunk) == 0
+        buf, pos = buf[keep:] + chunk, 0
+
+
+def process_userSearchQueries_in_htmlFormat(html_file, max_block_size=None):
     '''
-    html_file_content - is the content (string) of the HTML file
+    html_file - is an open binary file object of the HTML file
+    max_block_size - optional. largest block in characters to buffer, longer blocks are counted as errors
     '''
     textSearches = []
     webVisits = []
-    errorBlock = []
-    
-    def __processSearchBlock(block):
-        webVisit       = re.match('^.*Visited.*href="(.*)">(.*)</a><br>(.*?)</div.*$', block)
-        textSearch     = re.match('^.+?Searched for.+?">(.+?)</a><br>(.*?)</div>.+$', block)
-        #location       = re.match('^.*Locations.*">(.*)</a><br></div></div></div>$', block)
-        if textSearch:
-            textSearch = textSearch.groups()
-        else:
-            textSearch = None
-        if webVisit:
-            webVisit = webVisit.groups()
-        else:
-            webVist = None
-        return([textSearch,webVisit])
+    numTotalBlocks = 0
+    numErrorBlocks = 0
+
+    for block in iter_search_blocks(html_file, max_block_size=max_block_size):
+        numTotalBlocks += 1
+
+        if block is None:
+            numErrorBlocks += 1
+            continue
 
-    with open(html_file, "r") as f:
-        contents = f.read()
-    #this should be a unique search block in HTML file
-    blocks = re.findall('<div class="outer-cell.+?mdl-shadow--2dp">.+?</div></div></div>',contents)
+        textSearch = SEARCHED_FOR.search(block) if 'Searched for' in block else None
+        webVisit = VISITED.search(block) if 'Visited' in block else None
 
-    #process each block    
-    for b in blocks:
-        textSearch,webVisit = __processSearchBlock(b)
         if textSearch is None and webVisit is None:
-            errorBlock.append(b)
-        if textSearch: textSearches.append(textSearch) 
-        if webVisit: webVisits.append(webVisit)
+            numErrorBlocks += 1
+        if textSearch: textSearches.append(textSearch.groups())
+        if webVisit: webVisits.append(webVisit.groups())
+
     webVisits_df = pd.DataFrame.from_records(webVisits,columns=('titleUrl', 'title', 'time' ))
     textSearches_df = pd.DataFrame.from_records(textSearches,columns=('title', 'time'))
     textSearches_df['titleUrl'] = 'NA'
@@ -420,10 +970,6 @@ def process_userSearchQueries_in_htmlFormat(html_file):
     
     df = pd.concat([textSearches_df,webVisits_df], sort=False)
     df = df.loc[:, ('time', 'title', 'titleUrl', 'action')]
-    #fix the timezone mess
-    df.time = df.time.apply(dateutil.parser.parse, ignoretz=True)
-    numTotalBlocks = len(blocks)
-    numErrorBlocks = len(errorBlock)
     return([df, numTotalBlocks, numErrorBlocks])
 
 
@@ -441,109 +987,239 @@ def does_exist(synid, name):
     return any([name in c for c in children])
 
 
-def run_dlp_api(queryList):
+def run_dlp_api(queryList, redactor=None):
     """redact a dataframe through DLP
 
-    Args: queryList
+    Notes: the unique queries are triaged by the local pre-redaction engine first. Certain hits are redacted and
+    certain misses skipped without asking DLP. The ambiguous rest are looked up in the cross participant DLP verdict
+    cache and only cache misses are sent to DLP. Verdicts for the misses, including clean ones, are added to the cache
 
-    Returns:pandas.DataFrame 
+    Args:
+        queryList
+        redactor: (app.redaction.PreRedactor) optional. local pre-redaction engine, pass one in to read its counts
+
+    Returns:pandas.DataFrame with one row (title, info_type, likelihood) for every query flagged
     """""
+    redactor = redactor if redactor is not None else PreRedactor()
+    redacted, safe, queries = redactor.triage(sorted(set([q for q in queryList if isinstance(q, str)])))
 
-    def buildQueryTable(searchQueries):
-        """
-        ref - https://github.com/GoogleCloudPlatform/python-docs-samples/blob/master/dlp/inspect_content.py
-        """
-        searchQueries = np.unique(searchQueries)
-        rows = []
-        for query in searchQueries:
-            rows.append({ "values": [{"string_value": query} ]})
-        table = {}
-        table['headers'] = [ {'name' : 'userSearchQueries' }]
-        table['rows'] = rows
-        item = {"table" : table}
-        return item
-
-    def chunks(l, n):
-        """Yield successive n-sized chunks from l"""
-        for i in range(0, len(l), n):
-            yield l[i:i + n]
-        
-    def make_dlp_request(dlpServiceObject, searchQueries, DLP_PROJECT_ID, DLP_INSPECT_CONFIG):
-        parent = dlpServiceObject.project_path(DLP_PROJECT_ID)
-        
-        #pre-process the text list into JSON
-        items = buildQueryTable(searchQueries)
-        
-        #Run the actual query
-        response = dlpServiceObject.inspect_content(
-                parent=parent,
-                inspect_config=DLP_INSPECT_CONFIG,
-                item=items)
-        tmp = []
-        for f in response.result.findings:
-            tmp.append([f.quote, f.info_type.name, f.likelihood])
-        df = pd.DataFrame.from_records(tmp, columns=('title', 'info_type', 'likelihood'))
-        return df
+    fingerprint = ctx.dlp_config_fingerprint(secrets.DLP_INSPECT_CONFIG)
+    keys = {q: ctx.dlp_cache_key(q, fingerprint) for q in queries}
+
+    verdicts = ctx.get_dlp_verdicts(set(keys.values()))
+    misses = [q for q in queries if keys[q] not in verdicts]
+
+    found = inspect_queries(misses)
+    ctx.put_dlp_verdicts({keys[q]: found.get(q, (None, None)) for q in misses})
+
+    rows = [(q, info_type, likelihood) for q, (info_type, likelihood) in redacted.items()]
+    for q in queries:
+        info_type, likelihood = found[q] if q in found else verdicts.get(keys[q], (None, None))
+        if info_type is not None:
+            rows.append((q, info_type, likelihood))
 
+    return pd.DataFrame.from_records(rows, columns=('title', 'info_type', 'likelihood'))
+
+
+def inspect_queries(queryList):
+    """send search queries to DLP
+
+    Notes: requests run concurrently under the DLP_QPS rate limit, sized to the DLP payload limit, and retried with
+    backoff on quota errors. see app.inspection.DlpDispatcher
+
+    Args: queryList
+
+    Returns: dict query -> (info_type, likelihood) for every query DLP flagged
+    """
     ### __dlp is the global authorized object to make queries using DLP service account creds
-    ### parent = sets the project under which DLP queries are run
-    parent = __dlp.project_path(secrets.DLP_PROJECT_ID)    
-    queryList = np.unique(queryList)
-    ##Process the queryList in chunks - Max CHUNK_SIZE = 2000 (can be changed)
-    CHUNK_SIZE= 2000
-    DLP_results = [ ]
-    for chunk in chunks(queryList, CHUNK_SIZE):
-        DLP_results.append(make_dlp_request(__dlp, chunk, secrets.DLP_PROJECT_ID, secrets.DLP_INSPECT_CONFIG))
-    DLP_results = pd.concat(DLP_results, ignore_index=True)
-
-    return DLP_results
-
-
-def parse_google_location_data(filename):
-    """parse GPS data from Takeout archive"""
-    def arow(args):
-        idx, row = args
+    dispatcher = DlpDispatcher(__dlp, secrets.DLP_PROJECT_ID, secrets.DLP_INSPECT_CONFIG)
+    return dispatcher.inspect(list(queryList))
+
+
+def iter_location_records(f, read_size=1024 * 1024):
+    """incrementally decode the records of the 'locations' array in a Location History json file
+
+    Notes: the file is read read_size characters at a time and each record is decoded as soon as it is complete, so
+    the whole document is never held in memory
+
+    Args:
+        f: open binary file object of the Location History json file
+        read_size: (int) optional. characters to read per step
+
+    Yields:
+        dict
+    """
+    decoder = json.JSONDecoder()
+    reader = TextIOWrapper(f, encoding='utf-8')
+    buf, eof = '', False
+
+    # skip ahead to the opening bracket of the locations array
+    while True:
+        m = LOCATIONS_ARRAY.search(buf)
+        if m is not None:
+            pos = m.end()
+            break
+        elif eof:
+            return
+
+        chunk = reader.read(read_size)
+        eof = len(chunk) == 0
+        buf = buf[-64:] + chunk
+
+    while True:
+        pos = RECORD_SEPARATOR.match(buf, pos).end()
+
+        if pos < len(buf) and buf[pos] == ']':
+            return
+
         try:
-            j_ = js.activity[idx]
-            if isinstance(j_, float):
-                return np.nan
-            if len(j_) > 0:
-                result = j_[0]['activity'][0]['type']
-                return result
-            else:
-                return np.nan
-        except Exception:
-            return np.nan
+            record, pos = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                if len(buf[pos:].strip()) == 0:
+                    return
+                raise
+
+            # the record is incomplete, read more and try again
+            chunk = reader.read(read_size)
+            eof = len(chunk) == 0
+            buf, pos = buf[pos:] + chunk, 0
+            continue
 
-    with open(filename, 'r') as f:
-        js = json.load(f)
+        yield record
 
-    js = pd.DataFrame(js['locations'])
 
-    if 'verticalAccuracy' in js.columns:
-        js.drop(columns='verticalAccuracy', inplace=True)
+def flatten_activities(records, detail=False):
+    """flatten the nested activity lists of location records in a single pass
+
+    Notes: the most likely type of the first activity sample, activity[0].activity[0].type, is returned as a
+    categorical column. With detail, every (sample, type, confidence) is also collected into a long table
+
+    Args:
+        records: [dict,] raw records from the 'locations' array
+        detail: (bool) optional. also build the long table of all activity samples
+
+    Returns:
+        (pandas.Categorical, pandas.DataFrame with ACTIVITY_COLUMNS or None)
+    """
+    types = [None] * len(records)
+    rows = [] if detail else None
+
+    for i, r in enumerate(records):
+        samples = r.get('activity')
+        if not samples:
+            continue
+
+        try:
+            types[i] = samples[0]['activity'][0]['type']
+        except (KeyError, IndexError, TypeError):
+            pass
+
+        if detail:
+            for sample in samples:
+                for a in sample.get('activity', []):
+                    rows.append((r['timestampMs'], sample.get('timestampMs'), a.get('type'), a.get('confidence')))
+
+    categories = ACTIVITY_TYPES + sorted(set(types) - set(ACTIVITY_TYPES) - {None})
+    activity = pd.Categorical(types, categories=categories)
+
+    if detail:
+        table = pd.DataFrame.from_records(rows, columns=ACTIVITY_COLUMNS)
+        table['time'] = pd.to_datetime(table['time'].astype('int64'), unit='ms')
+        table['activity_time'] = pd.to_datetime(pd.to_numeric(table['activity_time']), unit='ms')
+        table['type'] = pd.Categorical(table['type'], categories=categories)
+        return activity, table
+    else:
+        return activity, None
+
+
+def location_batch(records, detail=False):
+    """build a columnar batch from location records
+
+    Args:
+        records: [dict,] raw records from the 'locations' array
+        detail: (bool) optional. also build the long table of all activity samples
+
+    Returns:
+        (dict of numpy arrays keyed by LOCATION_COLUMNS, pandas.DataFrame of activity samples or None)
+    """
+    n = len(records)
+
+    def column(key, dtype='float64'):
+        return np.fromiter((r.get(key, np.nan) for r in records), dtype=dtype, count=n)
+
+    activity, activities = flatten_activities(records, detail)
+
+    return {
+        'time': np.fromiter((int(r['timestampMs']) for r in records), dtype='int64', count=n),
+        'lat': np.round(column('latitudeE7') / 10e6, 5),
+        'lon': np.round(column('longitudeE7') / 10e6, 5),
+        'accuracy': column('accuracy'),
+        'velocity': column('velocity'),
+        'altitude': column('altitude'),
+        'activity': activity
+    }, activities
+
+
+def iter_location_batches(f, batch_size=None, detail=False):
+    """yield fixed size columnar batches from a Location History json file
+
+    Args:
+        f: open binary file object of the Location History json file
+        batch_size: (int) optional. records per batch. default LOCATION_BATCH_SIZE from application config
+        detail: (bool) optional. also build the long table of all activity samples
+
+    Yields:
+        (dict of numpy arrays keyed by LOCATION_COLUMNS, pandas.DataFrame of activity samples or None)
+    """
+    batch_size = batch_size if batch_size is not None else secrets.LOCATION_BATCH_SIZE
+
+    records = []
+    for record in iter_location_records(f):
+        records.append(record)
+
+        if len(records) == batch_size:
+            yield location_batch(records, detail)
+            records = []
+
+    if len(records) > 0:
+        yield location_batch(records, detail)
+
+
+def parse_google_location_data(f, path, batch_size=None, activity_path=None):
+    """parse GPS data from Takeout archive, writing it to csv as it is read
+
+    Notes: memory use is bounded by the batch size rather than by the length of the participant's history
+
+    Args:
+        f: open binary file object of the Location History json file
+        path: (str) csv file to write
+        batch_size: (int) optional. records per batch. default LOCATION_BATCH_SIZE from application config
+        activity_path: (str) optional. csv file to write the long table of all activity samples to
+
+    Returns:
+        (int) number of locations written
+    """
+    count = 0
+    detail = activity_path is not None
 
-    # if 'altitude' in js.columns:
-    #     js.drop(columns='altitude', inplace=True)
+    with open(path, 'w') as out, open(activity_path if detail else os.devnull, 'w') as activity_out:
+        for batch, activities in iter_location_batches(f, batch_size, detail):
+            df = pd.DataFrame(batch, columns=LOCATION_COLUMNS)
+            df.time = pd.to_datetime(df.time, unit='ms')
 
-    if 'heading' in js.columns:
-        js.drop(columns='heading', inplace=True)
+            df.to_csv(out, index=None, header=count == 0)
 
-    # if 'velocity' in js.columns:
-    #     js.drop(columns='velocity', inplace=True)
+            if detail:
+                activities.to_csv(activity_out, index=None, header=count == 0)
 
-    js.timestampMs = pd.to_datetime(js.timestampMs, unit='ms')
-    js.latitudeE7 = np.round(js.latitudeE7 / 10e6, 5)
-    js.longitudeE7 = np.round(js.longitudeE7 / 10e6, 5)
+            count += len(df)
 
-    if 'activity' in js.columns:
-        pool = TPool(secrets.CLEANING_THREADS)
-        js.activity = list(pool.map(arow, list(js.iterrows())))
-        pool.close()
-        pool.join()
+        if count == 0:
+            pd.DataFrame(columns=LOCATION_COLUMNS).to_csv(out, index=None)
+            pd.DataFrame(columns=ACTIVITY_COLUMNS).to_csv(activity_out, index=None)
 
-    js.rename(columns={'latitudeE7': 'lat', 'longitudeE7': 'lon', 'timestampMs': 'time'}, inplace=True)
-    return js
+    return count
 
 
 def process_from_local(study_id, consent_dt, path):
@@ -567,12 +1243,15 @@ def process_from_local(study_id, consent_dt, path):
 
         try:
             task = TakeOutExtractor(consent, archive_path=path).run()
-            # make sure all updates have been persisted to backend
+            # write the task's log entries, then make sure all updates have been persisted to backend
+            ctx.flush_logs()
             ctx.commit(s)
             # final call to update Synapse consents table
             task.consent.update_synapse()
+            ctx.flush_synapse()
         except Exception as e:
             consent.set_status(ctx.ConsentStatus.FAILED)
+            ctx.flush_logs()
             print(e)
             return 1
     return 0
@@ -0,0 +1,99 @@
+#!/bin/env python
+"""benchmark how many consents a pool of archive agent workers finishes per second
+
+Notes: the workers are run_worker processes on a SQLite database, running an extractor that only sleeps, so the
+numbers measure claiming, leases, and bookkeeping rather than Google Takeout
+
+Examples:
+    >>> python3 tests/bench_agent_throughput.py --consents 200 --workers 1 2 4 --task-ms 50
+"""
+import argparse
+import datetime as dt
+from multiprocessing import Event, Process
+import os
+import tempfile
+import time
+
+import conftest  # noqa: F401. builds app.config for running locally
+import app.config as secrets
+import app.context as ctx
+from app.archive_agent import run_worker
+
+
+class SleepingExtractor(object):
+    """an extractor that takes TASK_MS milliseconds to complete its consent"""
+    TASK_MS = 0
+
+    def __init__(self, consent):
+        self.consent = consent
+
+    def run(self):
+        time.sleep(SleepingExtractor.TASK_MS / 1000.)
+        self.consent.set_status(ctx.ConsentStatus.COMPLETE)
+
+
+def add_consents(conn, n):
+    with ctx.session_scope(conn) as s:
+        for i in range(n):
+            consent = ctx.Consent(study_id=f's{i}', consent_dt=dt.datetime(2019, 1, 1))
+            consent.status = ctx.ConsentStatus.READY.value
+            s.add(consent)
+
+
+def remaining(conn):
+    with ctx.session_scope(conn) as s:
+        return s.query(ctx.Consent).filter(ctx.Consent.status != ctx.ConsentStatus.COMPLETE.value).count()
+
+
+def run(directory, workers, consents):
+    """seconds workers take to finish every consent of a new database"""
+    conn = {'drivername': 'sqlite', 'path': os.path.join(directory, f'agent-{workers}.db')}
+    secrets.DATABASE = conn
+
+    ctx.create_database(conn)
+    add_consents(conn, consents)
+
+    stop = Event()
+    pool = [
+        Process(target=run_worker, args=(conn, stop, 1.), kwargs={'extractor': SleepingExtractor, 'slot': i})
+        for i in range(workers)
+    ]
+
+    start = time.perf_counter()
+    for p in pool:
+        p.start()
+
+    while remaining(conn) > 0:
+        time.sleep(.05)
+
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    for p in pool:
+        p.join()
+
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='--')
+    parser.add_argument('--consents', type=int, default=200, help='consents to finish')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='worker counts to compare')
+    parser.add_argument('--task-ms', type=int, default=50, help='milliseconds each task takes')
+    args = parser.parse_args()
+
+    SleepingExtractor.TASK_MS = args.task_ms
+    secrets.ARCHIVE_AGENT_WORKERS = max(args.workers)
+
+    print(f'{args.consents} consents, {args.task_ms} ms per task')
+
+    with tempfile.TemporaryDirectory() as d:
+        for workers in args.workers:
+            elapsed = run(d, workers, args.consents)
+            overhead = 1000. * (elapsed * workers / args.consents) - args.task_ms
+            print(f'{workers} workers: {elapsed:7.2f}s  {args.consents / elapsed:7.1f} consents/s  '
+                  f'{overhead:6.1f} ms overhead per task')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/bin/env python
+"""benchmark encrypting and decrypting consent credentials, and the decrypts a task makes before and after handles
+
+Notes: every encrypt and decrypt runs the cypher's key expansion, FSC_EXPANSION_COUNT iterations long. a task read
+Consent.credentials several times, each one a decrypt, before credentials were held in a CredentialHandle
+
+Examples:
+    >>> python3 tests/bench_credentials.py --ops 10 --expansion-count 10240 --reads 3
+"""
+import argparse
+import json
+import time
+
+import conftest  # noqa: F401. builds app.config for running locally
+import app.context as ctx
+
+CREDENTIALS = json.dumps({
+    'access_token': 'ya29.' + 'a' * 160,
+    'refresh_token': '1//' + 'r' * 100,
+    'token_uri': 'https://oauth2.googleapis.com/token',
+    'client_id': 'client.apps.googleusercontent.com',
+    'client_secret': 'not-a-secret',
+    'scopes': ['https://www.googleapis.com/auth/drive.readonly'],
+})
+
+
+def decrypt_per_read(data, reads):
+    """Consent.credentials before handles: a decrypt and a parse on every read, and one more parse of the oauth dict"""
+    for _ in range(reads):
+        x = json.loads(ctx.cypher.decrypt(data).decode('utf-8'))
+    return json.loads(x)
+
+
+def handle_per_task(data, reads):
+    """Consent.credentials through a CredentialHandle held for the task, cleared at its end"""
+    handle = ctx.CredentialHandle(data)
+    try:
+        for _ in range(reads):
+            handle.credentials
+        return handle.fields
+    finally:
+        handle.clear()
+
+
+def rate(fn, n):
+    """calls of fn per second"""
+    start = time.perf_counter()
+
+    for _ in range(n):
+        fn()
+
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='--')
+    parser.add_argument('--ops', type=int, default=10, help='operations timed per run')
+    parser.add_argument('--expansion-count', type=int, default=10240, help='key expansion iterations')
+    parser.add_argument('--reads', type=int, default=3, help='reads of Consent.credentials per task')
+    args = parser.parse_args()
+
+    ctx.cypher.EXPANSION_COUNT = args.expansion_count
+    data = ctx.encrypt_credentials(CREDENTIALS)
+
+    assert decrypt_per_read(data, args.reads) == handle_per_task(data, args.reads)
+
+    print(f'{args.ops} operations, {args.expansion_count} key expansion iterations, {args.reads} reads per task')
+    print(f'encrypt:           {rate(lambda: ctx.encrypt_credentials(CREDENTIALS), args.ops):9.1f} ops/s')
+    print(f'decrypt:           {rate(lambda: ctx.cypher.decrypt(data), args.ops):9.1f} ops/s')
+
+    before = rate(lambda: decrypt_per_read(data, args.reads), args.ops)
+    after = rate(lambda: handle_per_task(data, args.reads), args.ops)
+    print(f'decrypt per read:  {before:9.1f} tasks/s')
+    print(f'handle per task:   {after:9.1f} tasks/s  {after / before:5.1f}x')
+
+
+if __name__ == '__main__':
+    main()
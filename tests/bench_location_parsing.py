@@ -0,0 +1,114 @@
+#!/bin/env python
+"""benchmark the columnar location parser against the thread-pooled iterrows parser it replaced
+
+Examples:
+    >>> python3 tests/bench_location_parsing.py --points 1000000
+"""
+import argparse
+from io import BytesIO
+import json
+from multiprocessing.dummy import Pool as TPool
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import conftest  # noqa: F401. builds app.config for running locally
+from app.xtractor import ACTIVITY_TYPES, parse_google_location_data
+
+
+def location_history(n, seed=0):
+    """a Location History json document of n points, a third of them with activity samples"""
+    rng = random.Random(seed)
+    start = 1546300800000
+
+    def activity(ts):
+        return [{
+            'timestampMs': str(ts + 1000 * i),
+            'activity': [{'type': rng.choice(ACTIVITY_TYPES), 'confidence': rng.randint(0, 100)} for _ in range(3)]
+        } for i in range(2)]
+
+    locations = []
+    for i in range(n):
+        ts = start + 60000 * i
+        x = {
+            'timestampMs': str(ts),
+            'latitudeE7': rng.randint(-900000000, 900000000),
+            'longitudeE7': rng.randint(-1800000000, 1800000000),
+            'accuracy': rng.randint(3, 2000)
+        }
+
+        if i % 3 == 0:
+            x['activity'] = activity(ts)
+        if i % 2 == 0:
+            x['velocity'] = rng.randint(0, 30)
+            x['altitude'] = rng.randint(-10, 3000)
+
+        locations.append(x)
+
+    return json.dumps({'locations': locations}).encode('utf-8')
+
+
+def iterrows_parser(document, threads):
+    """the parser before the columnar rewrite: the whole document in a DataFrame and iterrows in a thread pool"""
+    def arow(args):
+        idx, row = args
+        try:
+            j_ = js.activity[idx]
+            if isinstance(j_, float):
+                return np.nan
+            if len(j_) > 0:
+                return j_[0]['activity'][0]['type']
+            else:
+                return np.nan
+        except Exception:
+            return np.nan
+
+    js = pd.DataFrame(json.loads(document)['locations'])
+
+    js.timestampMs = pd.to_datetime(js.timestampMs.astype('int64'), unit='ms')
+    js.latitudeE7 = np.round(js.latitudeE7 / 10e6, 5)
+    js.longitudeE7 = np.round(js.longitudeE7 / 10e6, 5)
+
+    pool = TPool(threads)
+    js.activity = list(pool.map(arow, list(js.iterrows())))
+    pool.close()
+    pool.join()
+
+    js.rename(columns={'latitudeE7': 'lat', 'longitudeE7': 'lon', 'timestampMs': 'time'}, inplace=True)
+    return js
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='--')
+    parser.add_argument('--points', type=int, default=1000000, help='location points in the generated history')
+    parser.add_argument('--threads', type=int, default=4, help='threads of the iterrows parser')
+    args = parser.parse_args()
+
+    document = location_history(args.points)
+    print(f'{args.points} points, {len(document) / 2 ** 20:.1f} MiB of json')
+
+    with tempfile.TemporaryDirectory() as d:
+        columnar = timed(lambda: parse_google_location_data(BytesIO(document), os.path.join(d, 'locations.csv')))
+        detail = timed(lambda: parse_google_location_data(
+            BytesIO(document), os.path.join(d, 'locations.csv'), activity_path=os.path.join(d, 'activities.csv')
+        ))
+
+    iterrows = timed(lambda: iterrows_parser(document, args.threads))
+
+    print(f'iterrows, {args.threads} threads (no csv written): {iterrows:8.2f}s')
+    print(f'columnar, csv written:                   {columnar:8.2f}s  {iterrows / columnar:5.1f}x')
+    print(f'columnar with activity detail:           {detail:8.2f}s')
+
+
+if __name__ == '__main__':
+    main()
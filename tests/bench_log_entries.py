@@ -0,0 +1,90 @@
+#!/bin/env python
+"""benchmark how many log entries per second are written without a session
+
+Notes: compares an engine built for every entry, as get_engine did before engines were registered per process, with
+the registered engine and its pool, and with the log sink that writes entries in bulk. Runs on SQLite, or on the
+Postgres database in GTAP_TEST_POSTGRES (see tests/conftest.py) with --postgres
+
+Examples:
+    >>> python3 tests/bench_log_entries.py --entries 2000
+    >>> GTAP_TEST_POSTGRES='{"host": "127.0.0.1", "port": 5432, "username": "postgres", "database": "gtap_test"}' \
+    ...     python3 tests/bench_log_entries.py --postgres
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+import conftest  # noqa: F401. builds app.config for running locally
+import app.config as secrets
+import app.context as ctx
+
+
+def engine_per_entry(conn, msg):
+    """the write path before engines were registered: a new engine, and so a new pool and connection, every entry"""
+    engine = ctx.build_engine(conn)
+    session = sessionmaker(bind=engine)()
+
+    try:
+        session.add(ctx.LogEntry(msg))
+        session.commit()
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def registered_engine(conn, msg):
+    """one entry per session on the engine registered for the process"""
+    with ctx.session_scope(conn) as s:
+        s.add(ctx.LogEntry(msg))
+
+
+def log_sink(conn, msg):
+    """the buffered path add_log_entry takes. the sink writes in bulk, the last entries at the final flush"""
+    ctx.add_log_entry(msg)
+
+
+def rate(conn, write, n):
+    """entries written per second"""
+    start = time.perf_counter()
+
+    for i in range(n):
+        write(conn, f'entry {i}')
+    ctx.flush_logs()
+
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='--')
+    parser.add_argument('--entries', type=int, default=2000, help='log entries written per run')
+    parser.add_argument('--postgres', action='store_true', help='use the database in GTAP_TEST_POSTGRES')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        if args.postgres:
+            conn = dict(json.loads(os.environ['GTAP_TEST_POSTGRES']), drivername='postgres')
+        else:
+            conn = {'drivername': 'sqlite', 'path': os.path.join(d, 'gtap.db')}
+
+        secrets.DATABASE = conn
+        ctx.create_database(conn)
+
+        print(f'{args.entries} log entries on {conn["drivername"]}')
+
+        before = rate(conn, engine_per_entry, args.entries)
+        print(f'engine per entry:   {before:9.0f} entries/s')
+
+        for name, write in (('registered engine:', registered_engine), ('log sink:         ', log_sink)):
+            after = rate(conn, write, args.entries)
+            print(f'{name} {after:9.0f} entries/s  {after / before:6.1f}x')
+
+        if args.postgres:
+            ctx.Base.metadata.drop_all(ctx.get_engine(conn))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/bin/env python
+"""benchmark the streaming My Activity search html parser against the whole-file regex parser it replaced
+
+Notes: the html is built by repeating the blocks of tests/data/my_activity_search.html
+
+Examples:
+    >>> python3 tests/bench_search_html.py --blocks 200000
+"""
+import argparse
+from io import BytesIO
+import os
+import re
+import time
+
+import pandas as pd
+
+import conftest  # noqa: F401. builds app.config for running locally
+from app.xtractor import iter_search_blocks, process_userSearchQueries_in_htmlFormat
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'my_activity_search.html')
+
+
+def search_html(n):
+    """a My Activity html document of n blocks"""
+    with open(CORPUS, 'r', encoding='utf-8') as f:
+        html = f.read()
+
+    blocks = list(iter_search_blocks(BytesIO(html.encode('utf-8'))))
+    start, end = html.index(blocks[0]), html.rindex(blocks[-1]) + len(blocks[-1])
+
+    body = '\n'.join([blocks[i % len(blocks)] for i in range(n)])
+    return (html[:start] + body + html[end:]).encode('utf-8')
+
+
+def regex_parser(html_file):
+    """the parser before the streaming rewrite: the whole file decoded, cut with findall, and matched with '^.*'"""
+    textSearches, webVisits, errorBlock = [], [], []
+
+    contents = html_file.read().decode('utf-8')
+    blocks = re.findall('<div class="outer-cell.+?mdl-shadow--2dp">.+?</div></div></div>', contents)
+
+    for b in blocks:
+        webVisit = re.match('^.*Visited.*href="(.*)">(.*)</a><br>(.*?)</div.*$', b)
+        textSearch = re.match('^.+?Searched for.+?">(.+?)</a><br>(.*?)</div>.+$', b)
+
+        if textSearch is None and webVisit is None:
+            errorBlock.append(b)
+        if textSearch: textSearches.append(textSearch.groups())
+        if webVisit: webVisits.append(webVisit.groups())
+
+    webVisits_df = pd.DataFrame.from_records(webVisits, columns=('titleUrl', 'title', 'time'))
+    textSearches_df = pd.DataFrame.from_records(textSearches, columns=('title', 'time'))
+
+    return pd.concat([textSearches_df, webVisits_df], sort=False), len(blocks), len(errorBlock)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='--')
+    parser.add_argument('--blocks', type=int, default=200000, help='activity blocks in the generated html')
+    parser.add_argument('--max-block', type=int, default=1024 * 1024, help='block limit of the bounded run')
+    args = parser.parse_args()
+
+    html = search_html(args.blocks)
+    print(f'{args.blocks} blocks, {len(html) / 2 ** 20:.1f} MiB of html')
+
+    regex, (df, total, errors) = timed(lambda: regex_parser(BytesIO(html)))
+    streaming, (df_, total_, errors_) = timed(lambda: process_userSearchQueries_in_htmlFormat(BytesIO(html)))
+    bounded, _ = timed(lambda: process_userSearchQueries_in_htmlFormat(BytesIO(html), max_block_size=args.max_block))
+
+    assert (total, errors, len(df)) == (total_, errors_, len(df_))
+
+    print(f'regex, whole file:   {regex:7.2f}s  {args.blocks / regex:10.0f} blocks/s')
+    print(f'streaming:           {streaming:7.2f}s  {args.blocks / streaming:10.0f} blocks/s  '
+          f'{regex / streaming:5.1f}x')
+    print(f'streaming, bounded:  {bounded:7.2f}s  {args.blocks / bounded:10.0f} blocks/s')
+
+
+if __name__ == '__main__':
+    main()
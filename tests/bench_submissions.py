@@ -0,0 +1,113 @@
+#!/bin/env python
+"""load test consent submissions: many concurrent submits, their latency, and the processes they leave running
+
+Notes: drives the code behind POST /consent/download without Flask, whose pinned version the installed one may not
+match. before is a process started per submission, as crud.download did, after is respond on a SubmissionQueue.
+submissions are written by context.add_task to a SQLite database
+
+Examples:
+    >>> python3 tests/bench_submissions.py --submits 500 --size 100 --workers 2
+"""
+import argparse
+import datetime as dt
+import importlib.util
+from multiprocessing import active_children, Process
+from multiprocessing.dummy import Pool as TPool
+import os
+import tempfile
+from threading import Event, Thread
+import time
+
+import numpy as np
+
+import conftest  # noqa: F401. builds app.config for running locally
+import app.config as secrets
+import app.context as ctx
+
+# app/search_consent/__init__.py builds the Flask app, so submissions.py is loaded on its own
+spec = importlib.util.spec_from_file_location(
+    'submissions', os.path.join(conftest.ROOT, 'app', 'search_consent', 'submissions.py')
+)
+submissions = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(submissions)
+
+"""forks made by this process"""
+FORKS = []
+os.register_at_fork(before=lambda: FORKS.append(1))
+
+
+def fork_per_submission(data):
+    """crud.download before the queue: a process per submission, left for the os to clean up"""
+    Process(target=ctx.add_task, args=(data,)).start()
+    return 'task submitted'
+
+
+def submission(i):
+    return {'study_id': f's{i}', 'consent_dt': dt.datetime(2019, 1, 1), 'credentials': '{"access_token": "x"}'}
+
+
+def load(submit, n):
+    """submit n submissions at once
+
+    Returns:
+        ([float,], [response,], int, int) milliseconds each submit took, its response, the forks made, and the most
+            child processes running at once
+    """
+    peak, done = [0], Event()
+    forks = len(FORKS)
+
+    def watch():
+        while not done.is_set():
+            peak[0] = max(peak[0], len(active_children()))
+            time.sleep(.005)
+
+    def timed(i):
+        start = time.perf_counter()
+        response = submit(submission(i))
+        return 1000. * (time.perf_counter() - start), response
+
+    watcher = Thread(target=watch)
+    watcher.start()
+
+    pool = TPool(n)
+    results = pool.map(timed, range(n))
+    pool.close()
+    pool.join()
+
+    done.set()
+    watcher.join()
+
+    return [r[0] for r in results], [r[1] for r in results], len(FORKS) - forks, peak[0]
+
+
+def report(name, latencies, responses, forks, peak):
+    accepted = len([r for r in responses if r == 'task submitted'])
+    print(f'{name} p50 {np.percentile(latencies, 50):8.2f} ms  p99 {np.percentile(latencies, 99):8.2f} ms  '
+          f'{accepted:4d} accepted  {len(responses) - accepted:4d} refused  {forks:4d} forks  '
+          f'{peak:4d} child processes at once')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='--')
+    parser.add_argument('--submits', type=int, default=500, help='concurrent submissions')
+    parser.add_argument('--size', type=int, default=secrets.SUBMISSION_QUEUE_SIZE, help='submission queue size')
+    parser.add_argument('--workers', type=int, default=secrets.SUBMISSION_WORKERS, help='submission writing threads')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        secrets.DATABASE = {'drivername': 'sqlite', 'path': os.path.join(d, 'gtap.db')}
+        ctx.create_database(secrets.DATABASE)
+
+        print(f'{args.submits} concurrent submissions, queue of {args.size} written by {args.workers} threads')
+
+        report('process per submission:', *load(fork_per_submission, args.submits))
+        for p in active_children():
+            p.join()
+
+        queue = submissions.SubmissionQueue(size=args.size, workers=args.workers)
+        report('submission queue:      ', *load(lambda data: submissions.respond(queue, data), args.submits))
+        queue.drain(60)
+
+
+if __name__ == '__main__':
+    main()
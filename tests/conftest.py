@@ -0,0 +1,108 @@
+"""test setup
+
+app.config is built from app/config.template.py rather than imported, so tests never reach a real Synapse project,
+database, or AWS account. Synapse is a FakeSynapse and every test gets a throwaway SQLite database
+
+Tests of Postgres only behavior run against the database in GTAP_TEST_POSTGRES, DATABASE connection parameters as
+json, and are skipped without it. Its tables are dropped after every test, e.g.
+
+    GTAP_TEST_POSTGRES='{"host": "127.0.0.1", "port": 5432, "username": "postgres", "database": "gtap_test"}'
+"""
+import json
+import os
+import sys
+import tempfile
+import types
+
+import pytest
+import synapseclient
+
+# synapseclient 2.0 moved synapseclient.exceptions, which the pinned 1.9 still has, to synapseclient.core
+if not hasattr(synapseclient, 'exceptions'):
+    import synapseclient.core.exceptions
+    sys.modules['synapseclient.exceptions'] = synapseclient.exceptions = synapseclient.core.exceptions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TMP_DIR = tempfile.mkdtemp(prefix='gtap-tests-')
+
+
+def build_config():
+    """app.config from the template with settings safe to run locally"""
+    config = types.ModuleType('app.config')
+
+    # a predefined syn skips the Synapse login in the template. the fake replaces it below
+    config.syn = None
+
+    path = os.path.join(ROOT, 'app', 'config.template.py')
+    with open(path, 'r') as f:
+        exec(compile(f.read(), path, 'exec'), config.__dict__)
+
+    config.__dict__.update(
+        PROJECT_SYNID='syn0',
+        CONSENTS_SYNID='syn1',
+        TIMEZONE='US/Pacific',
+        SECRET_KEY=b'not-a-secret',
+        FSC_EXPANSION_COUNT=16,
+        DATABASE={'drivername': 'sqlite', 'path': os.path.join(TMP_DIR, 'gtap.db')},
+        ARCHIVE_AGENT_TMP_DIR=TMP_DIR,
+        WORKING_DIR=TMP_DIR,
+        SYNAPSE_RETRIES=3,
+        SYNAPSE_FLUSH_INTERVAL_MS=0,
+        LOG_FLUSH_INTERVAL_MS=0,
+        RETRY_BASE_DELAY=.001,
+        RETRY_MAX_DELAY=.01,
+        WAIT_TIME_BETWEEN_DRIVE_NOT_READY=60,
+        MAX_TIME_FOR_DRIVE_WAIT=24 * 3600
+    )
+
+    # credentials that let the DLP client be built. nothing in the tests reaches Google
+    credentials = os.path.join(TMP_DIR, 'dlp-credentials.json')
+    with open(credentials, 'w') as f:
+        json.dump({'type': 'authorized_user', 'client_id': 'x', 'client_secret': 'x', 'refresh_token': 'x'}, f)
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials
+
+    return config
+
+
+import app  # noqa: E402
+
+app.config = sys.modules['app.config'] = build_config()
+
+from fakes import FakeSynapse  # noqa: E402
+
+app.config.syn = FakeSynapse()
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    """a new SQLite database with every table, used as the application database for the test"""
+    import app.context as ctx
+
+    conn = {'drivername': 'sqlite', 'path': str(tmp_path / 'gtap.db')}
+    monkeypatch.setattr(app.config, 'DATABASE', conn)
+    ctx.create_database(conn)
+
+    yield conn
+
+    ctx.LOG_SINK.flush()
+
+
+@pytest.fixture
+def postgres(monkeypatch):
+    """the Postgres database in GTAP_TEST_POSTGRES with every table, used as the application database for the test"""
+    import app.context as ctx
+
+    if 'GTAP_TEST_POSTGRES' not in os.environ:
+        pytest.skip('GTAP_TEST_POSTGRES is not set')
+
+    conn = dict(json.loads(os.environ['GTAP_TEST_POSTGRES']), drivername='postgres')
+    monkeypatch.setattr(app.config, 'DATABASE', conn)
+    ctx.create_database(conn)
+
+    yield conn
+
+    ctx.LOG_SINK.flush()
+    ctx.Base.metadata.drop_all(ctx.get_engine(conn))
@@ -0,0 +1,250 @@
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+from threading import Lock, Thread
+import time
+from types import SimpleNamespace
+
+from botocore.exceptions import ClientError
+from google.api_core import exceptions as gexc
+import requests
+from synapseclient.exceptions import SynapseHTTPError
+from synapseclient.table import PartialRowset
+
+from app.inspection import payload_bytes
+from app.synapse_sync import COLUMNS
+
+
+def http_error(status):
+    """a SynapseHTTPError carrying an http status, as synapseclient raises them"""
+    response = requests.Response()
+    response.status_code = status
+    return SynapseHTTPError(f'{status} error', response=response)
+
+
+class FakeSynapse(object):
+    """in-memory stand-in for the parts of synapseclient.Synapse used on the consents table
+
+    Notes: rows are kept as row id -> {'values', 'versionNumber'}. Errors put in failures are raised by the next calls
+    to store, one per call, and calls counts every call by method name
+    """
+
+    def __init__(self):
+        self.columns = [{'id': str(i + 1), 'name': c} for i, c in enumerate(COLUMNS)]
+        self.rows = OrderedDict()
+        self.failures = []
+        self.calls = Counter()
+
+    def __repr__(self):
+        return f'<FakeSynapse(rows={len(self.rows)})>'
+
+    def getTableColumns(self, table_id):
+        self.calls['getTableColumns'] += 1
+        return iter(self.columns)
+
+    def tableQuery(self, query, resultsAs='rowset'):
+        self.calls['tableQuery'] += 1
+
+        ids = re.search(r'internal_id in \((.*)\)', query)
+        ids = None if ids is None else [x.strip(" '") for x in ids.group(1).split(',')]
+
+        return [
+            {'rowId': row_id, 'versionNumber': r['versionNumber'], 'values': r['values'][:2]}
+            for row_id, r in self.rows.items() if ids is None or str(r['values'][1]) in ids
+        ]
+
+    def store(self, obj):
+        self.calls['store'] += 1
+
+        if len(self.failures) > 0:
+            raise self.failures.pop(0)
+
+        if isinstance(obj, PartialRowset):
+            names = {c['id']: COLUMNS.index(c['name']) for c in self.columns}
+
+            for row in obj['rows']:
+                if row['rowId'] not in self.rows:
+                    raise http_error(412)
+
+                r = self.rows[row['rowId']]
+                for v in row['values']:
+                    r['values'][names[v['key']]] = v['value']
+                r['versionNumber'] += 1
+
+            return obj
+
+        # a RowSet of new rows. Synapse answers with a reference to each row, in order
+        refs = []
+        for row in obj['rows']:
+            row_id = max(self.rows.keys(), default=0) + 1
+            self.rows[row_id] = {'values': list(row['values']), 'versionNumber': 1}
+            refs.append({'rowId': row_id, 'versionNumber': 1})
+
+        return {'tableId': obj['tableId'], 'headers': obj['headers'], 'rows': refs}
+
+    def values(self):
+        """every row's values, keyed by (study_id, internal_id)"""
+        return {(r['values'][0], str(r['values'][1])): r['values'] for r in self.rows.values()}
+
+
+class FakeDlp(object):
+    """stand-in for the parts of google.cloud.dlp.DlpServiceClient used by app.inspection.DlpDispatcher
+
+    Notes: every inspect_content call sleeps a random time up to latency seconds. The first quota_errors calls raise
+    ResourceExhausted and tables whose payload is over max_bytes raise InvalidArgument, as DLP does. Queries in
+    findings are reported at their row index. Sent chunks are kept in tables, rejected ones in rejected
+    """
+
+    def __init__(self, findings=None, latency=0., quota_errors=0, max_bytes=None):
+        self.findings = findings if findings is not None else {}
+        self.latency = latency
+        self.quota_errors = quota_errors
+        self.max_bytes = max_bytes
+
+        self.tables = []
+        self.rejected = []
+        self.__lock = Lock()
+
+    def __repr__(self):
+        return f'<FakeDlp(requests={len(self.tables)}, rejected={len(self.rejected)})>'
+
+    def project_path(self, project_id):
+        return f'projects/{project_id}'
+
+    def inspect_content(self, parent, inspect_config, item):
+        queries = [r['values'][0]['string_value'] for r in item['table']['rows']]
+        time.sleep(random.uniform(0, self.latency))
+
+        with self.__lock:
+            if self.quota_errors > 0:
+                self.quota_errors -= 1
+                raise gexc.ResourceExhausted('quota exceeded')
+
+            if self.max_bytes is not None and payload_bytes(queries) > self.max_bytes:
+                self.rejected.append(queries)
+                raise gexc.InvalidArgument('Request payload too large')
+
+            self.tables.append(queries)
+
+        findings = []
+        for i, q in enumerate(queries):
+            for info_type, likelihood in self.findings.get(q, []):
+                findings.append(SimpleNamespace(
+                    info_type=SimpleNamespace(name=info_type),
+                    likelihood=likelihood,
+                    location=SimpleNamespace(content_locations=[
+                        SimpleNamespace(record_location=SimpleNamespace(table_location=SimpleNamespace(row_index=i)))
+                    ])
+                ))
+
+        return SimpleNamespace(result=SimpleNamespace(findings=findings))
+
+
+class FakeSes(object):
+    """stand-in for the send_email of a boto3 SES client
+
+    Notes: sent emails are kept in sent as send_email keyword arguments. Errors put in failures are raised by the next
+    calls, one per call, as ClientError like SES raises them
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.failures = []
+
+    def __repr__(self):
+        return f'<FakeSes(sent={len(self.sent)})>'
+
+    def send_email(self, **kwargs):
+        if len(self.failures) > 0:
+            error = {'Error': {'Code': 'Throttling', 'Message': self.failures.pop(0)}}
+            raise ClientError(error, 'SendEmail')
+
+        self.sent.append(kwargs)
+        return {'MessageId': str(len(self.sent))}
+
+
+class FakeDrive(object):
+    """local HTTP stand-in for the Google Drive file endpoints used by app.drive.RangedDownload
+
+    Notes: serves one file at http://127.0.0.1:<port>/drive/v3/files/<file_id>. ?fields=size answers the metadata
+    request and ?alt=media the content, honouring Range headers unless ranges is False. The first drops range
+    requests send their headers and half their bytes, then drop the connection. Every range requested is counted in
+    requests by its start byte
+    """
+
+    def __init__(self, file_id, content, drops=0, ranges=True):
+        self.file_id = file_id
+        self.content = content
+        self.drops = drops
+        self.ranges = ranges
+        self.requests = Counter()
+
+        self.__lock = Lock()
+        self.__server = ThreadingHTTPServer(('127.0.0.1', 0), self.__handler())
+        self.__server.daemon_threads = True
+        self.__thread = Thread(target=self.__server.serve_forever, daemon=True)
+
+    def __repr__(self):
+        return f'<FakeDrive(file_id={self.file_id}, size={len(self.content)}, drops={self.drops})>'
+
+    def __enter__(self):
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    @property
+    def url(self):
+        """stand-in for app.drive.DRIVE_FILE_URL"""
+        return f'http://127.0.0.1:{self.__server.server_address[1]}/drive/v3/files/{{file_id}}'
+
+    def drop(self):
+        """whether to drop the connection of the next range request"""
+        with self.__lock:
+            if self.drops > 0:
+                self.drops -= 1
+                return True
+            return False
+
+    def __handler(self):
+        drive = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if not self.path.startswith(f'/drive/v3/files/{drive.file_id}'):
+                    return self.send_error(404)
+
+                if 'fields=size' in self.path:
+                    return self.reply(200, json.dumps({'size': str(len(drive.content))}).encode('utf-8'))
+
+                m = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+                if m is None or not drive.ranges:
+                    return self.reply(200, drive.content)
+
+                start, end = int(m.group(1)), int(m.group(2))
+                drive.requests[start] += 1
+                body = drive.content[start:end + 1]
+
+                if drive.drop():
+                    self.reply(206, body, send=len(body) // 2)
+                    self.close_connection = True
+                else:
+                    self.reply(206, body)
+
+            def reply(self, status, body, send=None):
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body[:send])
+                self.wfile.flush()
+
+        return Handler
@@ -0,0 +1,175 @@
+import datetime as dt
+from threading import Event
+
+import pytest
+from pytz import timezone
+
+import app.config as secrets
+import app.context as ctx
+from app import archive_agent
+
+from test_context import add_consent
+
+
+class FakeExtractor(object):
+    """an extractor that completes its consent, optionally held until released"""
+    runs = []
+    started = Event()
+    released = Event()
+
+    def __init__(self, consent):
+        self.consent = consent
+
+    def run(self):
+        FakeExtractor.runs.append(self.consent.internal_id)
+        FakeExtractor.started.set()
+        FakeExtractor.released.wait(10)
+        self.consent.set_status(ctx.ConsentStatus.COMPLETE)
+
+
+@pytest.fixture
+def extractor():
+    FakeExtractor.runs = []
+    FakeExtractor.started = Event()
+    FakeExtractor.released = Event()
+    yield FakeExtractor
+    FakeExtractor.released.set()
+
+
+def ready_consent(conn):
+    cid = add_consent(conn)
+
+    with ctx.session_scope(conn) as s:
+        s.query(ctx.Consent).get(cid).set_status(ctx.ConsentStatus.READY)
+
+    return cid
+
+
+def consent_state(conn, cid):
+    with ctx.session_scope(conn) as s:
+        consent = s.query(ctx.Consent).get(cid)
+        return consent.status, consent.claim_count, [l.msg for l in consent.log_entries]
+
+
+def test_finished_task_resets_its_claims(conn, extractor):
+    cid = ready_consent(conn)
+    extractor.released.set()
+
+    assert ctx.claim_task('worker', conn) == cid
+    assert consent_state(conn, cid)[1] == 1
+
+    archive_agent.run_task(cid, 'worker', conn, extractor)
+
+    status, claims, logs = consent_state(conn, cid)
+    assert status == ctx.ConsentStatus.COMPLETE.value
+    assert claims == 0
+
+
+def test_claim_task_takes_retries_by_next_eligible_at_then_new_consents_by_consent_dt(conn):
+    def consent(study_id, consent_dt, next_eligible_at=None):
+        with ctx.session_scope(conn) as s:
+            c = ctx.add_entity(s, ctx.Consent(study_id=study_id, consent_dt=consent_dt))
+            c.set_status(ctx.ConsentStatus.READY if next_eligible_at is None else ctx.ConsentStatus.DRIVE_NOT_READY)
+            c.next_eligible_at = next_eligible_at
+            return c.internal_id
+
+    # consent_dt is in TIMEZONE and next_eligible_at in utc, so neither is compared with the other
+    new_late = consent('new late', dt.datetime(2019, 1, 2))
+    retry_late = consent('retry late', dt.datetime(2019, 1, 1), next_eligible_at=dt.datetime(2019, 1, 3, 5))
+    new_early = consent('new early', dt.datetime(2019, 1, 1))
+    retry_early = consent('retry early', dt.datetime(2019, 1, 2), next_eligible_at=dt.datetime(2019, 1, 1, 5))
+
+    claimed = [ctx.claim_task(f'worker-{i}', conn) for i in range(5)]
+    assert claimed == [retry_early, retry_late, new_early, new_late, None]
+
+
+def test_drive_retries_stop_at_the_deadline_in_utc(conn, monkeypatch):
+    monkeypatch.setattr(secrets, 'DRIVE_BACKOFF_FACTOR', 1000)
+
+    # consented in TIMEZONE one hour short of the longest wait for Drive
+    local = dt.datetime.now(timezone(secrets.TIMEZONE)).replace(tzinfo=None)
+    consent_dt = local - dt.timedelta(seconds=secrets.MAX_TIME_FOR_DRIVE_WAIT) + dt.timedelta(hours=1)
+
+    with ctx.session_scope(conn) as s:
+        consent = ctx.add_entity(s, ctx.Consent(study_id='s1', consent_dt=consent_dt))
+        consent.mark_drive_not_ready()
+        consent.mark_drive_not_ready()
+
+        left = consent.next_eligible_at - dt.datetime.utcnow()
+        assert dt.timedelta(minutes=59) < left <= dt.timedelta(hours=1)
+
+
+def test_consent_claimed_too_often_is_failed_without_running(conn, extractor):
+    cid = ready_consent(conn)
+
+    # workers that died mid-task never released their claims, the lease runs out and the consent is due again
+    for i in range(secrets.TASK_MAX_CLAIMS + 1):
+        assert ctx.claim_task(f'worker-{i}', conn, lease_seconds=-1) == cid
+
+    archive_agent.run_task(cid, f'worker-{secrets.TASK_MAX_CLAIMS}', conn, extractor)
+
+    status, claims, logs = consent_state(conn, cid)
+    assert status == ctx.ConsentStatus.FAILED.value
+    assert extractor.runs == []
+    assert f'Marked as failed. Task claimed {secrets.TASK_MAX_CLAIMS + 1} times without finishing.' in logs
+
+    assert ctx.claim_task('worker', conn) is None
+
+
+def test_heartbeat_stops_the_worker_when_the_lease_is_lost(conn, extractor, monkeypatch):
+    monkeypatch.setattr(secrets, 'TASK_HEARTBEAT_SECONDS', .01)
+
+    exits = []
+
+    def exit_(code):
+        exits.append(code)
+        extractor.released.set()
+
+    monkeypatch.setattr(archive_agent.os, '_exit', exit_)
+
+    cid = ready_consent(conn)
+    assert ctx.claim_task('worker', conn) == cid
+
+    class LeaseLost(FakeExtractor):
+        """an extractor whose lease is taken over by another worker while it runs"""
+
+        def run(self):
+            with ctx.session_scope(conn) as s:
+                s.query(ctx.Consent).filter(ctx.Consent.internal_id == cid).update({
+                    ctx.Consent.lease_owner: 'another worker',
+                    ctx.Consent.lease_expires_at: dt.datetime.utcnow() + dt.timedelta(seconds=600)
+                }, synchronize_session=False)
+
+            super().run()
+
+    archive_agent.run_task(cid, 'worker', conn, LeaseLost)
+
+    assert exits == [1]
+    assert 'task lease lost to another worker, stopping the worker' in consent_state(conn, cid)[2]
+
+
+def test_heartbeat_stops_the_worker_when_renewals_fail_past_the_lease(conn, extractor, monkeypatch):
+    monkeypatch.setattr(secrets, 'TASK_HEARTBEAT_SECONDS', .01)
+    monkeypatch.setattr(secrets, 'TASK_LEASE_SECONDS', .1)
+
+    def renew_lease(*args, **kwargs):
+        raise Exception('database unavailable')
+
+    exits = []
+
+    def exit_(code):
+        exits.append(code)
+        extractor.released.set()
+
+    monkeypatch.setattr(ctx, 'renew_lease', renew_lease)
+    monkeypatch.setattr(archive_agent.os, '_exit', exit_)
+
+    cid = ready_consent(conn)
+    assert ctx.claim_task('worker', conn) == cid
+
+    archive_agent.run_task(cid, 'worker', conn, extractor)
+
+    logs = consent_state(conn, cid)[2]
+    assert exits == [1]
+    assert 'renewing task lease failed with <database unavailable>' in logs
+    assert 'task lease expired before it could be renewed, stopping the worker' in logs
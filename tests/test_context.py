@@ -0,0 +1,109 @@
+import datetime as dt
+from multiprocessing.dummy import Pool as TPool
+
+from sqlalchemy import event
+
+import app.config as secrets
+import app.context as ctx
+
+
+def add_consent(conn, study_id='s1'):
+    with ctx.session_scope(conn) as s:
+        consent = ctx.add_entity(s, ctx.Consent(study_id=study_id, consent_dt=dt.datetime(2019, 1, 1)))
+        return consent.internal_id
+
+
+def test_log_entries_sort_written_and_buffered_entries(conn):
+    cid = add_consent(conn)
+
+    with ctx.session_scope(conn) as s:
+        ctx.add_log_entry('written', cid, session=s)
+
+    ctx.add_log_entry('buffered', cid)
+
+    with ctx.session_scope(conn) as s:
+        consent = s.query(ctx.Consent).get(cid)
+
+        assert [l.msg for l in consent.latest_archive_transactions()] == ['buffered', 'written']
+        assert [n['msg'] for n in consent.dict['notes']] == ['written', 'buffered']
+        assert consent.notes().endswith('buffered')
+
+
+def test_log_entries_drops_entries_flushed_while_reading(conn, monkeypatch):
+    cid = add_consent(conn)
+    ctx.add_log_entry('buffered', cid)
+
+    pending = ctx.LOG_SINK.pending
+
+    def pending_then_flush(cid_):
+        entries = pending(cid_)
+        ctx.LOG_SINK.flush()
+        return entries
+
+    monkeypatch.setattr(ctx.LOG_SINK, 'pending', pending_then_flush)
+
+    with ctx.session_scope(conn) as s:
+        consent = s.query(ctx.Consent).get(cid)
+        assert [l.msg for l in consent.log_entries] == ['buffered']
+
+
+def test_location_sids_merge_with_location_sids(conn):
+    cid = add_consent(conn)
+
+    with ctx.session_scope(conn) as s:
+        consent = s.query(ctx.Consent).get(cid)
+        consent.set_search_sid('syn30')
+        consent.set_location_sid('syn20')
+        consent.set_location_sid('syn10')
+
+        assert consent.location_sid == 'syn10, syn20'
+        assert consent.search_sid == 'syn30'
+
+
+def test_put_dlp_verdicts_keeps_the_batch_when_another_worker_cached_a_key(conn):
+    engine = ctx.get_engine(conn)
+    raced = []
+
+    def cache_from_another_worker(connection, cursor, statement, parameters, context, executemany):
+        # the verdict lands between this worker's cache lookup and its insert
+        if 'INTO dlp_verdict' in statement and len(raced) == 0:
+            raced.append(statement)
+            cursor.connection.execute(
+                'INSERT INTO dlp_verdict (key, info_type, likelihood, created, last_used) VALUES (?, ?, ?, ?, ?)',
+                ('a', 'PHONE_NUMBER', 4, str(dt.datetime.utcnow()), str(dt.datetime.utcnow()))
+            )
+
+    event.listen(engine, 'before_cursor_execute', cache_from_another_worker)
+    try:
+        ctx.put_dlp_verdicts({'a': ('PHONE_NUMBER', 4), 'b': (None, None)}, conn=conn)
+    finally:
+        event.remove(engine, 'before_cursor_execute', cache_from_another_worker)
+
+    assert len(raced) == 1
+    assert ctx.get_dlp_verdicts(['a', 'b'], conn=conn) == {'a': ('PHONE_NUMBER', 4), 'b': (None, None)}
+
+
+def test_put_dlp_verdicts_replaces_expired_verdicts(conn):
+    ctx.put_dlp_verdicts({'a': (None, None)}, conn=conn)
+
+    with ctx.session_scope(conn) as s:
+        s.query(ctx.DlpVerdict).update({
+            ctx.DlpVerdict.created: dt.datetime.utcnow() - dt.timedelta(seconds=secrets.DLP_CACHE_TTL + 1)
+        })
+
+    assert ctx.get_dlp_verdicts(['a'], conn=conn) == {}
+
+    ctx.put_dlp_verdicts({'a': ('STREET_ADDRESS', 3)}, conn=conn)
+    assert ctx.get_dlp_verdicts(['a'], conn=conn) == {'a': ('STREET_ADDRESS', 3)}
+
+
+def test_concurrent_put_dlp_verdicts_keep_every_batch(conn):
+    batches = [{f'k{j}': ('PHONE_NUMBER', 4) for j in range(i, i + 20)} for i in range(0, 80, 10)]
+
+    pool = TPool(len(batches))
+    pool.map(lambda b: ctx.put_dlp_verdicts(b, conn=conn), batches)
+    pool.close()
+    pool.join()
+
+    keys = [f'k{j}' for j in range(90)]
+    assert sorted(ctx.get_dlp_verdicts(keys, conn=conn).keys()) == sorted(keys)
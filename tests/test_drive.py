@@ -0,0 +1,59 @@
+import os
+
+import pytest
+import requests
+
+import app.drive as drive
+from app.drive import RangedDownload, RangeNotSupported
+from app.retry import GOOGLE
+
+from fakes import FakeDrive
+
+CONTENT = os.urandom(10 * 1024 + 17)
+RANGE_SIZE = 1024
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    def serve_(**kwargs):
+        fake = FakeDrive('f1', CONTENT, **kwargs)
+        monkeypatch.setattr(drive, 'DRIVE_FILE_URL', fake.url)
+        return fake
+
+    return serve_
+
+
+def download(path, workers=4):
+    return RangedDownload(requests.Session(), 'f1', str(path), range_size=RANGE_SIZE, workers=workers)
+
+
+def test_download_survives_dropped_connections(serve, tmp_path):
+    with serve(drops=3) as fake:
+        x = download(tmp_path / 'takeout.zip')
+        assert x.run()
+
+    assert (tmp_path / 'takeout.zip').read_bytes() == CONTENT
+    assert sum(fake.requests.values()) == len(x.ranges) + 3
+
+
+def test_failed_download_resumes_from_the_manifest(serve, tmp_path, monkeypatch):
+    monkeypatch.setattr(GOOGLE, 'attempts', 1)
+
+    with serve(drops=2) as fake:
+        x = download(tmp_path / 'takeout.zip')
+        assert not x.run()
+        assert len(x.pending) == 2
+        assert os.path.exists(x.manifest_path)
+
+        # a new attempt only asks for the two ranges that were dropped
+        y = download(tmp_path / 'takeout.zip')
+        assert y.run()
+
+    assert (tmp_path / 'takeout.zip').read_bytes() == CONTENT
+    assert sorted(fake.requests.values()) == [1] * (len(y.ranges) - 2) + [2, 2]
+
+
+def test_whole_file_answers_raise_range_not_supported(serve, tmp_path):
+    with serve(ranges=False):
+        with pytest.raises(RangeNotSupported):
+            download(tmp_path / 'takeout.zip').run()
@@ -0,0 +1,78 @@
+from multiprocessing import get_context, Pipe
+import os
+
+import app.context as ctx
+
+from test_context import add_consent
+
+
+def in_child(fn):
+    """run fn in a forked process and return what it returned, or raise what it raised. a hung child is killed"""
+    receive, send = Pipe()
+
+    def run():
+        try:
+            send.send((True, fn()))
+        except Exception as e:
+            send.send((False, repr(e)))
+
+    child = get_context('fork').Process(target=run)
+    child.start()
+    if not receive.poll(30):
+        child.kill()
+        child.join()
+        raise AssertionError('the child did not finish')
+
+    ok, result = receive.recv()
+    child.join()
+
+    assert ok, result
+    return result
+
+
+def test_engines_are_reused_within_a_process(conn):
+    assert ctx.get_engine(conn) is ctx.get_engine(dict(conn))
+    assert ctx.registered(conn)[1] is ctx.registered(conn)[1]
+
+
+def test_forked_child_gets_a_fresh_pool(conn):
+    cid = add_consent(conn)
+    engine = ctx.get_engine(conn)
+    pool = engine.pool
+
+    def child():
+        with ctx.session_scope(conn) as s:
+            consents = s.query(ctx.Consent).count()
+
+        return ctx.get_engine(conn) is engine, engine.pool is pool, pool in ctx.INHERITED_POOLS, consents
+
+    assert in_child(child) == (True, False, True, 1)
+
+    # nothing the child did touched the parent's pool
+    assert engine.pool is pool
+    with ctx.session_scope(conn) as s:
+        assert s.query(ctx.Consent).get(cid) is not None
+
+
+def test_inherited_postgres_connections_are_replaced_in_the_child(postgres):
+    engine = ctx.get_engine(postgres)
+    pool = engine.pool
+
+    # leave a connection opened by the parent in the pool
+    with engine.connect() as c:
+        inherited = id(c.connection.connection)
+
+    def child():
+        # checking out of the pool the child inherited finds the parent's connection and replaces it
+        c = pool.connect()
+        try:
+            return id(c.connection) != inherited, c._connection_record.info['pid'] == os.getpid()
+        finally:
+            c.close()
+
+    assert in_child(child) == (True, True)
+
+    # the parent's connection is still open and usable
+    with engine.connect() as c:
+        assert id(c.connection.connection) == inherited
+        assert c.execute('SELECT 1').scalar() == 1
@@ -0,0 +1,138 @@
+import datetime as dt
+
+from sqlalchemy import event, inspect
+
+import app.context as ctx
+
+from test_context import add_consent
+
+
+def plans(conn, fn, table):
+    """run fn and return the query plan of every select it sent against a table
+
+    Notes: Postgres plans a sequential scan of a table this small whatever its indexes, so sequential scans are
+    disabled while explaining, leaving an index scan wherever one can be used
+    """
+    engine = ctx.get_engine(conn)
+    statements = []
+
+    def capture(connection, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and f'FROM {table}' in statement:
+            statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        fn()
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+
+    assert len(statements) > 0
+
+    with engine.connect() as c:
+        if conn['drivername'] == 'postgres':
+            c.execute('SET enable_seqscan = off')
+            explain = 'EXPLAIN'
+        else:
+            explain = 'EXPLAIN QUERY PLAN'
+
+        return [
+            ' '.join([r[-1] for r in c.execute(f'{explain} {statement}', parameters)])
+            for statement, parameters in statements
+        ]
+
+
+def test_claim_task_searches_the_status_index(conn):
+    add_consent(conn)
+
+    for plan in plans(conn, lambda: ctx.claim_task('worker', conn=conn), 'consent'):
+        assert 'USING INDEX idx_consent_status_eligible' in plan
+        assert 'SCAN consent' not in plan
+
+
+def test_next_due_at_searches_the_status_index(conn):
+    add_consent(conn)
+
+    for plan in plans(conn, lambda: ctx.next_due_at(conn=conn), 'consent'):
+        assert 'idx_consent_status_eligible' in plan
+        assert 'SCAN consent' not in plan
+
+
+def test_log_entries_search_the_consent_log_index(conn):
+    cid = add_consent(conn)
+
+    with ctx.session_scope(conn) as s:
+        ctx.add_log_entry('written', cid, session=s)
+
+    def read_logs():
+        with ctx.session_scope(conn) as s:
+            s.query(ctx.Consent).get(cid).log_entries
+
+    for plan in plans(conn, read_logs, 'log'):
+        assert 'USING INDEX idx_log_cid_ts' in plan
+
+
+def test_daily_digest_searches_the_consent_dt_index(conn):
+    add_consent(conn)
+
+    consent_dt = [p for p in plans(conn, lambda: ctx.daily_digest(conn=conn, day=dt.date(2019, 1, 1)), 'consent')
+                  if 'consent_dt' in p]
+
+    assert len(consent_dt) > 0
+    for plan in consent_dt:
+        assert 'USING INDEX idx_consent_dt' in plan or 'USING COVERING INDEX idx_consent_dt' in plan
+
+
+def test_migrate_database_adds_indexes_to_old_tables(conn, tmp_path):
+    old = {'drivername': 'sqlite', 'path': str(tmp_path / 'old.db')}
+    ctx.get_engine(old).execute(
+        'CREATE TABLE consent (internal_id INTEGER PRIMARY KEY, study_id VARCHAR, consent_dt DATETIME, status VARCHAR)'
+    )
+
+    ctx.create_database(old)
+    ctx.create_database(old)
+
+    existing = inspect(ctx.get_engine(old))
+    assert 'next_eligible_at' in [c['name'] for c in existing.get_columns('consent')]
+    indexes = set([i['name'] for i in existing.get_indexes('consent')])
+    assert {'idx_consent_status_eligible', 'idx_consent_dt'} <= indexes
+
+
+def test_postgres_claim_task_searches_the_status_index(postgres):
+    add_consent(postgres)
+
+    for plan in plans(postgres, lambda: ctx.claim_task('worker', conn=postgres), 'consent'):
+        assert 'idx_consent_status_eligible' in plan
+        assert 'Seq Scan on consent' not in plan
+
+
+def test_postgres_next_due_at_searches_the_status_index(postgres):
+    add_consent(postgres)
+
+    for plan in plans(postgres, lambda: ctx.next_due_at(conn=postgres), 'consent'):
+        assert 'idx_consent_status_eligible' in plan
+        assert 'Seq Scan on consent' not in plan
+
+
+def test_postgres_log_entries_search_the_consent_log_index(postgres):
+    cid = add_consent(postgres)
+
+    with ctx.session_scope(postgres) as s:
+        ctx.add_log_entry('written', cid, session=s)
+
+    def read_logs():
+        with ctx.session_scope(postgres) as s:
+            s.query(ctx.Consent).get(cid).log_entries
+
+    for plan in plans(postgres, read_logs, 'log'):
+        assert 'idx_log_cid_ts' in plan
+
+
+def test_postgres_daily_digest_searches_the_consent_dt_index(postgres):
+    add_consent(postgres)
+
+    consent_dt = [p for p in plans(postgres, lambda: ctx.daily_digest(conn=postgres, day=dt.date(2019, 1, 1)),
+                                   'consent') if 'consent_dt' in p]
+
+    assert len(consent_dt) > 0
+    for plan in consent_dt:
+        assert 'idx_consent_dt' in plan
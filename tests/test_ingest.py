@@ -0,0 +1,94 @@
+import datetime as dt
+import json
+
+import pytest
+from sqlalchemy import event
+
+import app.config as secrets
+import app.context as ctx
+from app.ingest import ingest_consents, read_consents
+
+from test_context import add_consent
+
+
+def records(n, start=0):
+    return [{
+        'study_id': f's{i}',
+        'consent_dt': dt.datetime(2019, 1, 1) + dt.timedelta(minutes=i),
+        'credentials': json.dumps({'access_token': f'token {i}'}),
+        'email': f's{i}@example.com',
+        'first_name': None,
+        'last_name': None
+    } for i in range(start, start + n)]
+
+
+def test_read_consents_from_csv_and_jsonl(tmp_path):
+    csv = tmp_path / 'consents.csv'
+    csv.write_text('study_id,consent_dt,credentials,email\ns1,2019-01-02 10:00,"{""a"": 1}",s1@example.com\n')
+
+    jsonl = tmp_path / 'consents.jsonl'
+    jsonl.write_text('{"study_id": "s1", "consent_dt": "2019-01-02T10:00:00", "credentials": "{\\"a\\": 1}", '
+                     '"email": "s1@example.com"}\n\n')
+
+    expected = [{
+        'study_id': 's1',
+        'consent_dt': dt.datetime(2019, 1, 2, 10),
+        'credentials': '{"a": 1}',
+        'email': 's1@example.com',
+        'first_name': None,
+        'last_name': None
+    }]
+
+    assert read_consents(str(csv)) == expected
+    assert read_consents(str(jsonl)) == expected
+
+
+def test_read_consents_rejects_records_missing_required_fields(tmp_path):
+    path = tmp_path / 'consents.jsonl'
+    path.write_text('{"study_id": "s1", "consent_dt": "2019-01-02", "credentials": "x"}\n'
+                    '{"study_id": "s2", "credentials": ""}\n')
+
+    with pytest.raises(Exception, match='consent record 2 is missing <consent_dt, credentials>'):
+        read_consents(str(path))
+
+
+def test_ingest_consents_returns_the_ids_of_its_rows(conn):
+    # ids of the batches follow rows already in the table
+    for i in range(3):
+        add_consent(conn, study_id=f'existing {i}')
+
+    statements = []
+
+    @event.listens_for(ctx.get_engine(conn), 'before_cursor_execute')
+    def count(connection, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT INTO consent '):
+            statements.append(len(parameters))
+
+    try:
+        ids = ingest_consents(records(300), conn=conn, batch_size=1000, workers=2)
+    finally:
+        event.remove(ctx.get_engine(conn), 'before_cursor_execute', count)
+
+    # 9 bound parameters a row, claim_count included, keep every insert within sqlite's 999
+    assert statements == [999, 999, 702]
+
+    assert len(set(ids)) == 300
+    with ctx.session_scope(conn) as s:
+        consents = {c.internal_id: c for c in s.query(ctx.Consent).filter(ctx.Consent.internal_id.in_(ids))}
+
+        assert [consents[i].study_id for i in ids] == [r['study_id'] for r in records(300)]
+        assert consents[ids[-1]].credentials == json.dumps({'access_token': 'token 299'})
+        assert set(c.status for c in consents.values()) == {ctx.ConsentStatus.READY.value}
+
+    synapse = secrets.syn.values()
+    assert all((f's{i}', str(internal_id)) in synapse for i, internal_id in enumerate(ids))
+
+
+def test_ingest_consents_on_postgres_returns_the_ids_of_its_rows(postgres):
+    add_consent(postgres, study_id='existing')
+
+    ids = ingest_consents(records(50), conn=postgres, batch_size=20, workers=2)
+
+    with ctx.session_scope(postgres) as s:
+        consents = {c.internal_id: c.study_id for c in s.query(ctx.Consent).filter(ctx.Consent.internal_id.in_(ids))}
+        assert [consents[i] for i in ids] == [r['study_id'] for r in records(50)]
@@ -0,0 +1,58 @@
+import pytest
+
+from app.inspection import DlpDispatcher, payload_bytes
+from app.retry import RetryPolicy
+
+from fakes import FakeDlp
+
+
+@pytest.fixture
+def policy():
+    return RetryPolicy('dlp', attempts=5, base=.001, cap=.01, budget_min=100)
+
+
+def queries(n):
+    return [f'query {i:04d}' for i in range(n)]
+
+
+def test_findings_are_matched_to_their_queries_across_chunks(policy):
+    qs = queries(200)
+    findings = {q: [('PHONE_NUMBER', 3)] for q in qs[::7]}
+    findings[qs[3]] = [('PERSON_NAME', 2), ('EMAIL_ADDRESS', 4)]
+
+    dlp = FakeDlp(findings=findings, latency=.005)
+    dispatcher = DlpDispatcher(dlp, 'p', {}, workers=4, qps=1000, max_rows=9, max_bytes=10000, policy=policy)
+
+    found = dispatcher.inspect(qs)
+
+    expected = {q: ('PHONE_NUMBER', 3) for q in qs[::7]}
+    expected[qs[3]] = ('EMAIL_ADDRESS,PERSON_NAME', 4)
+    assert found == expected
+
+    assert dispatcher.requests == len(dlp.tables) == 23
+    assert sorted([q for t in dlp.tables for q in t]) == qs
+
+
+def test_quota_errors_are_retried(policy):
+    qs = queries(30)
+    dlp = FakeDlp(findings={qs[0]: [('PHONE_NUMBER', 3)]}, quota_errors=2)
+    dispatcher = DlpDispatcher(dlp, 'p', {}, workers=1, qps=1000, max_rows=10, max_bytes=10000, policy=policy)
+
+    assert dispatcher.inspect(qs) == {qs[0]: ('PHONE_NUMBER', 3)}
+    assert policy.retries == 2
+    assert len(dlp.tables) == 3
+
+
+def test_too_large_payloads_are_split_and_shrink_later_chunks(policy):
+    qs = queries(100)
+    row = payload_bytes(qs[:1])
+
+    dlp = FakeDlp(findings={q: [('PHONE_NUMBER', 3)] for q in qs}, max_bytes=5 * row)
+    dispatcher = DlpDispatcher(dlp, 'p', {}, workers=1, qps=1000, max_rows=100, max_bytes=20 * row, policy=policy)
+
+    assert dispatcher.inspect(qs) == {q: ('PHONE_NUMBER', 3) for q in qs}
+
+    # the first chunk and both its halves were rejected, every chunk built after that fits
+    assert [len(t) for t in dlp.rejected] == [20, 10, 10]
+    assert dispatcher.max_bytes == 5 * row
+    assert all([len(t) == 5 for t in dlp.tables])
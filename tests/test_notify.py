@@ -0,0 +1,84 @@
+from multiprocessing.dummy import Pool as TPool
+
+import pytest
+
+import app.config as secrets
+import app.notify as notify
+from app.notify import get_ses_client, NotificationBatcher, send_email, set_ses_client
+
+from fakes import FakeSes
+from test_engines import in_child
+
+
+@pytest.fixture
+def ses(monkeypatch):
+    """a FakeSes used as the SES client of the test process"""
+    monkeypatch.setattr(notify, 'SES_CLIENT', None)
+    monkeypatch.setattr(notify, 'SES_CLIENT_PID', None)
+    monkeypatch.setattr(secrets, 'ADMIN_EMAILS', ['admin@example.com'])
+    monkeypatch.setattr(secrets, 'PARTICIPANT_EMAIL_BODY', '<p>{{ x.study_id }}</p>')
+
+    client = FakeSes()
+    set_ses_client(client)
+    return client
+
+
+def test_ses_client_is_built_once_per_process(monkeypatch):
+    monkeypatch.setattr(notify, 'SES_CLIENT', None)
+    monkeypatch.setattr(notify, 'SES_CLIENT_PID', None)
+    monkeypatch.setattr(secrets, 'REGION_NAME', 'us-east-1')
+
+    # the deployed config sets the AWS keys, the template does not
+    monkeypatch.setattr(secrets, 'AWS_ACCESS_KEY_ID', 'x', raising=False)
+    monkeypatch.setattr(secrets, 'AWS_SECRET_ACCESS_KEY', 'x', raising=False)
+
+    pool = TPool(8)
+    clients = pool.map(lambda i: get_ses_client(), range(32))
+    pool.close()
+    pool.join()
+
+    client = get_ses_client()
+    assert all([c is client for c in clients])
+
+    # a forked process builds its own
+    assert in_child(lambda: get_ses_client() is not client)
+    assert get_ses_client() is client
+
+
+def test_send_email_uses_the_client_set_for_the_process(ses):
+    send_email('subject', '<p>body</p>')
+
+    assert len(ses.sent) == 1
+    assert ses.sent[0]['Destination'] == {'ToAddresses': ['admin@example.com']}
+    assert ses.sent[0]['Message']['Subject']['Data'] == 'subject'
+
+
+def test_flush_sends_one_summary_of_every_notification(ses):
+    batcher = NotificationBatcher(60)
+    for study_id in ['s1', 's2', 's3']:
+        batcher.add({'study_id': study_id})
+
+    assert batcher.flush() == 3
+    assert batcher.flush() == 0
+
+    assert len(ses.sent) == 1
+    assert ses.sent[0]['Message']['Subject']['Data'] == '3 consents processed'
+    assert ses.sent[0]['Message']['Body']['Html']['Data'] == '<p>s1</p><hr><p>s2</p><hr><p>s3</p>'
+
+
+def test_failed_flush_puts_notifications_back(ses):
+    batcher = NotificationBatcher(60)
+    batcher.add({'study_id': 's1'})
+    batcher.add({'study_id': 's2'})
+
+    ses.failures = ['Maximum sending rate exceeded']
+    with pytest.raises(Exception, match='email failed with <Maximum sending rate exceeded>'):
+        batcher.flush()
+
+    assert len(batcher) == 2
+    assert len(ses.sent) == 0
+
+    # notifications added after the failure are sent after the ones put back
+    batcher.add({'study_id': 's3'})
+    assert batcher.flush() == 3
+    assert ses.sent[0]['Message']['Body']['Html']['Data'] == '<p>s1</p><hr><p>s2</p><hr><p>s3</p>'
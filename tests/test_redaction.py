@@ -0,0 +1,50 @@
+import pytest
+
+from app.redaction import PreRedactor
+
+INFO_TYPES = ['EMAIL_ADDRESS', 'US_SOCIAL_SECURITY_NUMBER', 'CREDIT_CARD_NUMBER', 'PHONE_NUMBER', 'STREET_ADDRESS']
+
+
+@pytest.fixture
+def redactor():
+    return PreRedactor(safe_tokens=['weather', 'news'], info_types=INFO_TYPES)
+
+
+@pytest.mark.parametrize('query, info_type', [
+    ('jane.doe@example.com', 'EMAIL_ADDRESS'),
+    ('123-45-6789', 'US_SOCIAL_SECURITY_NUMBER'),
+    ('4111 1111 1111 1111', 'CREDIT_CARD_NUMBER'),
+    ('call (206) 555-0123', 'PHONE_NUMBER'),
+    ('206-555-0123', 'PHONE_NUMBER'),
+    ('+1 206.555.0123 hours', 'PHONE_NUMBER'),
+    ('123 main st', 'STREET_ADDRESS'),
+    ('directions to 1600 pennsylvania ave', 'STREET_ADDRESS'),
+    ('4 privet drive apt 2', 'STREET_ADDRESS'),
+    ('221 b baker street', 'STREET_ADDRESS'),
+])
+def test_certain_hits(redactor, query, info_type):
+    redacted, safe, ambiguous = redactor.triage([query])
+    assert redacted == {query: (info_type, 5)}
+
+
+@pytest.mark.parametrize('query', [
+    '2 way radio',
+    'top 10 place to visit',
+    'windows 10 drive letter',
+    'iphone 11 screen way too dim',
+    'isbn 0306406152',
+    '978-0-306-40615-7',
+    '2065550123',
+    'order 12345678901',
+])
+def test_lookalikes_go_to_dlp(redactor, query):
+    redacted, safe, ambiguous = redactor.triage([query])
+    assert redacted == {}
+    assert ambiguous == [query]
+
+
+def test_safe_queries_skip_dlp(redactor):
+    redacted, safe, ambiguous = redactor.triage(['weather', 'Weather News', 'weather 2'])
+
+    assert safe == ['weather', 'Weather News']
+    assert ambiguous == ['weather 2']
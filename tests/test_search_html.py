@@ -0,0 +1,68 @@
+from io import BytesIO
+import os
+
+import pytest
+
+from app.xtractor import iter_search_blocks, process_userSearchQueries_in_htmlFormat
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'my_activity_search.html')
+
+SEARCHES = [
+    ('Jan 2, 2019, 9:00:00 AM PST', 'weather seattle'),
+    ('Jan 2, 2019, 12:30:00 PM PST', 'café near me'),
+    ('Jan 3, 2019, 10:15:00 PM GMT-07:00', 'how long to boil an egg'),
+    ('Jan 4, 2019, 1:05:09 AM PST', '🙂 emoji meaning'),
+]
+
+VISITS = [
+    ('Jan 2, 2019, 9:01:12 AM PST', 'Seattle forecast &amp; radar',
+     'https://www.example.com/forecast?city=seattle&amp;days=7'),
+    ('Jan 3, 2019, 10:16:00 PM GMT-07:00', 'Egg - Wikipedia', 'https://en.wikipedia.org/wiki/Egg'),
+]
+
+
+def corpus():
+    with open(CORPUS, 'rb') as f:
+        return f.read()
+
+
+def test_searches_and_visits_are_parsed_from_the_corpus():
+    df, total, errors = process_userSearchQueries_in_htmlFormat(BytesIO(corpus()))
+
+    assert (total, errors) == (7, 1)
+
+    searched = df[df.action == 'Searched']
+    assert list(zip(searched.time, searched.title)) == SEARCHES
+    assert set(searched.titleUrl) == {'NA'}
+
+    visited = df[df.action == 'Visited']
+    assert list(zip(visited.time, visited.title, visited.titleUrl)) == VISITS
+
+
+@pytest.mark.parametrize('read_size', [1, 7, 100, 1024 * 1024])
+def test_blocks_split_across_reads_are_cut_the_same(read_size):
+    blocks = list(iter_search_blocks(BytesIO(corpus()), read_size=read_size))
+
+    assert len(blocks) == 7
+    assert blocks == list(iter_search_blocks(BytesIO(corpus())))
+
+
+@pytest.mark.parametrize('read_size', [100, 1024 * 1024])
+def test_bounded_mode_skips_blocks_past_the_limit(read_size):
+    html = corpus().decode('utf-8')
+
+    # pad the second block far past the limit. small reads drop it before it closes, large ones once it has
+    padded = html.replace('Seattle forecast', 'Seattle forecast' + ' ' * 20000, 1)
+
+    blocks = list(iter_search_blocks(BytesIO(padded.encode('utf-8')), read_size=read_size, max_block_size=5000))
+    assert [b is None for b in blocks] == [False, True, False, False, False, False, False]
+
+    df, total, errors = process_userSearchQueries_in_htmlFormat(BytesIO(padded.encode('utf-8')), max_block_size=5000)
+
+    assert (total, errors) == (7, 2)
+    assert list(df[df.action == 'Searched'].title) == [s[1] for s in SEARCHES]
+    assert list(df[df.action == 'Visited'].title) == ['Egg - Wikipedia']
+
+    # without the limit the padded block is parsed
+    df, total, errors = process_userSearchQueries_in_htmlFormat(BytesIO(padded.encode('utf-8')))
+    assert (total, errors) == (7, 1)
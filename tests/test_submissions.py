@@ -0,0 +1,166 @@
+"""consent submissions. these need the Flask pinned in requirements.txt and skip on a newer one
+
+tests/bench_submissions.py runs the same load without Flask and reports latency and forks, e.g.
+
+    python3 tests/bench_submissions.py --submits 500
+"""
+from multiprocessing.dummy import Pool as TPool
+import os
+from threading import Event
+import time
+
+import numpy as np
+import pytest
+
+# the consent web app needs the Flask that oauth2client's flask utilities were written for
+pytest.importorskip('oauth2client.contrib.flask_util', exc_type=ImportError)
+
+from oauth2client.client import OAuth2Credentials  # noqa: E402
+
+import app  # noqa: E402
+from app import search_consent  # noqa: E402
+from app.search_consent import crud  # noqa: E402
+from app.search_consent.submissions import respond, SubmissionQueue  # noqa: E402
+
+"""forks made by the test process"""
+FORKS = []
+os.register_at_fork(before=lambda: FORKS.append(1))
+
+SCOPES = [
+    'https://www.googleapis.com/auth/drive.readonly',
+    'https://www.googleapis.com/auth/userinfo.email',
+    'https://www.googleapis.com/auth/userinfo.profile'
+]
+
+
+class HeldWrites(object):
+    """an add_task that holds every write until released"""
+
+    def __init__(self):
+        self.started = Event()
+        self.released = Event()
+        self.written = []
+
+    def __call__(self, data):
+        self.started.set()
+        self.released.wait(10)
+        self.written.append(data['study_id'])
+
+
+@pytest.fixture
+def web():
+    return search_consent.create_app(app.config, ssl=False, testing=True, config_overrides={
+        'GOOGLE_OAUTH2_CLIENT_ID': 'x',
+        'GOOGLE_OAUTH2_CLIENT_SECRET': 'x'
+    })
+
+
+def signed_in(web):
+    """a test client with the session of a participant who granted the scopes the consent form asks for"""
+    credentials = OAuth2Credentials(
+        'x', 'x', 'x', 'x', None, 'https://oauth2.googleapis.com/token', None, scopes=SCOPES
+    )
+
+    client = web.test_client()
+    with client.session_transaction() as s:
+        s['google_oauth2_credentials'] = credentials.to_json()
+        s['profile'] = {'emails': [{'value': 'p@example.com'}], 'name': {'givenName': 'p', 'familyName': 'q'}}
+
+    return client
+
+
+def test_submit_refuses_submissions_past_the_queue_size():
+    writes = HeldWrites()
+    queue = SubmissionQueue(size=1, workers=1, add_task=writes)
+
+    assert queue.submit({'study_id': 's1'})
+    assert writes.started.wait(10)
+
+    assert queue.submit({'study_id': 's2'})
+    assert not queue.submit({'study_id': 's3'})
+
+    body, status, headers = respond(queue, {'study_id': 's4'}, retry_after=7)
+    assert status == 503
+    assert headers == {'Retry-After': '7'}
+
+    writes.released.set()
+    queue.drain(10)
+
+    assert writes.written == ['s1', 's2']
+    assert respond(queue, {'study_id': 's5'}) == 'task submitted'
+
+
+def test_download_answers_a_full_queue_with_503_and_retry_after(web, monkeypatch):
+    writes = HeldWrites()
+    monkeypatch.setattr(crud, 'SUBMISSIONS', SubmissionQueue(size=1, workers=1, add_task=writes))
+    client = signed_in(web)
+
+    assert client.post('/consent/download', data={'study_id': 's1'}).status_code == 200
+    assert writes.started.wait(10)
+    assert client.post('/consent/download', data={'study_id': 's2'}).status_code == 200
+
+    refused = client.post('/consent/download', data={'study_id': 's3'})
+    assert refused.status_code == 503
+    assert refused.headers['Retry-After'] == str(app.config.SUBMISSION_RETRY_AFTER)
+
+    writes.released.set()
+    crud.SUBMISSIONS.drain(10)
+    assert writes.written == ['s1', 's2']
+
+
+def test_download_under_load_writes_every_accepted_submission(web, monkeypatch):
+    size, workers, n = 10, 2, 200
+
+    writes = HeldWrites()
+    monkeypatch.setattr(crud, 'SUBMISSIONS', SubmissionQueue(size=size, workers=workers, add_task=writes))
+
+    def post(i):
+        response = signed_in(web).post('/consent/download', data={'study_id': f's{i}'})
+        return response.status_code, response.headers.get('Retry-After')
+
+    pool = TPool(50)
+    responses = pool.map(post, range(n))
+    pool.close()
+    pool.join()
+
+    accepted = [r for r in responses if r[0] == 200]
+    refused = [r for r in responses if r[0] == 503]
+
+    # each worker holds one submission and the queue the rest, every other one is refused instead of waiting
+    assert size <= len(accepted) <= size + workers
+    assert len(accepted) + len(refused) == n
+    assert all([r[1] == str(app.config.SUBMISSION_RETRY_AFTER) for r in refused])
+
+    writes.released.set()
+    crud.SUBMISSIONS.drain(10)
+    assert len(writes.written) == len(accepted)
+
+
+def test_concurrent_submits_answer_quickly_without_forking():
+    size, workers, n = 100, 2, 500
+
+    writes = HeldWrites()
+    queue = SubmissionQueue(size=size, workers=workers, add_task=writes)
+    forks = len(FORKS)
+
+    def timed(i):
+        start = time.perf_counter()
+        response = respond(queue, {'study_id': f's{i}'})
+        return time.perf_counter() - start, response
+
+    pool = TPool(n)
+    results = pool.map(timed, range(n))
+    pool.close()
+    pool.join()
+
+    latencies = [r[0] for r in results]
+    accepted = [r for r in results if r[1] == 'task submitted']
+
+    # submits never wait on the database or a new process, so even the slowest answer well under a second
+    assert np.percentile(latencies, 99) < 1.
+    assert len(FORKS) == forks
+    assert size <= len(accepted) <= size + workers
+
+    writes.released.set()
+    queue.drain(10)
+    assert len(writes.written) == len(accepted)
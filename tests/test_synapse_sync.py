@@ -0,0 +1,147 @@
+from threading import Event, Thread
+
+import pytest
+
+import app.context as ctx
+from app.retry import SYNAPSE
+from app.synapse_sync import WriteBehindBuffer
+
+from fakes import FakeSynapse, http_error
+from test_engines import in_child
+
+
+def row(internal_id, notes='none', study_id='s'):
+    return [study_id, internal_id, '01JAN2019 PST 00:00:00', None, None, notes]
+
+
+@pytest.fixture
+def syn():
+    return FakeSynapse()
+
+
+@pytest.fixture
+def buffer(syn):
+    return WriteBehindBuffer(syn, 'syn1')
+
+
+def test_flush_collapses_updates_per_consent(syn, buffer):
+    for notes in ('a', 'b', 'c'):
+        buffer.stage(row(1, notes))
+    buffer.stage(row(2))
+
+    assert len(buffer) == 2
+    assert buffer.flush() == 2
+    assert len(buffer) == 0
+
+    assert syn.calls['store'] == 1
+    assert syn.values()[('s', '1')][-1] == 'c'
+
+
+def test_flush_updates_known_rows_in_one_partial_rowset(syn, buffer):
+    buffer.stage(row(1))
+    buffer.stage(row(2))
+    buffer.flush()
+
+    stores = syn.calls['store']
+    queries = syn.calls['tableQuery']
+
+    buffer.stage(row(1, 'x'))
+    buffer.stage(row(2, 'y'))
+    assert buffer.flush() == 2
+
+    # appended rows were indexed from the row references, so the update needs no lookup
+    assert syn.calls['tableQuery'] == queries
+    assert syn.calls['store'] == stores + 1
+    assert len(syn.rows) == 2
+    assert [v[-1] for v in syn.values().values()] == ['x', 'y']
+
+
+def test_flush_retries_server_errors(syn, buffer):
+    retries = SYNAPSE.retries
+    syn.failures = [http_error(503)]
+
+    buffer.stage(row(1))
+    assert buffer.flush() == 1
+
+    assert SYNAPSE.retries == retries + 1
+    assert ('s', '1') in syn.values()
+
+
+def test_failed_flush_stages_rows_again(syn, buffer):
+    syn.failures = [http_error(400)]
+
+    buffer.stage(row(1, 'old'))
+    with pytest.raises(Exception):
+        buffer.flush()
+
+    assert len(buffer) == 1
+    assert len(syn.rows) == 0
+
+    # a newer state staged before the next flush wins over the one put back
+    buffer.stage(row(1, 'new'))
+    assert buffer.flush() == 1
+    assert syn.values()[('s', '1')][-1] == 'new'
+
+
+def test_update_conflict_refreshes_the_row_index(syn, buffer):
+    buffer.stage(row(1))
+    buffer.flush()
+
+    # the row was replaced by another writer, so the indexed row id is stale
+    syn.rows[7] = syn.rows.pop(1)
+
+    buffer.stage(row(1, 'after'))
+    assert buffer.flush() == 1
+
+    assert buffer.index.get(('s', '1'))[0] == 7
+    assert syn.values()[('s', '1')][-1] == 'after'
+
+
+def test_update_conflict_appends_rows_that_were_deleted(syn, buffer):
+    buffer.stage(row(1))
+    buffer.stage(row(2))
+    buffer.flush()
+
+    # another writer deleted one of the rows, so its update conflicts and it has to be appended again
+    deleted = buffer.index.get(('s', '1'))[0]
+    del syn.rows[deleted]
+
+    buffer.stage(row(1, 'after'))
+    buffer.stage(row(2, 'after'))
+    assert buffer.flush() == 2
+
+    assert len(syn.rows) == 2
+    assert buffer.index.get(('s', '1'))[0] != deleted
+    assert [v[-1] for v in syn.values().values()] == ['after', 'after']
+
+
+def test_forked_child_drops_rows_staged_by_the_parent():
+    buffer = ctx.SYNAPSE_BUFFER
+    buffer.stage(row(1, 'parent'))
+
+    # another thread holds the buffer's lock while the process forks
+    held, release = Event(), Event()
+
+    def hold():
+        with buffer._WriteBehindBuffer__lock:
+            held.set()
+            release.wait()
+
+    t = Thread(target=hold)
+    t.start()
+    held.wait()
+
+    def child():
+        staged = len(buffer)
+        buffer.stage(row(2, 'child'))
+        return staged, len(buffer)
+
+    try:
+        assert in_child(child) == (0, 1)
+    finally:
+        release.set()
+        t.join()
+
+    # the parent still writes the row it staged
+    assert len(buffer) == 1
+    buffer.flush()
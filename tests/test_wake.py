@@ -0,0 +1,74 @@
+import pytest
+from sqlalchemy.dialects import postgresql
+
+import app.config as secrets
+import app.context as ctx
+from app.wake import NOTIFY, WakeListener, notify
+
+
+@pytest.fixture
+def engine(conn, monkeypatch):
+    monkeypatch.setattr(secrets, 'WAKE_PORT', 47753)
+    monkeypatch.setattr(secrets, 'ARCHIVE_AGENT_WORKERS', 2)
+    return ctx.get_engine(conn)
+
+
+def test_notify_wakes_every_worker(engine):
+    listeners = [WakeListener(engine, slot=i) for i in range(2)]
+
+    try:
+        assert all([l.listening for l in listeners])
+
+        notify(engine)
+        assert all([l.wait(1.) for l in listeners])
+
+        # the burst was drained, so the next wait times out
+        assert not any([l.wait(.05) for l in listeners])
+    finally:
+        for l in listeners:
+            l.close()
+
+
+def test_wait_sleeps_without_a_listener(engine):
+    taken = WakeListener(engine)
+    listener = WakeListener(engine)
+
+    try:
+        assert not listener.listening
+        assert listener.error is not None
+        assert not listener.wait(.01)
+    finally:
+        taken.close()
+        listener.close()
+
+
+def test_notify_statement_is_valid_postgres():
+    assert str(NOTIFY.compile(dialect=postgresql.dialect())) == "SELECT pg_notify(%(channel)s, '')"
+
+
+def test_notify_wakes_a_postgres_listener(postgres):
+    engine = ctx.get_engine(postgres)
+    listener = WakeListener(engine)
+
+    try:
+        assert listener.listening, listener.error
+
+        assert notify(engine) is None
+        assert listener.wait(5.)
+        assert not listener.wait(.05)
+    finally:
+        listener.close()
+
+
+def test_failed_notify_is_logged(engine, monkeypatch):
+    monkeypatch.setattr(secrets, 'WAKE_PORT', -1)
+
+    assert notify(engine) is not None
+
+    ctx.wake_workers(engine)
+    ctx.flush_logs()
+
+    with ctx.session_scope(secrets.DATABASE) as s:
+        logs = [l.msg for l in s.query(ctx.LogEntry).filter(ctx.LogEntry.cid == None)]
+
+    assert any([m.startswith('waking archive agent workers failed with <') for m in logs])
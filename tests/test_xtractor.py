@@ -0,0 +1,157 @@
+from io import BytesIO
+import datetime as dt
+import gc
+import glob
+import json
+import os
+import time
+from zipfile import ZipFile
+
+import pandas as pd
+import pytest
+
+import app.config as secrets
+import app.context as ctx
+from app.xtractor import normalize_timestamps, parse_timestamp_slow, remove_downloads, sweep_downloads, \
+    TakeOutExtractor
+
+LOCATIONS = 'Takeout/Location History/Location History.json'
+
+
+def archive(path, members):
+    with ZipFile(path, 'w') as z:
+        for name, content in members.items():
+            z.writestr(name, content)
+    return str(path)
+
+
+def location_history(n):
+    return json.dumps({'locations': [
+        {'timestampMs': str(1546300800000 + 60000 * i), 'latitudeE7': 476062000, 'longitudeE7': -1223321000}
+        for i in range(n)
+    ]})
+
+
+@pytest.fixture
+def consent(conn):
+    with ctx.session_scope(conn) as s:
+        c = ctx.add_entity(s, ctx.Consent(study_id='s1', consent_dt=dt.datetime(2019, 1, 1)))
+        yield c
+
+
+def test_location_csvs_of_finished_parts_are_removed_when_another_part_fails(consent, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    good = archive(tmp_path / 'takeout-001.zip', {LOCATIONS: location_history(10)})
+    x = TakeOutExtractor(consent, archive_path=good)
+    assert x.load_from_local()
+
+    # a second part that is not a zip archive at all
+    x._TakeOutExtractor__add_part(BytesIO(b'not a zip archive'))
+
+    assert not x.extract_gps()
+    assert x.cleaned_gps_file is None
+
+    # the csv written from the good part is still tracked and goes with the extractor
+    assert len(glob.glob(str(tmp_path / 'locations-*.csv'))) == 1
+    del x
+    gc.collect()
+    assert len(glob.glob(str(tmp_path / 'locations-*.csv'))) == 0
+
+
+def test_location_csvs_of_parts_scanned_before_a_failed_download_are_removed(consent, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    good = archive(tmp_path / 'takeout-001.zip', {LOCATIONS: location_history(10)})
+    x = TakeOutExtractor(consent, archive_path=good)
+    assert x.load_from_local()
+
+    # the task gives up before the scanned members are ever read
+    del x
+    gc.collect()
+    assert len(glob.glob(str(tmp_path / 'locations-*.csv'))) == 0
+
+
+def touch(directory, *names):
+    for name in names:
+        (directory / name).write_bytes(b'')
+
+
+def test_remove_downloads_keeps_other_consents_and_current_parts(tmp_path, monkeypatch):
+    monkeypatch.setattr(secrets, 'ARCHIVE_AGENT_TMP_DIR', str(tmp_path))
+    touch(tmp_path, 'takeout-1-old.zip', 'takeout-1-old.zip.manifest', 'takeout-1-new.zip', 'takeout-12-old.zip',
+          'notes.txt')
+
+    assert remove_downloads(1, keep=['new']) == 2
+    assert sorted(os.listdir(tmp_path)) == ['notes.txt', 'takeout-1-new.zip', 'takeout-12-old.zip']
+
+
+def test_sweep_removes_downloads_no_consent_will_resume(conn, tmp_path, monkeypatch):
+    downloads = tmp_path / 'downloads'
+    downloads.mkdir()
+    monkeypatch.setattr(secrets, 'ARCHIVE_AGENT_TMP_DIR', str(downloads))
+
+    ids = {}
+    with ctx.session_scope(conn) as s:
+        for status in ctx.ConsentStatus:
+            c = ctx.add_entity(s, ctx.Consent(study_id=status.value, consent_dt=dt.datetime(2019, 1, 1)))
+            c.status = status.value
+            ids[status] = c.internal_id
+        s.commit()
+
+    touch(downloads, *[f'takeout-{i}-t.zip.manifest' for i in ids.values()], 'takeout-999-t.zip')
+
+    # an old download of a waiting consent has outlived MAX_TIME_FOR_DRIVE_WAIT
+    old = str(downloads / 'takeout-{}-old.zip'.format(ids[ctx.ConsentStatus.DRIVE_NOT_READY]))
+    touch(downloads, os.path.basename(old))
+    os.utime(old, (time.time() - secrets.MAX_TIME_FOR_DRIVE_WAIT - 60,) * 2)
+
+    assert sweep_downloads(conn) == 4
+    assert sorted(os.listdir(downloads)) == sorted([
+        f'takeout-{ids[status]}-t.zip.manifest'
+        for status in (ctx.ConsentStatus.READY, ctx.ConsentStatus.PROCESSING, ctx.ConsentStatus.DRIVE_NOT_READY)
+    ])
+
+
+def utc(*args):
+    return pd.Timestamp(dt.datetime(*args), tz='UTC')
+
+
+@pytest.mark.parametrize('times, fmt, expected', [
+    (['Jan 2, 2019, 9:00:00 AM PST', 'Jan 12, 2019, 11:00:00 PM PDT', 'Jan 2, 2019, 1:05:09 PM'], 'activity-12h',
+     [utc(2019, 1, 2, 17), utc(2019, 1, 13, 6), utc(2019, 1, 2, 13, 5, 9)]),
+    (['Jan 2, 2019, 9:00:00 AM GMT-07:00', 'Jan 2, 2019, 11:00:00 AM GMT-07:00'], 'activity-12h',
+     [utc(2019, 1, 2, 16), utc(2019, 1, 2, 18)]),
+    (['2 Jan 2019, 9:00:00 CET', '12 Jan 2019, 19:00:00 GMT+05:30'], 'activity-24h',
+     [utc(2019, 1, 2, 8), utc(2019, 1, 12, 13, 30)]),
+    (['2019-01-02T09:00:00.000Z', '2019-01-02T16:30:00.123Z'], 'iso8601',
+     [utc(2019, 1, 2, 9), utc(2019, 1, 2, 16, 30, 0, 123000)]),
+])
+def test_normalize_timestamps_parses_every_row_on_the_vectorized_path(times, fmt, expected):
+    parsed, name, slow = normalize_timestamps(pd.Series(times))
+
+    assert name == fmt
+    assert slow == 0
+    assert list(parsed) == expected
+
+
+def test_normalize_timestamps_falls_back_for_other_formats():
+    parsed, name, slow = normalize_timestamps(pd.Series([
+        'Jan 2, 2019, 9:00:00 AM PST', '2019-01-02T09:00:00-07:00', 'Jan 2, 2019, 9:00:00 AM GMT-07:00 (MST)', None,
+        'not a time'
+    ]))
+
+    assert name == 'activity-12h'
+    assert slow == 3
+    assert list(parsed[:3]) == [utc(2019, 1, 2, 17), utc(2019, 1, 2, 16), utc(2019, 1, 2, 16)]
+    assert parsed[3:].isnull().all()
+
+
+@pytest.mark.parametrize('s, expected', [
+    ('Jan 2, 2019, 9:00:00 AM GMT-07:00', utc(2019, 1, 2, 16)),
+    ('2 Jan 2019, 9:00:00 GMT+05:30', utc(2019, 1, 2, 3, 30)),
+    ('Jan 2, 2019, 9:00:00 AM PST', utc(2019, 1, 2, 17)),
+    ('2019-01-02 09:00:00', utc(2019, 1, 2, 9)),
+])
+def test_parse_timestamp_slow_applies_zones_like_the_vectorized_path(s, expected):
+    assert parse_timestamp_slow(s) == expected